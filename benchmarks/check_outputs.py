@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+"""
+Check the output modes of MPA on a synthetic annotated vcf: processes,
+pipeline, regions, byte ranges, score cache, BCF, split alleles, sort, summary
+per gene, trace and service must give the same variants and MPA fields as the
+serial raw engine. Exit with status 1 if a mode differs.
+"""
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import sys
+import json
+import gzip
+import shutil
+import argparse
+import tempfile
+import threading
+import itertools
+import collections
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPOSITORY_DIR)
+
+import pysam                          # noqa: E402
+from mobidic_mpa import raw           # noqa: E402
+from mobidic_mpa import bcf           # noqa: E402
+from mobidic_mpa import filters       # noqa: E402
+from mobidic_mpa import server        # noqa: E402
+from mobidic_mpa import summary       # noqa: E402
+import generate_vcf                   # noqa: E402
+import run_benchmarks                 # noqa: E402
+import service_latency                # noqa: E402
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Keys compared between outputs
+MPA_KEYS = run_benchmarks.MPA_KEYS
+
+# Relative tolerance of Float fields read from BCF (32-bit floats)
+BCF_TOLERANCE = 1e-5
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def mpa(path, output, *options):
+    """
+    @summary: Run the mpa script with the raw engine
+    @param path: [str] The path of the input
+    @param output: [str] The path of the output
+    @param options: [list] The other options of the script
+    """
+    run_benchmarks.run([
+        sys.executable, run_benchmarks.MPA_SCRIPT, "-r", "-p", "-l",
+        "WARNING", "--engine", "raw", "-i", path, "-o", output
+    ] + list(options))
+
+
+def read_text(path):
+    """
+    @summary: Read a vcf as text (plain or gzipped)
+    @param path: [str] The path of the vcf
+    @return: [str] The text
+    """
+    with raw.open_vcf(path) as stream:
+        return stream.read()
+
+
+def read_body(path):
+    """
+    @summary: Read the variant lines of a vcf (plain or gzipped)
+    @param path: [str] The path of the vcf
+    @return: [list] The raw variant lines
+    """
+    with raw.open_vcf(path) as stream:
+        return list(raw.iter_body(stream))
+
+
+def mpa_entries(line):
+    """
+    @summary: Read the raw MPA fields of a vcf line
+    @param line: [str] The raw vcf line
+    @return: [dict] The raw value of each MPA field
+    """
+    info = line.split("\t", 8)[7]
+    return {key: raw.find_info_value(info, key + "=") for key in MPA_KEYS}
+
+
+def mpa_fields(line):
+    """
+    @summary: Read the MPA fields of a vcf line with the types of \
+        score_annotations (MPA_ranking is an int, MPA_impact a list)
+    @param line: [str] The raw vcf line
+    @return: [OrderedDict] The MPA fields
+    """
+    fields = collections.OrderedDict(mpa_entries(line))
+    fields["MPA_ranking"] = int(fields["MPA_ranking"])
+    impacts = fields["MPA_impact"]
+    fields["MPA_impact"] = [] if impacts == "." else impacts.split(",")
+    return fields
+
+
+def text_problems(path, reference, indexed=False):
+    """
+    @summary: Compare an output with the reference text
+    @param path: [str] The path of the output (plain or gzipped)
+    @param reference: [str] The path of the reference vcf
+    @param indexed: [bool] The output must have a tabix index
+    @return: [list] The problems found
+    """
+    problems = []
+    if read_text(path) != read_text(reference):
+        differences = run_benchmarks.compare(path, reference)
+        problems.append(
+            "different records" if differences == -1 else
+            f"different text, {differences} variants with other MPA fields")
+    if indexed and not os.path.exists(path + ".tbi"):
+        problems.append("no tabix index")
+    return problems
+
+
+def fields_problems(path, reference, tolerance=0):
+    """
+    @summary: Compare the sites and MPA fields of an output with the \
+        reference
+    @param path: [str] The path of the output vcf
+    @param reference: [str] The path of the reference vcf
+    @param tolerance: [float] The relative tolerance of numeric values
+    @return: [list] The problems found
+    """
+    missing = object()
+    differences = 0
+    for found, expected in itertools.zip_longest(
+        run_benchmarks.mpa_fields(path),
+        run_benchmarks.mpa_fields(reference),
+        fillvalue=missing
+    ):
+        if found is missing or expected is missing:
+            return ["different records"]
+        differences += found[0] != expected[0] or not all(
+            _same_value(value, other, tolerance)
+            for value, other in zip(found[1], expected[1]))
+    return [f"{differences} variants differ"] if differences else []
+
+
+def _same_value(value, other, tolerance):
+    """
+    @summary: Compare two raw values (numbers within a tolerance)
+    @param value: [str] The value
+    @param other: [str] The other value
+    @param tolerance: [float] The relative tolerance of numbers
+    @return: [bool] True if the values are the same
+    """
+    if value == other:
+        return True
+    try:
+        value, other = float(value), float(other)
+    except (TypeError, ValueError):
+        return False
+    return abs(value - other) <= tolerance * max(1.0, abs(other))
+
+
+def to_bcf(path, output):
+    """
+    @summary: Convert a vcf to BCF with htslib
+    @param path: [str] The path of the vcf
+    @param output: [str] The path of the BCF
+    """
+    with bcf.quiet(), pysam.VariantFile(path) as vcf, \
+            pysam.VariantFile(output, "wb", header=vcf.header) as bcf_file:
+        for record in vcf:
+            bcf_file.write(record)
+
+
+def to_vcf(path, output):
+    """
+    @summary: Convert a BCF to a text vcf with htslib
+    @param path: [str] The path of the BCF
+    @param output: [str] The path of the vcf
+    """
+    with bcf.quiet(), pysam.VariantFile(path) as bcf_file, \
+            open(output, "w") as vcf:
+        vcf.write(str(bcf_file.header))
+        for record in bcf_file:
+            vcf.write(str(record))
+
+
+def write_multiallelic(path, multiallelic, expected):
+    """
+    @summary: Merge pairs of SNV of a vcf in multi-allelic variants (with \
+        one ANNOVAR block per allele, as annovar writes them), and write the \
+        biallelic variants expected after their split (without samples)
+    @param path: [str] The path of the synthetic vcf
+    @param multiallelic: [str] The path of the multi-allelic vcf
+    @param expected: [str] The path of the expected biallelic vcf
+    """
+    header = [
+        line for line in generate_vcf.header_lines(1)
+        if not line.startswith("#CHROM")
+    ]
+    header.append("\t".join(
+        ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]) +
+        "\n")
+    lines = [line.split("\t")[:8] for line in read_body(path)]
+    with open(multiallelic, "w") as merged, open(expected, "w") as split:
+        merged.writelines(header)
+        split.writelines(header)
+        for first, second in itertools.zip_longest(lines[::2], lines[1::2]):
+            if second is None or len(first[3]) != 1 or len(first[4]) != 1 \
+                    or len(second[3]) != 1 or len(second[4]) != 1:
+                for columns in (first, second or []):
+                    if columns:
+                        merged.write("\t".join(columns) + "\n")
+                        split.write("\t".join(columns) + "\n")
+                continue
+            alt = next(
+                nucleotide for nucleotide in generate_vcf.NUCLEOTIDES
+                if nucleotide not in (first[3], first[4]))
+            sites, block = _split_annovar(first[7])
+            second_sites, second_block = _split_annovar(second[7])
+            second_count = second_sites[0].split("=", 1)[1]
+            merged.write("\t".join(first[:4] + [
+                first[4] + "," + alt, first[5], first[6],
+                ";".join(
+                    [sites[0] + "," + second_count] + sites[1:] +
+                    block + second_block)
+            ]) + "\n")
+            split.write("\t".join(first) + "\n")
+            split.write("\t".join(first[:4] + [
+                alt, first[5], first[6],
+                ";".join(["AC=" + second_count] + sites[1:] + second_block)
+            ]) + "\n")
+
+
+def _split_annovar(info):
+    """
+    @summary: Split an INFO column of the synthetic vcf in its site entries \
+        (AC first) and its ANNOVAR block
+    @param info: [str] The raw INFO column
+    @return: [tuple] The site entries and the ANNOVAR entries
+    """
+    entries = info.split(";")
+    start = next(
+        i for i, entry in enumerate(entries)
+        if entry.startswith("ANNOVAR_DATE="))
+    return entries[:start], entries[start:]
+
+
+def expected_summary(reference, output, top=summary.TOP):
+    """
+    @summary: Build the summary per gene of the reference vcf
+    @param reference: [str] The path of the reference vcf
+    @param output: [str] The path of the summary
+    @param top: [int] The number of top variants kept per gene
+    """
+    gene_summary = summary.GeneSummary(top)
+    for _ in summary.summarized_lines(
+        ((line, mpa_fields(line)) for line in read_body(reference)),
+        gene_summary,
+        filters.gene_key(True) + "="
+    ):
+        pass
+    gene_summary.write(output)
+
+
+def check_sort(path, reference, tmp_dir):
+    """
+    @summary: Check the external sort (with runs spilled to files)
+    @param path: [str] The path of the input vcf
+    @param reference: [str] The path of the reference vcf
+    @param tmp_dir: [str] The directory of outputs
+    @return: [list] The problems found
+    """
+    output = os.path.join(tmp_dir, "sorted.vcf")
+    mpa(path, output, "--sort", "--sort-memory", "1")
+    lines = read_body(reference)
+    expected = [
+        line for _, line in sorted(
+            enumerate(lines),
+            key=lambda entry: (
+                mpa_fields(entry[1])["MPA_ranking"],
+                -filters.final_score(mpa_fields(entry[1])),
+                entry[0]
+            )
+        )
+    ]
+    return [] if read_body(output) == expected else ["different order"]
+
+
+def check_trace(path, reference, tmp_dir):
+    """
+    @summary: Check the MPA fields of the trace of all variants
+    @param path: [str] The path of the input vcf
+    @param reference: [str] The path of the reference vcf
+    @param tmp_dir: [str] The directory of outputs
+    @return: [list] The problems found
+    """
+    output = os.path.join(tmp_dir, "trace.jsonl.gz")
+    mpa(path, os.path.join(tmp_dir, "traced.vcf"), "--trace", output,
+        "--trace-rate", "1")
+    with gzip.open(output, "rt") as trace_file:
+        traces = [json.loads(line) for line in trace_file]
+    lines = read_body(reference)
+    if len(traces) != len(lines):
+        return [f"{len(traces)} variants traced of {len(lines)}"]
+    differences = 0
+    for trace, line in zip(traces, lines):
+        site = [str(trace[key]) for key in ("chrom", "pos", "id", "ref", "alt")]
+        entries = dict(
+            entry.split("=", 1)
+            for entry in raw.format_info_fields(trace["mpa_fields"]))
+        differences += (
+            site != line.split("\t", 5)[:5] or entries != mpa_entries(line))
+    return [f"{differences} variants differ"] if differences else []
+
+
+def check_service(path, reference, tmp_dir):
+    """
+    @summary: Check the MPA fields returned by the service (Unix socket)
+    @param path: [str] The path of the input vcf
+    @param reference: [str] The path of the reference vcf
+    @param tmp_dir: [str] The directory of outputs
+    @return: [list] The problems found
+    """
+    address = os.path.join(tmp_dir, "mpa.sock")
+    service = server.create_server(address, no_refseq_version=True)
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    try:
+        _, results = service_latency.client(
+            address, list(raw.batched(read_body(path), 100)))
+    finally:
+        service.shutdown()
+        service.server_close()
+        os.remove(address)
+    expected = [
+        json.loads(json.dumps(server.result(mpa_fields(line))))
+        for line in read_body(reference)
+    ]
+    if len(results) != len(expected):
+        return ["different records"]
+    differences = sum(
+        found != wanted for found, wanted in zip(results, expected))
+    return [f"{differences} variants differ"] if differences else []
+
+
+def check_outputs(path, tmp_dir):
+    """
+    @summary: Check each output mode against the serial raw engine
+    @param path: [str] The path of the input vcf (sorted, uncompressed)
+    @param tmp_dir: [str] The directory of outputs
+    @return: [generator] The name and the problems of each mode
+    """
+    def output(name):
+        return os.path.join(tmp_dir, name)
+
+    reference = output("reference.vcf")
+    mpa(path, reference)
+
+    mpa(path, output("threads.vcf"), "--threads", "2", "--batch-size", "100")
+    yield "processes", text_problems(output("threads.vcf"), reference)
+
+    mpa(path, output("pipeline.vcf"), "--pipeline")
+    yield "pipeline", text_problems(output("pipeline.vcf"), reference)
+
+    indexed = output("input.vcf.gz")
+    pysam.tabix_compress(path, indexed, force=True)
+    pysam.tabix_index(indexed, preset="vcf", force=True)
+    mpa(indexed, output("regions.vcf.gz"), "--split-by", "contig",
+        "--threads", "2")
+    yield "regions", text_problems(
+        output("regions.vcf.gz"), reference, indexed=True)
+
+    mpa(path, output("ranges.vcf.gz"), "--split-by", "bytes", "--threads",
+        "2")
+    yield "byte ranges", text_problems(
+        output("ranges.vcf.gz"), reference, indexed=True)
+
+    cache = output("cache.db")
+    mpa(path, output("cold.vcf"), "--cache", cache)
+    mpa(path, output("warm.vcf"), "--cache", cache, "--threads", "2",
+        "--batch-size", "100")
+    yield "score cache", (
+        text_problems(output("cold.vcf"), reference) +
+        text_problems(output("warm.vcf"), reference))
+
+    to_bcf(path, output("input.bcf"))
+    mpa(output("input.bcf"), output("from_bcf.vcf"))
+    mpa(path, output("output.bcf"))
+    to_vcf(output("output.bcf"), output("output.vcf"))
+    yield "BCF", (
+        fields_problems(output("from_bcf.vcf"), reference, BCF_TOLERANCE) +
+        fields_problems(output("output.vcf"), reference, BCF_TOLERANCE))
+
+    write_multiallelic(path, output("multi.vcf"), output("biallelic.vcf"))
+    mpa(output("biallelic.vcf"), output("biallelic_scored.vcf"))
+    mpa(output("multi.vcf"), output("split.vcf"), "--split-alleles")
+    yield "split alleles", fields_problems(
+        output("split.vcf"), output("biallelic_scored.vcf"))
+
+    yield "sort", check_sort(path, reference, tmp_dir)
+
+    expected_summary(reference, output("expected.tsv"))
+    problems = []
+    for name, options in (
+        ("serial", []),
+        ("regions", ["--split-by", "contig", "--threads", "2"]),
+        ("byte ranges", ["--split-by", "bytes", "--threads", "2"])
+    ):
+        mpa(indexed if name == "regions" else path,
+            output("summary.vcf.gz"), "--gene-summary",
+            output("summary.tsv"), *options)
+        with open(output("summary.tsv")) as found, \
+                open(output("expected.tsv")) as expected:
+            if found.read() != expected.read():
+                problems.append(f"different summary ({name})")
+    yield "summary per gene", problems
+
+    yield "trace", check_trace(path, reference, tmp_dir)
+
+    yield "service", check_service(path, reference, tmp_dir)
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n',
+        '--records',
+        default=5000,
+        type=int,
+        help="Number of variants of the synthetic vcf. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--seed',
+        default=1,
+        type=int,
+        help="Seed of the synthetic vcf. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--tmp-dir',
+        default=None,
+        help="Directory of the synthetic vcf and outputs. \
+        [Default: system temporary directory]"
+    )
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="mpa-check-", dir=args.tmp_dir)
+    failed = 0
+    try:
+        path = os.path.join(tmp_dir, "input.vcf")
+        with open(path, "w") as vcf:
+            generate_vcf.generate(vcf, args.records, 1, "exome", args.seed)
+        for name, problems in check_outputs(path, tmp_dir):
+            failed += bool(problems)
+            print(f"{name:<20}" + (
+                f"no ({', '.join(problems)})" if problems else "yes"),
+                flush=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    sys.exit(1 if failed else 0)
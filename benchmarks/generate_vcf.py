@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+"""
+Generate synthetic vcf annotated as annovar would do (refGene, ClinVar,
+dbNSFP, dbscSNV and SpliceAI) to benchmark MPA.
+"""
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import sys
+import random
+import argparse
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Number of variants and samples of each preset
+PRESETS = {
+    "panel": {"records": 5000, "samples": 1, "regions": "exome"},
+    "exome": {"records": 60000, "samples": 1, "regions": "exome"},
+    "genome": {"records": 5000000, "samples": 1, "regions": "genome"},
+    "wide": {"records": 20000, "samples": 200, "regions": "exome"}
+}
+
+# Contigs of hg19 (length)
+CONTIGS = [
+    ("chr1", 249250621), ("chr2", 243199373), ("chr3", 198022430),
+    ("chr4", 191154276), ("chr5", 180915260), ("chr6", 171115067),
+    ("chr7", 159138663), ("chr8", 146364022), ("chr9", 141213431),
+    ("chr10", 135534747), ("chr11", 135006516), ("chr12", 133851895),
+    ("chr13", 115169878), ("chr14", 107349540), ("chr15", 102531392),
+    ("chr16", 90354753), ("chr17", 81195210), ("chr18", 78077248),
+    ("chr19", 59128983), ("chr20", 63025520), ("chr21", 48129895),
+    ("chr22", 51304566), ("chrX", 155270560), ("chrY", 59373566)
+]
+
+# Func.refGene of variants (weights of exome and genome captures)
+FUNC = {
+    "exome": [
+        ("exonic", 42), ("intronic", 30), ("UTR3", 8), ("UTR5", 3),
+        ("splicing", 1.5), ("exonic;splicing", 0.3), ("ncRNA_exonic", 4),
+        ("ncRNA_intronic", 4), ("upstream", 2), ("downstream", 2),
+        ("intergenic", 3), ("upstream;downstream", 0.2)
+    ],
+    "genome": [
+        ("intergenic", 45), ("intronic", 38), ("ncRNA_intronic", 6),
+        ("exonic", 1.5), ("UTR3", 1.2), ("UTR5", 0.3), ("splicing", 0.05),
+        ("ncRNA_exonic", 1), ("upstream", 3), ("downstream", 3),
+        ("upstream;downstream", 0.2)
+    ]
+}
+
+# ExonicFunc.refGene of exonic SNV and indels
+EXONIC_FUNC_SNV = [
+    ("synonymous_SNV", 47), ("nonsynonymous_SNV", 48), ("stopgain", 1.5),
+    ("stoploss", 0.1), ("startloss", 0.1), ("unknown", 2)
+]
+EXONIC_FUNC_INDEL = [
+    ("frameshift_deletion", 30), ("frameshift_insertion", 20),
+    ("nonframeshift_deletion", 25), ("nonframeshift_insertion", 15),
+    ("stopgain", 3), ("unknown", 7)
+]
+
+# ClinVar significance (most variants are not in ClinVar)
+CLNSIG = [
+    (".", 80), ("Benign", 6), ("Likely_benign", 4),
+    ("Benign/Likely_benign", 3), ("Uncertain_significance", 4),
+    ("Conflicting_interpretations_of_pathogenicity", 1.5),
+    ("Pathogenic", 0.6), ("Likely_pathogenic", 0.4),
+    ("Pathogenic/Likely_pathogenic", 0.3), ("not_provided", 0.2)
+]
+
+# dbNSFP predictors (deleterious, tolerated predictions)
+PREDICTORS = [
+    ("SIFT", ["D"], ["T"]),
+    ("Polyphen2_HDIV", ["D", "P"], ["B"]),
+    ("Polyphen2_HVAR", ["D", "P"], ["B"]),
+    ("LRT", ["D"], ["N", "U"]),
+    ("MutationTaster", ["A", "D"], ["N", "P"]),
+    ("FATHMM", ["D"], ["T"]),
+    ("PROVEAN", ["D"], ["N"]),
+    ("fathmm-MKL_coding", ["D"], ["N"]),
+    ("MetaSVM", ["D"], ["T"]),
+    ("MetaLR", ["D"], ["T"])
+]
+
+# Other annotations written as annovar does (mostly missing)
+OTHER_KEYS = [
+    "cytoBand", "gnomAD_exome_ALL", "gnomAD_exome_AFR", "gnomAD_exome_NFE",
+    "gnomAD_genome_ALL", "ExAC_ALL", "1000g2015aug_all", "avsnp150",
+    "CLNALLELEID", "CLNDN", "CLNDISDB", "CLNREVSTAT", "CADD_raw",
+    "CADD_phred", "DANN_score", "GERP++_RS", "phyloP100way_vertebrate",
+    "Interpro_domain"
+]
+
+NUCLEOTIDES = "ACGT"
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def _choice(rng, weighted):
+    """
+    @summary: Draw a value from weighted choices
+    @param rng: [random.Random] The random generator
+    @param weighted: [list] The (value, weight) choices
+    @return: [str] The value
+    """
+    return rng.choices(
+        [value for value, _ in weighted],
+        [weight for _, weight in weighted]
+    )[0]
+
+
+def _escape(value):
+    """
+    @summary: Escape an annotation as annovar does
+    @param value: [str] The annotation
+    @return: [str] The escaped annotation
+    """
+    return value.replace(";", "\\x3b").replace("=", "\\x3d").replace(
+        ",", "\\x2c")
+
+
+def header_lines(samples):
+    """
+    @summary: Build the header of the synthetic vcf
+    @param samples: [int] The number of samples
+    @return: [list] The header lines
+    """
+    lines = [
+        "##fileformat=VCFv4.2",
+        '##FILTER=<ID=PASS,Description="All filters passed">',
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+        '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">',
+        '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+        '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype '
+        'quality">',
+        '##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count">',
+        '##INFO=<ID=AN,Number=1,Type=Integer,Description="Allele number">',
+        '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">',
+        '##INFO=<ID=ANNOVAR_DATE,Number=1,Type=String,Description="Flag the '
+        'start of ANNOVAR annotation for one alternative allele">'
+    ]
+    keys = [
+        "Func.refGene", "Gene.refGene", "GeneDetail.refGene",
+        "ExonicFunc.refGene", "AAChange.refGene"
+    ] + OTHER_KEYS[:1] + ["CLNSIG"] + OTHER_KEYS[1:]
+    for name, _, _ in PREDICTORS:
+        keys += [f"{name}_score", f"{name}_rankscore", f"{name}_pred"]
+    keys += ["dbscSNV_ADA_SCORE", "dbscSNV_RF_SCORE", "spliceai_filtered"]
+    for key in keys:
+        lines.append(
+            f'##INFO=<ID={key},Number=.,Type=String,Description="{key} '
+            'annotation provided by ANNOVAR">')
+    lines.append(
+        '##INFO=<ID=ALLELE_END,Number=0,Type=Flag,Description="Flag the end '
+        'of ANNOVAR annotation for one alternative allele">')
+    for contig, length in CONTIGS:
+        lines.append(f"##contig=<ID={contig},length={length}>")
+    lines.append("\t".join(
+        ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+         "FORMAT"] +
+        [f"sample{i + 1}" for i in range(samples)]
+    ))
+    return [line + "\n" for line in lines]
+
+
+def _alleles(rng, is_indel):
+    """
+    @summary: Draw the reference and alternative alleles of a variant
+    @param rng: [random.Random] The random generator
+    @param is_indel: [bool] Draw an indel
+    @return: [tuple] REF, ALT
+    """
+    ref = rng.choice(NUCLEOTIDES)
+    if not is_indel:
+        return ref, rng.choice(NUCLEOTIDES.replace(ref, ""))
+    inserted = "".join(
+        rng.choice(NUCLEOTIDES) for _ in range(rng.choice([1, 1, 2, 3, 4])))
+    if rng.random() < 0.6:
+        return ref + inserted, ref
+    return ref, ref + inserted
+
+
+def _missing_predictions(name):
+    """
+    @summary: dbNSFP annotations of a predictor without prediction
+    @param name: [str] The predictor
+    @return: [list] The INFO entries
+    """
+    return [f"{name}_score=.", f"{name}_rankscore=.", f"{name}_pred=."]
+
+
+def _predictions(rng, info):
+    """
+    @summary: Add dbNSFP predictions of a missense variant (predictors agree \
+        more often than not)
+    @param rng: [random.Random] The random generator
+    @param info: [list] The INFO entries
+    """
+    damaging = rng.betavariate(0.7, 0.9)
+    for name, deleterious, tolerated in PREDICTORS:
+        if rng.random() < 0.1:
+            info += _missing_predictions(name)
+            continue
+        score = rng.random()
+        pred = rng.choice(
+            deleterious if rng.random() < damaging else tolerated)
+        info += [
+            f"{name}_score={score:.3f}",
+            f"{name}_rankscore={rng.random():.5f}",
+            f"{name}_pred={pred}"
+        ]
+
+
+def _spliceai(rng, gene):
+    """
+    @summary: Draw a SpliceAI annotation (delta scores are mostly low)
+    @param rng: [random.Random] The random generator
+    @param gene: [str] The gene symbol
+    @return: [str] The escaped spliceai_filtered annotation
+    """
+    scores = [min(1.0, rng.expovariate(12)) for _ in range(4)]
+    if rng.random() < 0.03:
+        scores[rng.randrange(4)] = rng.uniform(0.2, 1.0)
+    entry = ";".join([f"ALLELE={rng.choice(NUCLEOTIDES)}", f"SYMBOL={gene}"] +
+                     [f"DS_{t}={s:.2f}"
+                      for t, s in zip(("AG", "AL", "DG", "DL"), scores)] +
+                     [f"DP_{t}={rng.randint(-50, 50)}"
+                      for t in ("AG", "AL", "DG", "DL")])
+    return _escape(entry)
+
+
+def _genotypes(rng, samples):
+    """
+    @summary: Draw the genotypes of the samples
+    @param rng: [random.Random] The random generator
+    @param samples: [int] The number of samples
+    @return: [list] The FORMAT column and the sample columns
+    """
+    columns = ["GT:AD:DP:GQ"]
+    for _ in range(samples):
+        gt = _choice(rng, [("0/0", 50), ("0/1", 30), ("1/1", 15), ("./.", 5)])
+        if gt == "./.":
+            columns.append("./.:.:.:.")
+            continue
+        depth = rng.randint(8, 250)
+        alt = {"0/0": 0, "0/1": depth // 2, "1/1": depth}[gt]
+        columns.append(
+            f"{gt}:{depth - alt},{alt}:{depth}:{rng.randint(20, 99)}")
+    return columns
+
+
+def record_line(rng, contig, pos, regions, samples):
+    """
+    @summary: Draw one annotated variant
+    @param rng: [random.Random] The random generator
+    @param contig: [str] The contig
+    @param pos: [int] The position
+    @param regions: [str] The distribution of Func.refGene ("exome" or \
+        "genome")
+    @param samples: [int] The number of samples
+    @return: [str] The vcf line
+    """
+    is_indel = rng.random() < 0.12
+    ref, alt = _alleles(rng, is_indel)
+    func = _choice(rng, FUNC[regions])
+    gene = f"GENE{rng.randrange(20000)}"
+    exonic_func = "."
+    aa_change = "."
+    if func.startswith("exonic"):
+        exonic_func = _choice(
+            rng, EXONIC_FUNC_INDEL if is_indel else EXONIC_FUNC_SNV)
+        aa_change = _escape(
+            f"{gene}:NM_{rng.randrange(10 ** 6):06d}:exon{rng.randint(1, 40)}"
+            f":c.{rng.randint(1, 5000)}{ref}>{alt}")
+
+    info = [
+        f"AC={rng.randint(1, 2 * samples)}",
+        f"AN={2 * samples}",
+        f"DP={rng.randint(10, 300 * samples)}",
+        "ANNOVAR_DATE=2018-04-16",
+        f"Func.refGene={_escape(func)}",
+        f"Gene.refGene={gene}",
+        "GeneDetail.refGene=.",
+        f"ExonicFunc.refGene={exonic_func}",
+        f"AAChange.refGene={aa_change}",
+        f"cytoBand={rng.randint(1, 22)}p{rng.randint(11, 36)}",
+        f"CLNSIG={_choice(rng, CLNSIG)}"
+    ]
+    for key in OTHER_KEYS[1:]:
+        info.append(
+            f"{key}={rng.random():.4g}" if rng.random() < 0.3 else f"{key}=.")
+
+    if exonic_func == "nonsynonymous_SNV":
+        _predictions(rng, info)
+    else:
+        for name, _, _ in PREDICTORS:
+            info += _missing_predictions(name)
+
+    # dbscSNV only covers SNV close to splice sites
+    if not is_indel and func in ("splicing", "exonic", "intronic") and \
+            rng.random() < 0.08:
+        ada = min(1.0, rng.expovariate(4))
+        info += [
+            f"dbscSNV_ADA_SCORE={ada:.4f}",
+            f"dbscSNV_RF_SCORE={min(1.0, ada * rng.uniform(0.5, 1.5)):.3f}"
+        ]
+    else:
+        info += ["dbscSNV_ADA_SCORE=.", "dbscSNV_RF_SCORE=."]
+
+    info.append("spliceai_filtered=" + (
+        _spliceai(rng, gene) if rng.random() < 0.35 else "."))
+    info.append("ALLELE_END")
+
+    return "\t".join([
+        contig, str(pos), ".", ref, alt,
+        f"{rng.uniform(30, 3000):.2f}", "PASS", ";".join(info)
+    ] + _genotypes(rng, samples)) + "\n"
+
+
+def generate(output, records, samples=1, regions="exome", seed=1):
+    """
+    @summary: Write a synthetic annotated vcf (variants are sorted)
+    @param output: [file] The text stream of the output
+    @param records: [int] The number of variants
+    @param samples: [int] The number of samples
+    @param regions: [str] The distribution of Func.refGene ("exome" or \
+        "genome")
+    @param seed: [int] The seed of the random generator
+    """
+    rng = random.Random(seed)
+    output.writelines(header_lines(samples))
+
+    total_length = sum(length for _, length in CONTIGS)
+    written = 0
+    for i, (contig, length) in enumerate(CONTIGS):
+        # Variants are spread over contigs in proportion to their length
+        if i == len(CONTIGS) - 1:
+            count = records - written
+        else:
+            count = round(records * length / total_length)
+        count = min(count, records - written)
+        written += count
+        for pos in sorted(rng.sample(range(1, length), count)):
+            output.write(record_line(rng, contig, pos, regions, samples))
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-p',
+        '--preset',
+        default="exome",
+        choices=sorted(PRESETS),
+        help="Size of the vcf. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '-n',
+        '--records',
+        type=int,
+        help="Number of variants (overrides the preset)."
+    )
+    parser.add_argument(
+        '-s',
+        '--samples',
+        type=int,
+        help="Number of samples (overrides the preset)."
+    )
+    parser.add_argument(
+        '--seed',
+        default=1,
+        type=int,
+        help="Seed of the random generator. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        default="-",
+        help="The output vcf ('-' for the standard output). \
+        [Default: %(default)s]"
+    )
+    args = parser.parse_args()
+
+    preset = PRESETS[args.preset]
+    with (
+        sys.stdout if args.output == "-" else open(args.output, "w")
+    ) as output:
+        generate(
+            output,
+            args.records or preset["records"],
+            args.samples or preset["samples"],
+            preset["regions"],
+            args.seed
+        )
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+"""
+Measure the time to import mobidic_mpa (best of several fresh interpreters)
+and check it against a budget: importing the package must not load vcfpy,
+tqdm, pysam, numpy or sqlite3 (they are imported when a vcf is annotated).
+"""
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import sys
+import argparse
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Import time budget of mobidic_mpa (ms, logging included)
+BUDGET_MS = 50
+
+# Modules that must not be loaded by "import mobidic_mpa"
+HEAVY_MODULES = ["vcfpy", "tqdm", "pysam", "numpy", "sqlite3"]
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def import_time(module="mobidic_mpa", python_path=REPOSITORY_DIR):
+    """
+    @summary: Import a module in a fresh interpreter
+    @param module: [str] The module name
+    @param python_path: [str] The PYTHONPATH of the interpreter
+    @return: [tuple] The cumulative import time (ms) and the heavy modules \
+        loaded by the import
+    """
+    env = dict(os.environ, PYTHONPATH=python_path)
+    process = subprocess.run(
+        [
+            sys.executable, "-X", "importtime", "-c",
+            f"import sys, {module}; "
+            f"print(' '.join(m for m in {HEAVY_MODULES!r} "
+            f"if m in sys.modules))"
+        ],
+        env=env, capture_output=True, text=True, check=True
+    )
+    microseconds = None
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            microseconds = int(fields[1])
+    return microseconds / 1000, process.stdout.split()
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--budget',
+        default=BUDGET_MS,
+        type=float,
+        help="Import time budget in ms. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--repeat',
+        default=5,
+        type=int,
+        help="Number of measures (the best one is kept). \
+        [Default: %(default)s]"
+    )
+    args = parser.parse_args()
+
+    measures = [import_time() for _ in range(args.repeat)]
+    best = min(milliseconds for milliseconds, _ in measures)
+    heavy = measures[0][1]
+    print(f"import mobidic_mpa: {best:.1f} ms (budget {args.budget:.0f} ms)")
+    if heavy:
+        sys.exit(f"Heavy modules loaded at import: {', '.join(heavy)}")
+    if best > args.budget:
+        sys.exit("Import time over budget")
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+"""
+Benchmark MPA engines on synthetic annotated vcf: time parse, score and write
+stages, report records/s and peak memory, and check that the MPA fields are
+the same as the ones of the reference implementation (mpa script run with its
+default engine).
+"""
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import itertools
+import resource
+import tempfile
+import subprocess
+import collections
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPOSITORY_DIR)
+
+import vcfpy                          # noqa: E402
+import mobidic_mpa                    # noqa: E402
+from mobidic_mpa import raw           # noqa: E402
+import generate_vcf                   # noqa: E402
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+ENGINES = ["vcfpy", "raw", "numpy"]
+
+MPA_SCRIPT = os.path.join(REPOSITORY_DIR, "scripts", "mpa")
+
+# Keys compared between outputs
+MPA_KEYS = [info["ID"] for info in mobidic_mpa.MPA_INFOS]
+
+
+###############################################################################
+#
+# STAGES
+#
+###############################################################################
+def run_stages(engine, path, output, batch_size=1000):
+    """
+    @summary: Score a vcf with one engine, timing each stage separately \
+        (parse: read lines and decode annotations, score: compute MPA \
+        scores, write: format and write lines)
+    @param engine: [str] The engine name
+    @param path: [str] The path of the input vcf
+    @param output: [str] The path of the output vcf
+    @param batch_size: [int] The number of lines processed at once
+    @return: [dict] The time of each stage (s), the number of records and \
+        the peak memory (MB)
+    """
+    timings = collections.Counter()
+    start = time.perf_counter()
+    stream = raw.open_vcf(path)
+    header = raw.read_header(stream)
+    for info in mobidic_mpa.MPA_INFOS:
+        header.add_info_line(info)
+    lines = raw.iter_body(stream)
+    out = raw.open_output(output)
+    keys = mobidic_mpa.annotation_keys(True)
+    timings["parse"] += time.perf_counter() - start
+
+    if engine == "vcfpy":
+        reader = vcfpy.Reader.from_stream(io.StringIO(raw.header_text(header)))
+        writer = vcfpy.Writer.from_stream(out, header)
+    else:
+        out.write(raw.header_text(header))
+        scorer = raw.RawScorer(header, True)
+    if engine == "numpy":
+        from mobidic_mpa import columnar
+
+    records = 0
+    while True:
+        start = time.perf_counter()
+        batch = [line for _, line in zip(range(batch_size), lines)]
+        if not batch:
+            break
+        records += len(batch)
+        if engine == "vcfpy":
+            parsed = [reader.parser.parse_line(line) for line in batch]
+            annotations = [
+                (mobidic_mpa.get_annotations(record.INFO, keys),
+                 not record.is_snv())
+                for record in parsed
+            ]
+        else:
+            parsed = [scorer.parse_line(line) for line in batch]
+            if engine == "numpy":
+                columns = columnar.annotation_columns(
+                    [annotation for _, annotation, _ in parsed],
+                    [is_indel for _, _, is_indel in parsed]
+                )
+        parse_end = time.perf_counter()
+
+        if engine == "vcfpy":
+            scores = [
+                mobidic_mpa.score_annotations(annotation, is_indel)
+                for annotation, is_indel in annotations
+            ]
+        elif engine == "raw":
+            scores = [
+                mobidic_mpa.score_annotations(annotation, is_indel)
+                for _, annotation, is_indel in parsed
+            ]
+        else:
+            scores = columnar.score_columns(**columns)
+        score_end = time.perf_counter()
+
+        if engine == "vcfpy":
+            for record, mpa_fields in zip(parsed, scores):
+                record.INFO.update(mpa_fields)
+                writer.write_record(record)
+        else:
+            for i, (line_columns, _, _) in enumerate(parsed):
+                mpa_fields = (
+                    columnar.get_mpa_fields(scores, i) if engine == "numpy"
+                    else scores[i]
+                )
+                line_columns[7] = raw.add_info_fields(
+                    line_columns[7], mpa_fields)
+                out.write("\t".join(line_columns) + "\n")
+        write_end = time.perf_counter()
+
+        timings["parse"] += parse_end - start
+        timings["score"] += score_end - parse_end
+        timings["write"] += write_end - score_end
+
+    start = time.perf_counter()
+    out.close()
+    timings["write"] += time.perf_counter() - start
+
+    return {
+        "parse": timings["parse"],
+        "score": timings["score"],
+        "write": timings["write"],
+        "records": records,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def run(command, python_path=REPOSITORY_DIR):
+    """
+    @summary: Run a command and measure its wall time and peak memory
+    @param command: [list] The command
+    @param python_path: [str] The PYTHONPATH of the command (None to keep \
+        the environment)
+    @return: [tuple] The time (s), the peak memory (MB) and the standard \
+        output
+    """
+    env = dict(os.environ)
+    if python_path:
+        env["PYTHONPATH"] = python_path
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, env=env)
+    stdout = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        sys.exit(f"Command failed ({process.returncode}): {' '.join(command)}")
+    return seconds, usage.ru_maxrss / 1024, stdout
+
+
+def mpa_fields(path):
+    """
+    @summary: Read the MPA fields of each variant of a vcf
+    @param path: [str] The path of the vcf
+    @return: [generator] The site and the MPA fields of each variant
+    """
+    with raw.open_vcf(path) as stream:
+        for line in raw.iter_body(stream):
+            columns = line.split("\t", 8)
+            yield (
+                tuple(columns[:5]),
+                tuple(raw.find_info_value(columns[7], key + "=")
+                      for key in MPA_KEYS)
+            )
+
+
+def compare(path, reference):
+    """
+    @summary: Count variants whose MPA fields differ from the reference
+    @param path: [str] The path of the scored vcf
+    @param reference: [str] The path of the reference vcf
+    @return: [int] The number of differences (-1 if the number of variants \
+        differs)
+    """
+    differences = 0
+    missing = object()
+    for found, expected in itertools.zip_longest(
+        mpa_fields(path), mpa_fields(reference), fillvalue=missing
+    ):
+        if found is missing or expected is missing:
+            return -1
+        differences += found != expected
+    return differences
+
+
+def benchmark(path, engines, reference_script, tmp_dir, batch_size=1000,
+              reference_path=REPOSITORY_DIR):
+    """
+    @summary: Benchmark engines on one vcf
+    @param path: [str] The path of the input vcf
+    @param engines: [list] The engine names
+    @param reference_script: [str] The mpa script used as reference
+    @param tmp_dir: [str] The directory of outputs
+    @param batch_size: [int] The number of lines processed at once
+    @param reference_path: [str] The PYTHONPATH of the reference script \
+        (None for the installed mobidic_mpa)
+    @return: [list] The results (dict) of each engine
+    """
+    reference = os.path.join(tmp_dir, "reference.vcf")
+    seconds, peak_rss, _ = run([
+        sys.executable, reference_script, "-r", "-p", "-l", "WARNING",
+        "-i", path, "-o", reference
+    ], reference_path)
+    results = [{
+        "engine": "reference",
+        "records": None,
+        "total": seconds,
+        "peak_rss": peak_rss,
+        "differences": 0
+    }]
+
+    for engine in engines:
+        output = os.path.join(tmp_dir, f"{engine}.vcf")
+        _, peak_rss, stdout = run([
+            sys.executable, os.path.abspath(__file__), "--stages", engine,
+            "--batch-size", str(batch_size), "-i", path, "-o", output
+        ])
+        result = json.loads(stdout)
+        result["engine"] = engine
+        result["peak_rss"] = max(result["peak_rss"], peak_rss)
+        result["total"] = result["parse"] + result["score"] + result["write"]
+        result["differences"] = compare(output, reference)
+        results.append(result)
+        os.remove(output)
+
+    records = results[-1]["records"] if engines else None
+    results[0]["records"] = records
+    os.remove(reference)
+    return results
+
+
+def report(name, results):
+    """
+    @summary: Print the results of a benchmark
+    @param name: [str] The name of the benchmark
+    @param results: [list] The results of each engine (see benchmark)
+    """
+    print(f"## {name}")
+    print(
+        f"{'engine':<10}{'records':>10}{'parse':>9}{'score':>9}{'write':>9}"
+        f"{'total':>9}{'records/s':>12}{'peak MB':>10}  equivalent")
+    for result in results:
+        stages = "".join(
+            f"{result[stage]:>9.2f}" if stage in result else f"{'-':>9}"
+            for stage in ("parse", "score", "write")
+        )
+        rate = result["records"] / result["total"] if result["records"] else 0
+        equivalent = {0: "yes", -1: "no (records)"}.get(
+            result["differences"], f"no ({result['differences']} variants)")
+        print(
+            f"{result['engine']:<10}{result['records'] or 0:>10}{stages}"
+            f"{result['total']:>9.2f}{rate:>12.0f}{result['peak_rss']:>10.1f}"
+            f"  {equivalent}")
+    print(flush=True)
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-p',
+        '--presets',
+        nargs="+",
+        default=["panel"],
+        choices=sorted(generate_vcf.PRESETS),
+        help="Synthetic vcf to benchmark. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '-i',
+        '--input',
+        help="Benchmark an existing vcf instead of synthetic ones."
+    )
+    parser.add_argument(
+        '-e',
+        '--engines',
+        nargs="+",
+        default=ENGINES,
+        choices=ENGINES,
+        help="Engines to benchmark. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--reference',
+        default=MPA_SCRIPT,
+        help="The mpa script used as reference (e.g. the last release). \
+        [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--reference-path',
+        default=REPOSITORY_DIR,
+        help="The PYTHONPATH of the reference script, empty to use the \
+        installed mobidic_mpa. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--batch-size',
+        default=1000,
+        type=int,
+        help="Number of variants processed at once. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--seed',
+        default=1,
+        type=int,
+        help="Seed of the synthetic vcf. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--tmp-dir',
+        default=None,
+        help="Directory of the synthetic vcf and outputs. \
+        [Default: system temporary directory]"
+    )
+    # Internal: run the stages of one engine (in a separate process)
+    parser.add_argument('--stages', help=argparse.SUPPRESS)
+    parser.add_argument('-o', '--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stages:
+        json.dump(
+            run_stages(args.stages, args.input, args.output, args.batch_size),
+            sys.stdout
+        )
+        sys.exit(0)
+
+    tmp_dir = tempfile.mkdtemp(prefix="mpa-benchmark-", dir=args.tmp_dir)
+    try:
+        if args.input:
+            report(
+                os.path.basename(args.input),
+                benchmark(args.input, args.engines, args.reference, tmp_dir,
+                          args.batch_size, args.reference_path)
+            )
+        for preset in ([] if args.input else args.presets):
+            path = os.path.join(tmp_dir, f"{preset}.vcf")
+            options = generate_vcf.PRESETS[preset]
+            with open(path, "w") as output:
+                generate_vcf.generate(
+                    output,
+                    options["records"],
+                    options["samples"],
+                    options["regions"],
+                    args.seed
+                )
+            report(
+                f"{preset} ({options['records']} variants, "
+                f"{options['samples']} samples)",
+                benchmark(path, args.engines, args.reference, tmp_dir,
+                          args.batch_size, args.reference_path)
+            )
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
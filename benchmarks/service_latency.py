@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+"""
+Start the MPA scoring service on a temporary Unix socket (or a local TCP
+port), send batches of synthetic variants from concurrent clients, check that
+the scores are the same as the raw engine and report the latencies measured
+by the clients and by the service (no external service needed).
+"""
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import http.client
+import concurrent.futures
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPOSITORY_DIR)
+
+from mobidic_mpa import raw           # noqa: E402
+from mobidic_mpa import server        # noqa: E402
+import generate_vcf                   # noqa: E402
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    @summary: HTTP connection over a Unix socket
+    """
+    def __init__(self, path):
+        """
+        @param path: [str] The path of the Unix socket
+        """
+        super().__init__("localhost")
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def connect(address):
+    """
+    @summary: Open a connection to the service
+    @param address: [str] The address of the service (see \
+        server.parse_address)
+    @return: [http.client.HTTPConnection] The connection
+    """
+    family, location = server.parse_address(address)
+    if family == "unix":
+        return UnixHTTPConnection(location)
+    return http.client.HTTPConnection(*location)
+
+
+def request(connection, method, path, body=None, content_type=None):
+    """
+    @summary: Send a request and read its JSON response
+    @param connection: [http.client.HTTPConnection] The connection
+    @param method: [str] The HTTP method
+    @param path: [str] The path
+    @param body: [bytes] The body
+    @param content_type: [str] The content type of the body
+    @return: [tuple] The status and the response
+    """
+    headers = {"Content-Type": content_type} if content_type else {}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def client(address, batches, as_json=False):
+    """
+    @summary: Score batches of vcf lines one request after another
+    @param address: [str] The address of the service
+    @param batches: [list] The batches of vcf lines
+    @param as_json: [bool] Send the lines in a JSON list (text/plain \
+        otherwise)
+    @return: [tuple] The latency of each request (s) and the results
+    """
+    connection = connect(address)
+    latencies = []
+    results = []
+    for batch in batches:
+        start = time.perf_counter()
+        if as_json:
+            status, response = request(
+                connection, "POST", "/score",
+                json.dumps({"variants": batch}).encode(), "application/json")
+        else:
+            status, response = request(
+                connection, "POST", "/score", "".join(batch).encode(),
+                "text/plain")
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            sys.exit(f"Request failed ({status}): {response['error']}")
+        results.extend(response["results"])
+    connection.close()
+    return latencies, results
+
+
+def expected_results(lines):
+    """
+    @summary: Score vcf lines with the raw engine
+    @param lines: [list] The vcf lines
+    @return: [list] The MPA fields of each variant (see server.result)
+    """
+    line_scorer = raw.RawScorer(
+        raw.read_header(iter(generate_vcf.header_lines(1))),
+        no_refseq_version=True
+    )
+    return [server.result(line_scorer.score_line(line)[1]) for line in lines]
+
+
+def percentile(values, percent):
+    """
+    @summary: Percentile of sorted values
+    @param values: [list] The sorted values
+    @param percent: [int] The percentile
+    @return: [float] The value
+    """
+    return values[min(len(values) - 1, len(values) * percent // 100)]
+
+
+###############################################################################
+#
+# MAIN
+#
+###############################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-c',
+        '--clients',
+        default=4,
+        type=int,
+        help="Number of concurrent clients. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '-n',
+        '--requests',
+        default=50,
+        type=int,
+        help="Number of requests per client. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '-b',
+        '--batch-size',
+        default=20,
+        type=int,
+        help="Number of variants per request. [Default: %(default)s]"
+    )
+    parser.add_argument(
+        '--json',
+        default=False,
+        action='store_true',
+        help="Send variants in JSON (vcf lines as text/plain otherwise)."
+    )
+    parser.add_argument(
+        '--address',
+        default=None,
+        help="Address of the service, a port or a Unix socket path. \
+        [Default: a temporary Unix socket]"
+    )
+    parser.add_argument(
+        '--seed',
+        default=1,
+        type=int,
+        help="Seed of the synthetic variants. [Default: %(default)s]"
+    )
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="mpa-service-")
+    address = args.address or os.path.join(tmp_dir, "mpa.sock")
+    service = server.create_server(address, no_refseq_version=True)
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+
+    rng = random.Random(args.seed)
+    batches = [
+        [
+            generate_vcf.record_line(rng, "chr1", pos, "exome", 1)
+            for pos in range(i * args.batch_size, (i + 1) * args.batch_size)
+        ]
+        for i in range(args.clients * args.requests)
+    ]
+    try:
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(args.clients) as executor:
+            outcomes = list(executor.map(
+                lambda i: client(
+                    address, batches[i::args.clients], args.json),
+                range(args.clients)
+            ))
+        seconds = time.perf_counter() - start
+        _, metrics = request(connect(address), "GET", "/metrics")
+    finally:
+        service.shutdown()
+        service.server_close()
+        if os.path.exists(os.path.join(tmp_dir, "mpa.sock")):
+            os.remove(os.path.join(tmp_dir, "mpa.sock"))
+        os.rmdir(tmp_dir)
+
+    # Results of a client follow the order of its batches
+    differences = 0
+    for i, (_, results) in enumerate(outcomes):
+        lines = [line for batch in batches[i::args.clients] for line in batch]
+        differences += sum(
+            found != expected
+            for found, expected in zip(results, expected_results(lines)))
+    latencies = sorted(
+        latency for client_latencies, _ in outcomes
+        for latency in client_latencies)
+    variants = sum(len(batch) for batch in batches)
+    print(
+        f"{len(latencies)} requests, {variants} variants in {seconds:.2f}s "
+        f"({variants / seconds:.0f} variants/s) with {args.clients} clients")
+    print("client latency (ms): " + ", ".join(
+        f"p{p} {1000 * percentile(latencies, p):.2f}" for p in (50, 90, 99)))
+    print("service metrics: " + json.dumps(metrics["latency_ms"]) +
+          f", max in flight {metrics['max_in_flight']}")
+    print(f"equivalent to the raw engine: "
+          f"{'yes' if not differences else f'no ({differences} variants)'}")
+    sys.exit(1 if differences else 0)
@@ -22,11 +22,118 @@ __status__ = 'prod'
 # IMPORT
 #
 ###############################################################################
+import os
 import sys        # system command
-import re         # regex
+import logging
+import argparse
+import functools
+import itertools
 import collections
-import tqdm
-import vcfpy
+
+from mobidic_mpa import classify
+from mobidic_mpa import splice
+from mobidic_mpa import metrics
+from mobidic_mpa import filters
+
+# vcfpy, tqdm and the modules reading/writing vcf (raw, parallel, regions,
+# cache, cohort...) are imported by the functions using them: importing the
+# package only to score annotations stays fast
+
+# Logger of the package (replaced by the logger given to main)
+log = logging.getLogger("MPA_score")
+
+
+########################################################################
+#
+# CONSTANTS
+#
+########################################################################
+# INFO header lines added by MPA (in the order of the vcf header)
+MPA_INFOS = [
+    collections.OrderedDict([
+        ("ID", "MPA_adjusted"),
+        ("Number", 1),
+        ("Type", "Float"),
+        ("Description", "MPA_adjusted : normalize MPA missense score from 0 to 10"),
+        ("Source", "MPA")
+    ]),
+    collections.OrderedDict([
+        ("ID", "MPA_available"),
+        ("Number", 1),
+        ("Type", "Integer"),
+        ("Description", "MPA_available : number of missense tools annotation available for this variant"),
+        ("Source", "MPA")
+    ]),
+    collections.OrderedDict([
+        ("ID", "MPA_deleterious"),
+        ("Number", 1),
+        ("Type", "Integer"),
+        ("Description", "MPA_deleterious : number of missense tools that annotate this variant pathogenic"),
+        ("Source", "MPA")
+    ]),
+    collections.OrderedDict([
+        ("ID", "MPA_final_score"),
+        ("Number", 1),
+        ("Type", "Float"),
+        ("Description", "MPA_final_score : unique score that take into account curated database, biological assumptions, splicing predictions and the sum of various predictors for missense alterations. Annotations are made for exonic and splicing variants up to +300nt."),
+        ("Source", "MPA")
+    ]),
+    collections.OrderedDict([
+        ("ID", "MPA_impact"),
+        ("Number", "."),
+        ("Type", "String"),
+        ("Description", "MPA_impact : pathogenic predictions (clinvar_pathogenicity, splice_impact, stop, start, frameshift_impact & indel_impact)"),
+        ("Source", "MPA")
+    ]),
+    collections.OrderedDict([
+        ("ID", "MPA_ranking"),
+        ("Number", 1),
+        ("Type", "Integer"),
+        ("Description", "MPA_ranking : prioritize variants with ranks from 1 to 10"),
+        ("Source", "MPA")
+    ])
+]
+
+# Annotations read with all their values (only the first value of the others
+# is read)
+MULTIPLE_VALUES_KEYS = ['spliceai_filtered']
+
+# Default options of annotate (as the mpa script, without progress bar)
+OPTIONS = collections.OrderedDict([
+    ("no_refseq_version", False),
+    ("no_progress_bar", True),
+    ("engine", "vcfpy"),
+    ("threads", 1),
+    ("batch_size", 1000),
+    ("max_batches", None),
+    ("split_by", None),
+    ("window_size", 10000000),
+    ("cache", None),
+    ("cache_size", 10000000),
+    ("profile", False),
+    ("metrics_json", None),
+    ("cohort", None),
+    ("output_dir", None),
+    ("max_rank", None),
+    ("min_score", None),
+    ("top_k", None),
+    ("sort", False),
+    ("sort_memory", 256),
+    ("export", None),
+    ("export_info", None),
+    ("bgzip", False),
+    ("compress_threads", 1),
+    ("pipeline", False),
+    ("serve", None),
+    ("split_alleles", False),
+    ("gene_summary", None),
+    ("summary_top", 3),
+    ("lazy_samples", False),
+    ("trace", None),
+    ("trace_rate", None),
+    ("trace_region", None),
+    ("trace_ids", None)
+])
 
 
 ########################################################################
@@ -34,16 +141,14 @@ import vcfpy
 # FUNCTIONS
 #
 ########################################################################
-def check_annotation(vcf_infos, no_refseq_version=True):
+def annotation_keys(no_refseq_version=True):
     """
-    @summary: Chek if vcf followed the guidelines for annotations (17 are \
-        mandatory see full documentation)
-    @param vcf_infos: [vcf.reader.infos] One record of the VCF
-    @return: [None]
+    @summary: List the INFO keys read by MPA to score a variant
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [list] The INFO keys
     """
-
     refSeqExt = 'refGene' if no_refseq_version else 'refGeneWithVer'
-    vcf_keys = [
+    return [
         'Func.{}'.format(refSeqExt),
         'ExonicFunc.{}'.format(refSeqExt),
         'dbscSNV_ADA_SCORE',
@@ -62,6 +167,16 @@ def check_annotation(vcf_infos, no_refseq_version=True):
         'CLNSIG'
     ]
 
+
+def check_annotation(vcf_infos, no_refseq_version=True):
+    """
+    @summary: Chek if vcf followed the guidelines for annotations (17 are \
+        mandatory see full documentation)
+    @param vcf_infos: [vcf.reader.infos] One record of the VCF
+    @return: [None]
+    """
+    vcf_keys = annotation_keys(no_refseq_version)
+
     log.debug(vcf_keys)
 
     if(not set(vcf_keys).issubset(vcf_infos)):
@@ -106,7 +221,7 @@ def calculate_adjusted_score(scores_impact):
     available = 0
     score_adjusted = 0
 
-    log.debug(f"scores impact : {scores_impact}")
+    log.debug("scores impact : %s", scores_impact)
 
     for score, impact in scores_impact.items():
         if(impact == "D" or impact == "A"):
@@ -118,19 +233,14 @@ def calculate_adjusted_score(scores_impact):
     if available > 0:
         score_adjusted = float(deleterious) / float(available) * 10
 
-    log.debug(">> Return: ")
-    log.debug({
-        "adjusted": score_adjusted,
-        "available": available,
-        "deleterious": deleterious
-    })
-
     # Return meta score and available tools
-    return {
+    adjusted_score = {
         "adjusted": score_adjusted,
         "available": available,
         "deleterious": deleterious
     }
+    log.debug(">> Return: %s", adjusted_score)
+    return adjusted_score
 
 
 # TODO: modulate clinvar score
@@ -141,17 +251,8 @@ def is_clinvar_pathogenic(clinsig):
     @return: [int/bool] Rank (1) if is pathogenic and no Benign; False in \
         other cases
     """
-    # No clinsig available
-    if clinsig is None:
-        return False
-
-    # Test if "Pathogenic" or "Benign" match on clinsig
-    match_pathogenic = re.search("pathogenic", clinsig, re.IGNORECASE)
-    match_benign = re.search("benign", clinsig, re.IGNORECASE)
-    match_conflicting = re.search("conflicting", clinsig, re.IGNORECASE)
-
     # Determine if clinvar as no doubt about pathogenicity
-    if(match_pathogenic and not match_benign and not match_conflicting):
+    if(classify.classify(clinsig) & classify.CLINVAR_PATHOGENIC):
         return 1
     else:
         return False
@@ -160,66 +261,38 @@ def is_clinvar_pathogenic(clinsig):
 def is_splice_impact(splices_scores, is_indel, funcRefGene):
     """
     @summary: Predict splicing effect of the variant
-    @param splices_scores: [dict] The dictionnary of splicing scores
+    @param splices_scores: [splice.SpliceScores] The splicing scores (see \
+        splice.decode)
     @param is_indel: [bool] Boolean to define if variants is indel or not
     @param funcRefGene: [str] Annotation provided by refGene about the \
         biological function
     @return: [int/bool] Rank (3,4,5,6,7 or 8) if is splicing impact; False in \
         other cases
     """
-
     # If ADA predict splicing impact
     ADA_splice = (
-        splices_scores["ADA"] is not None and
-        float(splices_scores["ADA"]) >= 0.6
+        splices_scores.ada is not None and
+        splices_scores.ada >= 0.6
     )
 
     # If RF predict splicing impact
     RF_splice = (
-        splices_scores["RF"] is not None and
-        float(splices_scores["RF"]) >= 0.6
+        splices_scores.rf is not None and
+        splices_scores.rf >= 0.6
     )
 
-    # If Zscore predict splicing impact but no ADA and RF annotation
-    if(splices_scores["spliceAI"] is not None):
-        spliceAI_split = splices_scores["spliceAI"].split("\\x3b")
-        spliceAI_annot = dict()
-        for annot in spliceAI_split:
-            annot_split = annot.split("\\x3d")
-            if len(annot_split) > 1:
-                spliceAI_annot[annot_split[0]] = annot_split[1]
-
-    spliceAI_score_high = (
-        splices_scores["spliceAI"] is not None and
-        (
-            float(spliceAI_annot["DS_AG"]) > 0.8 or
-            float(spliceAI_annot["DS_AL"]) > 0.8 or
-            float(spliceAI_annot["DS_DG"]) > 0.8 or
-            float(spliceAI_annot["DS_DL"]) > 0.8
-        )
-    )
-    spliceAI_score_moderate = (
-        splices_scores["spliceAI"] is not None and
-        (
-            float(spliceAI_annot["DS_AG"]) > 0.5 or
-            float(spliceAI_annot["DS_AL"]) > 0.5 or
-            float(spliceAI_annot["DS_DG"]) > 0.5 or
-            float(spliceAI_annot["DS_DL"]) > 0.5
-        )
-    )
-    spliceAI_score_low = (
-        splices_scores["spliceAI"] is not None and
-        (
-            float(spliceAI_annot["DS_AG"]) > 0.2 or
-            float(spliceAI_annot["DS_AL"]) > 0.2 or
-            float(spliceAI_annot["DS_DG"]) > 0.2 or
-            float(spliceAI_annot["DS_DL"]) > 0.2
-        )
-    )
+    # If Zscore predict splicing impact but no ADA and RF annotation (highest
+    # SpliceAI delta score)
+    max_ds = splices_scores.max_ds
+    spliceAI_score_high = max_ds is not None and max_ds > 0.8
+    spliceAI_score_moderate = max_ds is not None and max_ds > 0.5
+    spliceAI_score_low = max_ds is not None and max_ds > 0.2
 
     # Home made prediction of splice impact
-    match_splicing = re.search("splicing", funcRefGene, re.IGNORECASE)
-    home_splice = (is_indel and match_splicing)
+    home_splice = (
+        is_indel and
+        classify.classify(funcRefGene) & classify.SPLICING
+    )
 
     # Determine if there is a splicing impact
     if(RF_splice):
@@ -244,10 +317,7 @@ def is_stop_impact(exonicFuncRefGene):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [bool] Rank (2) if is stop impact; False in other cases
     """
-    match_stoploss = re.search("stoploss", exonicFuncRefGene, re.IGNORECASE)
-    match_stopgain = re.search("stopgain", exonicFuncRefGene, re.IGNORECASE)
-
-    if(match_stopgain or match_stoploss):
+    if(classify.classify(exonicFuncRefGene) & classify.STOP):
         return 2
     else:
         return False
@@ -259,10 +329,7 @@ def is_start_impact(exonicFuncRefGene):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [bool] Rank (2) if is start impact; False in other cases
     """
-    match_startloss = re.search("startloss", exonicFuncRefGene, re.IGNORECASE)
-    # match_startgain = re.search("startgain", exonicFuncRefGene, re.IGNORECASE)
-
-    if(match_startloss):
+    if(classify.classify(exonicFuncRefGene) & classify.START):
         return 2
     else:
         return False
@@ -274,18 +341,11 @@ def is_indel_impact(exonicFuncRefGene):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [int/bool] Rank (2) if is frameshift impact; Rank (8) if non-frameshift; False in other cases
     """
-    match_frameshift = re.search(
-        "frameshift",
-        exonicFuncRefGene,
-        re.IGNORECASE)
-    match_nonframeshift = re.search(
-        "nonframeshift",
-        exonicFuncRefGene,
-        re.IGNORECASE)
+    exonic_mask = classify.classify(exonicFuncRefGene)
 
-    if(match_frameshift and not match_nonframeshift):
+    if(exonic_mask & classify.FRAMESHIFT):
         return 2
-    elif(match_nonframeshift):
+    elif(exonic_mask & classify.NONFRAMESHIFT):
         return 8
     else:
         return False
@@ -297,12 +357,7 @@ def is_missense_impact(exonicFuncRefGene, adjusted_score):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [int/bool] Rank () if is missense impact; False in other cases
     """
-    match_missense = re.search(
-        "nonsynonymous_SNV",
-        exonicFuncRefGene,
-        re.IGNORECASE)
-
-    if(match_missense):
+    if(classify.classify(exonicFuncRefGene) & classify.MISSENSE):
         if(adjusted_score > 6):
             return 5
         elif(adjusted_score > 2):
@@ -319,14 +374,196 @@ def is_unknown_impact(exonicFuncRefGene):
     @param exonicFuncRefGene: [str] The exonic function predicted by RefGene
     @return: [int/bool] Rank (10) if is unknown impact; False in other cases
     """
-    match_unknown = re.search("unknown", exonicFuncRefGene, re.IGNORECASE)
-
-    if(match_unknown):
+    if(classify.classify(exonicFuncRefGene) & classify.UNKNOWN):
         return 10
     else:
         return False
 
 
+def get_annotations(infos, keys):
+    """
+    @summary: Extract the first value of each annotation used by MPA (all \
+        values for MULTIPLE_VALUES_KEYS)
+    @param infos: [dict] The INFO fields of the variant (as parsed by vcfpy)
+    @param keys: [list] The INFO keys to extract (see annotation_keys)
+    @return: [dict] The first value of each annotation (None if empty)
+    """
+    return {
+        key: (
+            infos[key] if key in MULTIPLE_VALUES_KEYS else infos[key][0]
+        ) if infos[key] else None
+        for key in keys
+    }
+
+
+def score_annotations(annotations, is_indel, no_refseq_version=True,
+                      trace=None):
+    """
+    @summary: Calculate MPA scores and ranking of one variant
+    @param annotations: [dict] The first value of each annotation used by MPA \
+        (see get_annotations)
+    @param is_indel: [bool] Boolean to define if variants is indel or not
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param trace: [dict] Filled with the decisions of the scoring (scores \
+        read, outcome of each impact rule, rank), None to skip
+    @return: [OrderedDict] The MPA INFO fields to add to the variant (in the \
+        order written on the vcf)
+    """
+    refSeqExt = 'refGene' if no_refseq_version else 'refGeneWithVer'
+    FuncKey = f'Func.{refSeqExt}'
+    ExonicFuncKey = f'ExonicFunc.{refSeqExt}'
+
+    # Deleterious impact scores
+    impacts_scores = {
+        "SIFT": annotations['SIFT_pred'],
+        "HDIV": annotations['Polyphen2_HDIV_pred'],
+        "HVAR": annotations['Polyphen2_HVAR_pred'],
+        "LRT": annotations['LRT_pred'],
+        "MutationTaster": annotations['MutationTaster_pred'],
+        "FATHMM": annotations['FATHMM_pred'],
+        "PROVEAN": annotations['PROVEAN_pred'],
+        "MKL": annotations['fathmm-MKL_coding_pred'],
+        "SVM": annotations['MetaSVM_pred'],
+        "LR": annotations['MetaLR_pred']
+    }
+
+    # Splicing impact scores
+    splices_scores = splice.decode(
+        annotations['dbscSNV_ADA_SCORE'],
+        annotations['dbscSNV_RF_SCORE'],
+        annotations['spliceai_filtered']
+    )
+
+    # MPA aggregate the information to predict some effects
+    meta_impact = {
+        "clinvar_pathogenicity": False,
+        "stop_impact": False,
+        "splice_impact": False,
+        "frameshift_impact": False,
+        "indel_impact": False,
+        "unknown_impact": False
+    }
+
+    # Calculate adjusted score for each variants
+    adjusted_score = calculate_adjusted_score(impacts_scores)
+
+    # Determine if variant is annotated with clinvar as deleterious
+    meta_impact["clinvar_pathogenicity"] = is_clinvar_pathogenic(
+        annotations['CLNSIG']
+    )
+
+    # Determine the impact on splicing
+    meta_impact["splice_impact"] = is_splice_impact(
+        splices_scores,
+        is_indel,
+        annotations[FuncKey]
+    )
+
+    # Determine the exonic impact
+    match_exonic = classify.classify(annotations[FuncKey]) & classify.EXONIC
+    exonicFunc = annotations[ExonicFuncKey]
+    if (
+        match_exonic and
+        exonicFunc
+    ):
+        # Determine the stop impact
+        meta_impact["stop_impact"] = is_stop_impact(exonicFunc)
+
+        # Determine the start impact
+        meta_impact["start_impact"] = is_start_impact(exonicFunc)
+
+        # Determine the frameshift impact
+        indel_impact = is_indel_impact(exonicFunc)
+        if indel_impact == 8:
+            meta_impact["indel_impact"] = 8
+        if indel_impact == 2:
+            meta_impact["frameshift_impact"] = 2
+
+        # Determine the missense impact
+        meta_impact["missense_impact"] = is_missense_impact(
+            exonicFunc,
+            adjusted_score["adjusted"])
+
+        # Determine if unknown impact (misunderstand gene)
+        # NOTE: /!\ Be careful to updates regularly your databases /!\
+        meta_impact["unknown_impact"] = is_unknown_impact(exonicFunc)
+
+    log.debug("Meta score : %s", meta_impact)
+
+    # Ranking of variants
+    rank = False
+    mpa_impact = []
+    for impact in meta_impact:
+        if (meta_impact[impact]):
+            mpa_impact.append(impact)
+
+            if(meta_impact[impact] < rank or not rank):
+
+                rank = meta_impact[impact]
+
+                if (
+                    impact == "unknown_impact" or
+                    impact == "missense_impact"
+                ):
+                    adjusted_score["final_score"] = \
+                        adjusted_score["adjusted"]
+                elif (
+                    impact == "splice_impact" and
+                    meta_impact["splice_impact"] == 6
+                ):
+                    adjusted_score["final_score"] = 6
+                elif (
+                    impact == "splice_impact" and
+                    meta_impact["splice_impact"] == 8
+                ):
+                    adjusted_score["final_score"] = 2
+                elif (
+                    impact == "indel_impact" and
+                    meta_impact["indel_impact"] == 8
+                ):
+                    adjusted_score["final_score"] = 8
+                elif (
+                    impact == "frameshift_impact" and
+                    meta_impact["frameshift_impact"] == 2
+                ):
+                    adjusted_score["final_score"] = 2
+                else:
+                    adjusted_score["final_score"] = 10
+
+    # if not ranking default value 10
+    if not rank:
+        rank = 10
+        mpa_impact = ["NULL"]
+        adjusted_score["final_score"] = str(adjusted_score["adjusted"])
+
+    log.debug("Ranking : %s", rank)
+
+    if trace is not None:
+        trace["impacts_scores"] = impacts_scores
+        trace["splice_scores"] = splices_scores._asdict()
+        trace["exonic"] = bool(match_exonic)
+        trace["meta_impact"] = dict(meta_impact)
+        trace["adjusted_score"] = dict(adjusted_score)
+        trace["rank"] = int(rank)
+        # The first impact of the lowest rank sets the final score
+        trace["rank_impact"] = next(
+            (
+                impact for impact in meta_impact
+                if meta_impact[impact] and meta_impact[impact] == rank
+            ),
+            "NULL"
+        )
+
+    mpa_fields = collections.OrderedDict([
+        ('MPA_impact', mpa_impact),
+        ('MPA_ranking', int(rank))
+    ])
+    for sc in adjusted_score:
+        mpa_fields['MPA_' + sc] = str(adjusted_score[sc])
+
+    return mpa_fields
+
+
 ###############################################################################
 #
 # PROCESS
@@ -341,227 +578,709 @@ def main(args, logger):
     global log
     log = logger
 
-    info_MPA_adjusted = vcfpy.OrderedDict([
-        ("ID", "MPA_adjusted"),
-        ("Number", 1),
-        ("Type", "Float"),
-        ("Description", "MPA_adjusted : normalize MPA missense score from 0 to 10"),
-        ("Source", "MPA")
-    ])
-    info_MPA_available = vcfpy.OrderedDict([
-        ("ID", "MPA_available"),
-        ("Number", 1),
-        ("Type", "Integer"),
-        ("Description", "MPA_available : number of missense tools annotation available for this variant"),
-        ("Source", "MPA")
-    ])
-    info_MPA_deleterious = vcfpy.OrderedDict([
-        ("ID", "MPA_deleterious"),
-        ("Number", 1),
-        ("Type", "Integer"),
-        ("Description", "MPA_deleterious : number of missense tools that annotate this variant pathogenic"),
-        ("Source", "MPA")
-    ])
-    info_MPA_final_score = vcfpy.OrderedDict([
-        ("ID", "MPA_final_score"),
-        ("Number", 1),
-        ("Type", "Float"),
-        ("Description", "MPA_final_score : unique score that take into account curated database, biological assumptions, splicing predictions and the sum of various predictors for missense alterations. Annotations are made for exonic and splicing variants up to +300nt."),
-        ("Source", "MPA")
-    ])
-    info_MPA_impact = vcfpy.OrderedDict([
-        ("ID", "MPA_impact"),
-        ("Number", "."),
-        ("Type", "String"),
-        ("Description", "MPA_impact : pathogenic predictions (clinvar_pathogenicity, splice_impact, stop, start, frameshift_impact & indel_impact)"),
-        ("Source", "MPA")
-    ])
-    info_MPA_ranking = vcfpy.OrderedDict([
-        ("ID", "MPA_ranking"),
-        ("Number", 1),
-        ("Type", "Integer"),
-        ("Description", "MPA_ranking : prioritize variants with ranks from 1 to 10"),
-        ("Source", "MPA")
-    ])
-    refSeqExt = 'refGene' if args.no_refseq_version else 'refGeneWithVer'
+    # Metrics are only collected on demand
+    vcf_metrics = None
+    if args.profile or args.metrics_json:
+        vcf_metrics = metrics.Metrics()
+
+    try:
+        if args.cohort:
+            annotate_cohort(args, vcf_metrics)
+        elif args.serve:
+            serve(args)
+        else:
+            annotate_vcf(args, vcf_metrics)
+    except SystemExit as e:
+        if vcf_metrics is not None:
+            vcf_metrics.status = e.code if isinstance(e.code, int) else (
+                0 if e.code is None else 1)
+        raise
+    finally:
+        if vcf_metrics is not None:
+            if args.profile:
+                vcf_metrics.log(log)
+            if args.metrics_json:
+                vcf_metrics.write(args.metrics_json)
+
+    return vcf_metrics.report() if vcf_metrics is not None else None
+
+
+def annotate(input=None, output=None, logger=None, **options):
+    """
+    @summary: Annotate a vcf with MPA score from python code (same as the mpa \
+        script). It can be called several times in a process: modules and \
+        the classification cache are only loaded once.
+    @param input: [str] The vcf file to annotate ("-" for the standard input)
+    @param output: [str] The output vcf file ("-" for the standard output)
+    @param logger: [Logger] The logger (default to the "MPA_score" logger)
+    @param options: [dict] The options of the mpa script by their long name \
+        (e.g. engine="raw", threads=4, cohort="samples/*.vcf", \
+        output_dir="outputs"), see OPTIONS for the default values
+    @return: [dict] The metrics of the annotation (see Metrics.report), None \
+        unless profile or metrics_json is given
+    @raise SystemExit: As the mpa script, on a badly annotated or malformed \
+        vcf (the error is logged)
+    """
+    unknown = set(options).difference(OPTIONS)
+    if unknown:
+        raise TypeError(
+            "annotate() got unknown options: " + ", ".join(sorted(unknown)))
+    if options.get("cohort"):
+        if input is not None or not options.get("output_dir"):
+            raise TypeError("annotate() needs output_dir with cohort")
+    elif options.get("serve"):
+        if input is not None:
+            raise TypeError("annotate() needs no input with serve")
+    elif input is None or (output is None and not options.get("export")):
+        raise TypeError("annotate() needs input and output (or export)")
+
+    args = argparse.Namespace(input=input, output=output, **OPTIONS)
+    for key, value in options.items():
+        setattr(args, key, value)
+    return main(args, logger or log)
+
+
+def serve(args):
+    """
+    @summary: Serve MPA scores over HTTP (TCP or Unix socket) until \
+        interrupted, and log the metrics of the service at exit.
+    @param args: [Namespace] The namespace extract from the script arguments.
+    """
+    from mobidic_mpa import server
+
+    try:
+        report = server.serve(args.serve, args.no_refseq_version)
+    except SystemExit as e:
+        log.error(str(e))
+        sys.exit(1)
+    log.info(
+        f"Service: {report['requests']} requests ({report['errors']} "
+        f"errors), {report['variants']} variants, "
+        f"{report['max_in_flight']} concurrent requests at most")
+
+
+def annotate_cohort(args, vcf_metrics=None):
+    """
+    @summary: Annotate the vcf of a cohort with MPA score, each vcf in \
+        the output directory, and write the status and timing of each vcf.
+    @param args: [Namespace] The namespace extract from the script arguments.
+    @param vcf_metrics: [Metrics] The metrics collected (None to disable).
+    """
+    import tqdm
+    from mobidic_mpa import cohort
+
+    paths = cohort.list_inputs(args.cohort)
+    if not paths:
+        log.error(f"No vcf found for the cohort {args.cohort}")
+        sys.exit(1)
+    if (
+        args.split_by or args.cache or args.export or args.pipeline or
+        args.gene_summary or args.trace
+    ):
+        log.warning(
+            "Split by region, score cache, export, pipeline, summary per "
+            "gene and trace are not used by cohorts.")
+
+    log.info(f"Annotate {len(paths)} vcf with {args.threads} processes")
+    results = collections.OrderedDict.fromkeys(paths)
+    try:
+        for path, output, result in tqdm.tqdm(
+            metrics.timed(vcf_metrics, "score", cohort.annotate_cohort(
+                paths,
+                args.output_dir,
+                args.engine,
+                args.no_refseq_version,
+                args.threads,
+                args.batch_size,
+                args.bgzip,
+                args.compress_threads,
+                args.max_rank,
+                args.min_score,
+                args.top_k,
+                args.sort_memory if args.sort else None,
+                args.split_alleles,
+                args.lazy_samples
+            )),
+            total=len(paths),
+            unit=" vcf",
+            disable=args.no_progress_bar
+        ):
+            results[path] = (path, output, result)
+            if result["status"] == "ok":
+                log.info(
+                    f"{path}: {result['variants']} variants scored in "
+                    f"{result['seconds']:.2f}s")
+            else:
+                log.error(f"{path}: {result['error']}")
+            if vcf_metrics is not None:
+                vcf_metrics.add_counts(
+                    result["variants"], result["ranks"], result["impacts"])
+    except SystemExit as e:
+        log.error(str(e))
+        sys.exit(1)
+
+    # The report follows the order of the cohort
+    report = os.path.join(args.output_dir, cohort.REPORT_NAME)
+    cohort.write_report(report, [results[path] for path in results])
+    failures = sum(
+        1 for _, _, result in results.values() if result["status"] != "ok")
+    log.info(f"Cohort report: {report}")
+    if failures:
+        log.error(f"{failures} of {len(results)} vcf not annotated")
+        sys.exit(2)
+
+
+def annotate_vcf(args, vcf_metrics=None):
+    """
+    @summary: Annotate a vcf with MPA score.
+    @param args: [Namespace] The namespace extract from the script arguments.
+    @param vcf_metrics: [Metrics] The metrics collected (None to disable).
+    """
+    import vcfpy
+    from mobidic_mpa import raw
+    from mobidic_mpa import bcf
+    from mobidic_mpa import progress
+
+    if bcf.is_bcf(args.input) or bcf.is_bcf(args.output):
+        annotate_bcf(args, vcf_metrics)
+        return
 
     log.info("Read VCF file")
-    vcf_reader = vcfpy.Reader.from_path(args.input)
-    count = -1
-    if not args.no_progress_bar:
-        count = sum(1 for _ in vcf_reader)
-        log.info(f"Number of variants : {count}")
-        vcf_reader = vcfpy.Reader.from_path(args.input)
-
-    # TODO: improve this
-    vcf_reader.header.add_info_line(info_MPA_adjusted)
-    vcf_reader.header.add_info_line(info_MPA_available)
-    vcf_reader.header.add_info_line(info_MPA_deleterious)
-    vcf_reader.header.add_info_line(info_MPA_final_score)
-    vcf_reader.header.add_info_line(info_MPA_impact)
-    vcf_reader.header.add_info_line(info_MPA_ranking)
-    vcf_writer = vcfpy.Writer.from_path(args.output, vcf_reader.header)
-
-    if count == 0:
-        log.warn("No variant in VCF. Exit.")
-        sys.exit(0)
+    vcf_index = None
+    byte_ranges = False
+    if args.split_by and args.export:
+        log.warning("Split by region is not used with an export.")
+    elif args.split_by:
+        from mobidic_mpa import regions
+        from mobidic_mpa import ranges
+        if args.split_by != "bytes":
+            vcf_index = regions.find_index(args.input)
+        if vcf_index is None:
+            # Without index, an uncompressed vcf is split in byte ranges
+            byte_ranges = ranges.is_mappable(args.input)
+            if not byte_ranges:
+                log.warning(
+                    "Split by region needs a bgzipped vcf with a tabix/csi "
+                    "index, or an uncompressed vcf file. Read the whole vcf.")
+            elif args.split_by != "bytes":
+                log.info("No tabix/csi index, split the vcf in byte ranges")
+    split_input = vcf_index or byte_ranges
+    # Cached MPA fields are added to the raw lines: the vcfpy engine would
+    # write the other variants differently (e.g. "FS=0.0" for "FS=0")
+    use_cache = args.cache and args.engine != "vcfpy"
+    if args.cache and not use_cache:
+        log.warning("Score cache is not used with the vcfpy engine (use "
+                    "--engine raw or numpy).")
+
+    # Variants are read as raw lines by raw/numpy engines and by workers
+    # (and when scores are sorted or exported, alleles split or samples not
+    # parsed)
+    read_lines = (
+        args.engine != "vcfpy" or args.threads > 1 or split_input or
+        args.sort or args.export or args.split_alleles or
+        args.lazy_samples
+    )
+    vcf_stream = raw.open_vcf(args.input)
+    if read_lines:
+        vcf_header = raw.read_header(vcf_stream)
+        variants = raw.iter_body(vcf_stream)
+        if args.split_alleles:
+            from mobidic_mpa import alleles
+            variants = alleles.AlleleSplitter(vcf_header).split_lines(
+                variants)
+    else:
+        vcf_reader = vcfpy.Reader.from_stream(vcf_stream, path=args.input)
+        vcf_header = vcf_reader.header
+        variants = vcf_reader
+    pipelined = args.pipeline and not split_input
+    if pipelined:
+        from mobidic_mpa import pipeline
+        log.info("Read, score and write variants on separate threads")
+        variants = pipeline.prefetch(
+            variants,
+            args.batch_size,
+            args.max_batches or pipeline.DEPTH
+        )
+    variants = metrics.timed(vcf_metrics, "read", variants)
+
+    for info in MPA_INFOS:
+        vcf_header.add_info_line(info)
+    if not split_input:
+        # Without output, only the export is written
+        vcf_output = raw.open_output(
+            args.output or os.devnull,
+            (args.bgzip or None) if args.output else False,
+            args.compress_threads,
+            None if pipelined else vcf_metrics
+        )
+        if pipelined:
+            vcf_output = pipeline.QueuedWriter(
+                vcf_output,
+                args.max_batches or pipeline.DEPTH,
+                metrics=vcf_metrics
+            )
+        vcf_writer = vcfpy.Writer.from_stream(
+            vcf_output,
+            vcf_header,
+            path=args.output,
+            use_bgzf=False
+        )
+
+        # Look at the first variant only (the vcf is read once)
+        first_variant = next(variants, None)
+        if first_variant is None:
+            log.warn("No variant in VCF. Exit.")
+            sys.exit(0)
+        variants = progress.track(
+            itertools.chain([first_variant], variants),
+            vcf_stream,
+            args.no_progress_bar
+        )
 
     log.info("Check vcf annotations")
     try:
-        check_annotation(vcf_reader.header.info_ids(), args.no_refseq_version)
+        metrics.timer(vcf_metrics, "validate", check_annotation)(
+            vcf_header.info_ids(), args.no_refseq_version)
     except SystemExit as e:
         log.error(str(e))
         sys.exit(1)
 
-    log.info("Read each variants")
-    for record in tqdm.tqdm(vcf_reader, total=count):
-        log.debug(str(record))
+    gene_summary = None
+    if args.gene_summary:
+        from mobidic_mpa import summary
+        gene_summary = summary.GeneSummary(args.summary_top)
+    tracer = None if split_input else open_tracer(args)
 
+    log.info("Read each variants")
+    if split_input:
+        options = (
+            args.output,
+            args.engine,
+            args.no_refseq_version,
+            args.threads,
+            args.bgzip or None,
+            vcf_metrics is not None,
+            args.max_rank,
+            args.min_score,
+            args.split_alleles,
+            args.summary_top if gene_summary is not None else None,
+            args.lazy_samples
+        )
+        if byte_ranges:
+            vcf_regions = ranges.list_ranges(
+                args.input, args.threads * ranges.RANGES_PER_WORKER)
+            unit = "byte ranges"
+            chunks = ranges.write_ranges(
+                args.input, vcf_header, vcf_regions, *options)
+        else:
+            vcf_regions = regions.list_regions(
+                args.input,
+                vcf_index,
+                vcf_header,
+                args.split_by,
+                args.window_size
+            )
+            unit = "regions"
+            chunks = regions.write_regions(
+                args.input, vcf_index, vcf_header, vcf_regions, *options)
+        log.info(
+            f"Score {len(vcf_regions)} {unit} with {args.threads} processes")
+        if args.cache:
+            log.warning("Score cache is not used with split by region.")
+        if args.top_k:
+            log.warning("Top variants per gene are not selected with split by "
+                        "region (--max-rank and --min-score are applied).")
+        if args.sort:
+            log.warning("Variants are not sorted by rank with split by "
+                        "region.")
+        if args.trace:
+            log.warning("Scoring decisions are not traced with split by "
+                        "region.")
+        import tqdm
         try:
-            check_split_variants(record)
+            for count, ranks, impacts, region_summary in tqdm.tqdm(
+                metrics.timed(vcf_metrics, "score", chunks),
+                total=len(vcf_regions),
+                unit=f" {unit}",
+                disable=args.no_progress_bar
+            ):
+                if vcf_metrics is not None:
+                    vcf_metrics.regions += 1
+                    vcf_metrics.add_counts(count, ranks, impacts)
+                if region_summary is not None:
+                    gene_summary.update(region_summary)
         except SystemExit as e:
-            log.error(str(record))
             log.error(str(e))
             sys.exit(2)
-
-        # Deleterious impact scores
-        impacts_scores = {
-            "SIFT": record.INFO['SIFT_pred'][0] if record.INFO['SIFT_pred'] else None,
-            "HDIV": record.INFO['Polyphen2_HDIV_pred'][0] if record.INFO['Polyphen2_HDIV_pred'] else None,
-            "HVAR": record.INFO['Polyphen2_HVAR_pred'][0] if record.INFO['Polyphen2_HVAR_pred'] else None,
-            "LRT": record.INFO['LRT_pred'][0] if record.INFO['LRT_pred'] else None,
-            "MutationTaster": record.INFO['MutationTaster_pred'][0] if record.INFO['MutationTaster_pred'] else None,
-            "FATHMM": record.INFO['FATHMM_pred'][0] if record.INFO['FATHMM_pred'] else None,
-            "PROVEAN": record.INFO['PROVEAN_pred'][0] if record.INFO['PROVEAN_pred'] else None,
-            "MKL": record.INFO['fathmm-MKL_coding_pred'][0] if record.INFO['fathmm-MKL_coding_pred'] else None,
-            "SVM": record.INFO['MetaSVM_pred'][0] if record.INFO['MetaSVM_pred'] else None,
-            "LR": record.INFO['MetaLR_pred'][0] if record.INFO['MetaLR_pred'] else None
-        }
-
-        # Splicing impact scores
-        splices_scores = {
-            "ADA": record.INFO['dbscSNV_ADA_SCORE'][0] if record.INFO['dbscSNV_ADA_SCORE'] else None,
-            "RF": record.INFO['dbscSNV_RF_SCORE'][0] if record.INFO['dbscSNV_RF_SCORE'] else None,
-            "spliceAI": record.INFO['spliceai_filtered'][0] if record.INFO['spliceai_filtered'] else None,
-        }
-
-        # MPA aggregate the information to predict some effects
-        meta_impact = {
-            "clinvar_pathogenicity": False,
-            "stop_impact": False,
-            "splice_impact": False,
-            "frameshift_impact": False,
-            "indel_impact": False,
-            "unknown_impact": False
-        }
-
-        # Calculate adjusted score for each variants
-        adjusted_score = calculate_adjusted_score(impacts_scores)
-
-        # Determine if variant is annotated with clinvar as deleterious
-        meta_impact["clinvar_pathogenicity"] = is_clinvar_pathogenic(
-            record.INFO['CLNSIG'][0] if record.INFO['CLNSIG'] else None
+        write_gene_summary(gene_summary, args.gene_summary)
+        return
+
+    if read_lines:
+        line_scorer = raw.line_scorer(
+            args.engine, vcf_header, args.no_refseq_version,
+            args.lazy_samples)
+        if args.threads > 1:
+            from mobidic_mpa import parallel
+            log.info(f"Score variants with {args.threads} processes")
+            score_variants = functools.partial(
+                parallel.score_lines,
+                header=vcf_header,
+                engine=args.engine,
+                no_refseq_version=args.no_refseq_version,
+                threads=args.threads,
+                batch_size=args.batch_size,
+                max_batches=args.max_batches,
+                lazy_samples=args.lazy_samples
+            )
+            score_batches = functools.partial(
+                parallel.score_batches,
+                header=vcf_header,
+                engine=args.engine,
+                no_refseq_version=args.no_refseq_version,
+                threads=args.threads,
+                max_batches=args.max_batches,
+                lazy_samples=args.lazy_samples
+            )
+        else:
+            score_variants = functools.partial(
+                raw.score_lines, line_scorer, batch_size=args.batch_size)
+            score_batches = functools.partial(raw.score_batches, line_scorer)
+
+        score_cache = None
+        if use_cache:
+            from mobidic_mpa import cache
+            log.info(f"Use score cache {args.cache}")
+            try:
+                score_cache = cache.ScoreCache(
+                    args.cache, args.no_refseq_version, args.cache_size)
+            except SystemExit as e:
+                log.error(str(e))
+                sys.exit(1)
+            scored_lines = cache.score_lines(
+                score_cache,
+                score_batches,
+                variants,
+                args.batch_size
+            )
+        else:
+            scored_lines = score_variants(variants)
+
+        write_line = metrics.timer(
+            vcf_metrics, "serialize", vcf_writer.stream.write)
+        scored_lines = metrics.timed(vcf_metrics, "score", scored_lines)
+        if vcf_metrics is not None:
+            scored_lines = vcf_metrics.counted(scored_lines)
+        gene_token = filters.gene_key(args.no_refseq_version) + '='
+        if gene_summary is not None:
+            # All scored variants are summarized (before selection)
+            scored_lines = summary.summarized_lines(
+                scored_lines, gene_summary, gene_token)
+        if tracer is not None:
+            from mobidic_mpa import trace
+            site_parser = raw.RawScorer(vcf_header, args.no_refseq_version)
+            scored_lines = tracer.traced_variants(
+                scored_lines,
+                trace.line_site,
+                lambda line: site_parser.parse_line(line)[1:]
+            )
+        selected = filters.select(
+            scored_lines,
+            lambda line: raw.find_info_value(
+                line.split('\t', 8)[7], gene_token),
+            args.max_rank,
+            args.min_score,
+            args.top_k
+        )
+        if args.sort:
+            from mobidic_mpa import sorting
+            output_lines = metrics.timed(
+                vcf_metrics, "sort", sorting.sort_lines(
+                    selected,
+                    args.sort_memory * 1024 * 1024,
+                    None if args.output in (None, "-")
+                    else os.path.dirname(os.path.abspath(args.output))
+                ))
+        else:
+            output_lines = (line for line, _ in selected)
+
+        exporter = None
+        if args.export:
+            from mobidic_mpa import export
+            log.info(f"Export MPA results in {args.export}")
+            try:
+                exporter = export.open_exporter(
+                    args.export, args.export_info or [],
+                    args.no_refseq_version)
+            except SystemExit as e:
+                log.error(str(e))
+                sys.exit(1)
+            export_tokens = export.info_tokens(
+                args.export_info or [], args.no_refseq_version)
+            export_row = metrics.timer(vcf_metrics, "write", exporter.write)
+        try:
+            for line in output_lines:
+                write_line(line)
+                if exporter is not None:
+                    export_row(export.read_row(line, export_tokens))
+        except SystemExit as e:
+            log.error(str(e))
+            sys.exit(2)
+        finally:
+            if score_cache is not None:
+                score_cache.evict()
+                cache_stats = score_cache.stats()
+                score_cache.close()
+            if exporter is not None:
+                exporter.close()
+            close_tracer(tracer, args.trace)
+        vcf_writer.close()
+        if score_cache is not None:
+            log.info(
+                f"Score cache: {cache_stats['hits']} hits, "
+                f"{cache_stats['misses']} misses, "
+                f"{cache_stats['size']} variants cached")
+            if vcf_metrics is not None:
+                vcf_metrics.cache = cache_stats
+        write_gene_summary(gene_summary, args.gene_summary)
+        log.debug(f"Classification cache: {classify.cache_info()}")
+        return
+
+    write_record = metrics.timer(
+        vcf_metrics, "serialize", vcf_writer.write_record)
+    gene_key = filters.gene_key(args.no_refseq_version)
+
+    def gene_of(record):
+        return ','.join(str(gene) for gene in record.INFO.get(gene_key) or [])
+
+    scored_records = score_records(
+        variants, args.no_refseq_version, vcf_metrics)
+    if gene_summary is not None:
+        scored_records = summary.summarized_records(
+            scored_records, gene_summary, gene_of)
+    if tracer is not None:
+        from mobidic_mpa import summary
+        vcf_keys = annotation_keys(args.no_refseq_version)
+        scored_records = tracer.traced_variants(
+            scored_records,
+            summary.record_site,
+            lambda record: (
+                get_annotations(record.INFO, vcf_keys),
+                (not record.is_snv())
+            )
         )
+    for record, _ in filters.select(
+        scored_records,
+        gene_of,
+        args.max_rank,
+        args.min_score,
+        args.top_k
+    ):
+        write_record(record)
+    vcf_writer.close()
+    close_tracer(tracer, args.trace)
+    write_gene_summary(gene_summary, args.gene_summary)
+    log.debug(f"Classification cache: {classify.cache_info()}")
 
-        FuncKey = f'Func.{refSeqExt}'
-        ExonicFuncKey = f'ExonicFunc.{refSeqExt}'
 
-        # Determine the impact on splicing
-        meta_impact["splice_impact"] = is_splice_impact(
-            splices_scores,
-            (not record.is_snv()),
-            record.INFO[FuncKey][0]
+def annotate_bcf(args, vcf_metrics=None):
+    """
+    @summary: Annotate a BCF (or write a BCF) with MPA score. Records are \
+        read and written by htslib, INFO values used by MPA are read typed \
+        from the binary records.
+    @param args: [Namespace] The namespace extract from the script arguments.
+    @param vcf_metrics: [Metrics] The metrics collected (None to disable).
+    """
+    from mobidic_mpa import bcf
+    from mobidic_mpa import progress
+
+    if (
+        args.threads > 1 or args.split_by or args.cache or args.sort or
+        args.export or args.pipeline or args.split_alleles
+    ):
+        log.warning(
+            "Threads, split by region, score cache, sort, export, pipeline "
+            "and allele splitting are not used with BCF.")
+
+    log.info("Read BCF file")
+    try:
+        vcf_reader = bcf.open_input(args.input)
+    except SystemExit as e:
+        log.error(str(e))
+        sys.exit(1)
+    variants = metrics.timed(vcf_metrics, "read", vcf_reader)
+
+    log.info("Check vcf annotations")
+    try:
+        metrics.timer(vcf_metrics, "validate", check_annotation)(
+            list(vcf_reader.header.info), args.no_refseq_version)
+    except SystemExit as e:
+        log.error(str(e))
+        sys.exit(1)
+
+    # Without output, nothing is written
+    vcf_header = bcf.output_header(vcf_reader.header)
+    try:
+        vcf_writer = bcf.open_output(
+            args.output or os.devnull,
+            vcf_header,
+            args.bgzip or None,
+            args.compress_threads
         )
+    except SystemExit as e:
+        log.error(str(e))
+        sys.exit(1)
+
+    first_variant = next(variants, None)
+    if first_variant is None:
+        log.warn("No variant in VCF. Exit.")
+        sys.exit(0)
+    variants = progress.track(
+        itertools.chain([first_variant], variants),
+        None,
+        args.no_progress_bar
+    )
 
-        # Determine the exonic impact
-        match_exonic = re.search(
-            "exonic",
-            record.INFO[FuncKey][0],
-            re.IGNORECASE
+    log.info("Read each variants")
+    annotator = bcf.RecordAnnotator(vcf_header, args.no_refseq_version)
+    write_record = metrics.timer(vcf_metrics, "write", vcf_writer.write)
+    gene_key = filters.gene_key(args.no_refseq_version)
+    scored_records = bcf.score_records(annotator, variants, vcf_metrics)
+    gene_summary = None
+    if args.gene_summary:
+        from mobidic_mpa import summary
+        gene_summary = summary.GeneSummary(args.summary_top)
+        scored_records = summary.summarized_records(
+            scored_records,
+            gene_summary,
+            lambda record: bcf.gene_of(record, gene_key)
+        )
+    tracer = open_tracer(args)
+    if tracer is not None:
+        from mobidic_mpa import raw
+        from mobidic_mpa import summary
+        scored_records = tracer.traced_variants(
+            scored_records,
+            summary.record_site,
+            lambda record: (
+                annotator.annotations(record),
+                (not raw.is_snv(raw.Site(*summary.record_site(record))))
+            )
         )
-        if (
-            match_exonic and
-            record.INFO[ExonicFuncKey]
+    try:
+        for record, _ in filters.select(
+            scored_records,
+            lambda record: bcf.gene_of(record, gene_key),
+            args.max_rank,
+            args.min_score,
+            args.top_k
         ):
-            # Determine the stop impact
-            meta_impact["stop_impact"] = is_stop_impact(
-                record.INFO[ExonicFuncKey][0])
-
-            # Determine the start impact
-            meta_impact["start_impact"] = is_start_impact(
-                record.INFO[ExonicFuncKey][0])
-
-            # Determine the frameshift impact
-            if is_indel_impact(record.INFO[ExonicFuncKey][0]) == 8:
-                meta_impact["indel_impact"] = 8
-            if is_indel_impact(record.INFO[ExonicFuncKey][0]) == 2:
-                meta_impact["frameshift_impact"] = 2
-
-            # Determine the missense impact
-            meta_impact["missense_impact"] = is_missense_impact(
-                record.INFO[ExonicFuncKey][0],
-                adjusted_score["adjusted"])
-
-            # Determine if unknown impact (misunderstand gene)
-            # NOTE: /!\ Be careful to updates regularly your databases /!\
-            meta_impact["unknown_impact"] = is_unknown_impact(
-                record.INFO[ExonicFuncKey][0])
-
-        log.debug(f"Meta score : {meta_impact}")
-
-        # Ranking of variants
-        rank = False
-        record.INFO['MPA_impact'] = []
-        for impact in meta_impact:
-            if (meta_impact[impact]):
-                record.INFO['MPA_impact'].append(impact)
-
-                if(meta_impact[impact] < rank or not rank):
-
-                    rank = meta_impact[impact]
-
-                    if (
-                        impact == "unknown_impact" or
-                        impact == "missense_impact"
-                    ):
-                        adjusted_score["final_score"] = \
-                            adjusted_score["adjusted"]
-                    elif (
-                        impact == "splice_impact" and
-                        meta_impact["splice_impact"] == 6
-                    ):
-                        adjusted_score["final_score"] = 6
-                    elif (
-                        impact == "splice_impact" and
-                        meta_impact["splice_impact"] == 8
-                    ):
-                        adjusted_score["final_score"] = 2
-                    elif (
-                        impact == "indel_impact" and
-                        meta_impact["indel_impact"] == 8
-                    ):
-                        adjusted_score["final_score"] = 8
-                    elif (
-                        impact == "frameshift_impact" and
-                        meta_impact["frameshift_impact"] == 2
-                    ):
-                        adjusted_score["final_score"] = 2
-                    else:
-                        adjusted_score["final_score"] = 10
-
-        # if not ranking default value 10
-        if not rank:
-            rank = 10
-            record.INFO['MPA_impact'] = ["NULL"]
-            adjusted_score["final_score"] = str(adjusted_score["adjusted"])
-
-        log.debug(f"Ranking : {rank}")
-
-        # write vcf output
-        # record.INFO['MPA_impact'] = record.INFO['MPA_impact'][:-1]
-        record.INFO['MPA_ranking'] = int(rank)
-        for sc in adjusted_score:
-            record.INFO['MPA_' + sc] = str(adjusted_score[sc])
-
-        vcf_writer.write_record(record)
-    vcf_writer.close()
+            write_record(record)
+    except SystemExit as e:
+        log.error(str(e))
+        sys.exit(2)
+    finally:
+        vcf_writer.close()
+        vcf_reader.close()
+        close_tracer(tracer, args.trace)
+    write_gene_summary(gene_summary, args.gene_summary)
+    log.debug(f"Classification cache: {classify.cache_info()}")
+
+
+def open_tracer(args):
+    """
+    @summary: Open the trace of the scoring decisions of sampled variants.
+    @param args: [Namespace] The namespace extract from the script arguments.
+    @return: [Tracer] The tracer (None without trace).
+    """
+    if not args.trace:
+        return None
+    from mobidic_mpa import trace
+
+    rate = args.trace_rate
+    if not (rate or args.trace_region or args.trace_ids):
+        log.warning("No trace rate, region or ID: trace all variants.")
+        rate = 1.0
+    try:
+        tracer = trace.Tracer(
+            args.trace,
+            rate,
+            args.trace_region,
+            args.trace_ids,
+            args.no_refseq_version
+        )
+    except SystemExit as e:
+        log.error(str(e))
+        sys.exit(1)
+    except OSError as e:
+        log.error(f"Cannot write the trace {args.trace}: {e}")
+        sys.exit(1)
+    log.info(f"Trace scoring decisions in {args.trace}")
+    return tracer
+
+
+def close_tracer(tracer, path):
+    """
+    @summary: Close the trace of the scoring decisions.
+    @param tracer: [Tracer] The tracer (None without trace).
+    @param path: [str] The path of the trace.
+    """
+    if tracer is None:
+        return
+    tracer.close()
+    log.info(f"{tracer.traced} variants traced in {path}")
+
+
+def write_gene_summary(gene_summary, path):
+    """
+    @summary: Write the summary per gene of the scored variants.
+    @param gene_summary: [GeneSummary] The summary (None if not summarized).
+    @param path: [str] The path of the summary (JSON for ".json", TSV \
+        otherwise).
+    """
+    if gene_summary is None:
+        return
+    log.info(
+        f"Write the summary of {len(gene_summary.genes)} genes in {path}")
+    try:
+        gene_summary.write(path)
+    except OSError as e:
+        log.error(f"Cannot write the summary per gene {path}: {e}")
+        sys.exit(1)
+
+
+def score_records(variants, no_refseq_version=True, vcf_metrics=None):
+    """
+    @summary: Score vcfpy records and add MPA fields to them.
+    @param variants: [iterable] The vcfpy records.
+    @param no_refseq_version: [bool] Annotation without refseq version.
+    @param vcf_metrics: [Metrics] The metrics collected (None to disable).
+    @return: [generator] The records with MPA fields and the MPA fields.
+    """
+    vcf_keys = annotation_keys(no_refseq_version)
+
+    # Functions of each stage (timed only if metrics are collected)
+    check_record = metrics.timer(vcf_metrics, "validate", check_split_variants)
+    read_annotations = metrics.timer(vcf_metrics, "score", get_annotations)
+    score_record = metrics.timer(vcf_metrics, "score", score_annotations)
+
+    for record in variants:
+        log.debug("%s", record)
+
+        try:
+            check_record(record)
+        except SystemExit as e:
+            log.error(str(record))
+            log.error(str(e))
+            sys.exit(2)
+
+        # Score the variant and add MPA fields to the record
+        mpa_fields = score_record(
+            read_annotations(record.INFO, vcf_keys),
+            (not record.is_snv()),
+            no_refseq_version
+        )
+        record.INFO.update(mpa_fields)
+        if vcf_metrics is not None:
+            vcf_metrics.count(mpa_fields)
+
+        yield record, mpa_fields
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import re
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# INFO entries opening and closing the annotations of one alternative allele
+# (ANNOVAR writes one block per allele of a multi-allelic variant)
+ALLELE_START = "ANNOVAR_DATE"
+ALLELE_END = "ALLELE_END"
+
+# Separators of the alleles of a genotype
+GT_SEPARATOR = re.compile(r"([/|])")
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class AlleleSplitter(object):
+    """
+    @summary: Decompose multi-allelic vcf lines into one line per \
+        alternative allele, as "bcftools norm -m -" does, while the vcf is \
+        read. The ANNOVAR block of each allele and the values of Number=A/R/G \
+        fields are kept for their allele; genotypes of the other alleles \
+        become the reference.
+    """
+    def __init__(self, header):
+        """
+        @param header: [vcfpy.Header] The header of the vcf
+        """
+        self._info_numbers = {
+            key: header.get_info_field_info(key).number
+            for key in header.info_ids()
+        }
+        self._format_numbers = {
+            key: header.get_format_field_info(key).number
+            for key in header.format_ids()
+        }
+
+    def split_line(self, line):
+        """
+        @summary: Split a vcf line by alternative allele
+        @param line: [str] The raw vcf line
+        @return: [list] The biallelic vcf lines (the line itself if it has \
+            one alternative allele)
+        """
+        columns = line.rstrip("\n").split("\t")
+        alts = columns[4].split(",")
+        if len(alts) < 2:
+            return [line]
+
+        blocks = _allele_blocks(columns[7].split(";"))
+        if blocks is not None and len(blocks[1]) != len(alts):
+            blocks = None
+        lines = []
+        for index, alt in enumerate(alts):
+            split = list(columns)
+            split[4] = alt
+            split[7] = self._split_info(blocks, columns[7], index, len(alts))
+            if len(columns) > 9:
+                split[9:] = [
+                    self._split_sample(
+                        columns[8].split(":"), sample, index, len(alts))
+                    for sample in columns[9:]
+                ]
+            lines.append("\t".join(split) + "\n")
+        return lines
+
+    def split_lines(self, lines):
+        """
+        @summary: Split the multi-allelic lines of a vcf
+        @param lines: [iterable] The raw vcf lines
+        @return: [generator] The biallelic vcf lines
+        """
+        for line in lines:
+            yield from self.split_line(line)
+
+    def _split_info(self, blocks, info, index, count):
+        """
+        @summary: Keep the INFO entries of one allele
+        @param blocks: [tuple] The entries before, in and after the ANNOVAR \
+            blocks (see _allele_blocks), None to use the whole column
+        @param info: [str] The raw INFO column
+        @param index: [int] The index of the alternative allele
+        @param count: [int] The number of alternative alleles
+        @return: [str] The INFO column of the allele
+        """
+        if info == ".":
+            return info
+        if blocks is None:
+            entries = info.split(";")
+        else:
+            before, alleles, after = blocks
+            entries = before + alleles[index] + after
+        return ";".join(
+            self._split_entry(entry, index, count) for entry in entries)
+
+    def _split_entry(self, entry, index, count):
+        """
+        @summary: Keep the value of one allele of a Number=A/R INFO entry
+        @param entry: [str] The INFO entry ("key=value" or a flag)
+        @param index: [int] The index of the alternative allele
+        @param count: [int] The number of alternative alleles
+        @return: [str] The INFO entry of the allele
+        """
+        key, separator, value = entry.partition("=")
+        if not separator:
+            return entry
+        value = _split_values(
+            self._info_numbers.get(key), value, index, count)
+        return f"{key}={value}"
+
+    def _split_sample(self, keys, sample, index, count):
+        """
+        @summary: Keep the values of one allele of a sample
+        @param keys: [list] The FORMAT keys
+        @param sample: [str] The raw sample column
+        @param index: [int] The index of the alternative allele
+        @param count: [int] The number of alternative alleles
+        @return: [str] The sample column of the allele
+        """
+        values = sample.split(":")
+        ploidy = 2
+        for i, (key, value) in enumerate(zip(keys, values)):
+            if key == "GT":
+                alleles = GT_SEPARATOR.split(value)
+                ploidy = len(alleles[::2])
+                values[i] = "".join(
+                    allele if j % 2 or allele == "." else
+                    "1" if allele == str(index + 1) else "0"
+                    for j, allele in enumerate(alleles)
+                )
+            else:
+                values[i] = _split_values(
+                    self._format_numbers.get(key), value, index, count,
+                    ploidy)
+        return ":".join(values)
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def _allele_blocks(entries):
+    """
+    @summary: Find the ANNOVAR blocks of each allele in INFO entries
+    @param entries: [list] The INFO entries
+    @return: [tuple] The entries before the blocks, the entries of each \
+        block and the entries after the blocks (None without block)
+    """
+    starts = [
+        i for i, entry in enumerate(entries)
+        if entry.partition("=")[0] == ALLELE_START
+    ]
+    if not starts:
+        return None
+    ends = []
+    for start in starts:
+        try:
+            ends.append(entries.index(ALLELE_END, start) + 1)
+        except ValueError:
+            return None
+    return (
+        entries[:starts[0]],
+        [entries[start:end] for start, end in zip(starts, ends)],
+        entries[ends[-1]:]
+    )
+
+
+def _split_values(number, value, index, count, ploidy=2):
+    """
+    @summary: Keep the values of one allele of a field
+    @param number: [str/int] The Number of the field in the header
+    @param value: [str] The raw values (comma separated)
+    @param index: [int] The index of the alternative allele
+    @param count: [int] The number of alternative alleles
+    @param ploidy: [int] The ploidy of the sample (Number=G)
+    @return: [str] The raw values of the allele (unchanged for other \
+        Number or if the number of values does not match)
+    """
+    if number not in ("A", "R", "G"):
+        return value
+    values = value.split(",")
+    allele = index + 1
+    if number == "A" and len(values) == count:
+        return values[index]
+    if number == "R" and len(values) == count + 1:
+        return ",".join([values[0], values[allele]])
+    if number == "G":
+        if ploidy == 1 and len(values) == count + 1:
+            return ",".join([values[0], values[allele]])
+        # Genotype (j, k) with j <= k is at k * (k + 1) / 2 + j
+        if ploidy == 2 and len(values) == (count + 1) * (count + 2) // 2:
+            return ",".join([
+                values[0],
+                values[allele * (allele + 1) // 2],
+                values[allele * (allele + 1) // 2 + allele]
+            ])
+    return value
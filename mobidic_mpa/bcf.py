@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import sys
+import contextlib
+import pysam
+
+import mobidic_mpa
+from mobidic_mpa import raw
+from mobidic_mpa import metrics
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Python type of the MPA fields set on htslib records (MPA_impact is a list,
+# Float fields are stored as 32-bit floats by htslib)
+MPA_TYPES = {
+    "MPA_ranking": int,
+    "MPA_final_score": float,
+    "MPA_adjusted": float,
+    "MPA_available": int,
+    "MPA_deleterious": int
+}
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class RecordAnnotator(object):
+    """
+    @summary: Score htslib records (pysam.VariantRecord) of a BCF or VCF. \
+        The INFO values used by MPA are read typed from the binary record, \
+        other columns are copied as is by htslib.
+    """
+    def __init__(self, header, no_refseq_version=True):
+        """
+        @param header: [pysam.VariantHeader] The header of the output (with \
+            MPA fields)
+        @param no_refseq_version: [bool] Annotation without refseq version
+        """
+        self.header = header
+        self.no_refseq_version = no_refseq_version
+        self.keys = mobidic_mpa.annotation_keys(no_refseq_version)
+
+    def annotations(self, record):
+        """
+        @summary: Read the annotations used by MPA from a record
+        @param record: [pysam.VariantRecord] The record
+        @return: [dict] The first value of each annotation (None if empty, \
+            see mobidic_mpa.get_annotations)
+        """
+        annotations = dict()
+        for key in self.keys:
+            value = record.info.get(key)
+            if value is not None:
+                if not isinstance(value, tuple):
+                    value = (value,)
+                # htslib keeps the "." of string values
+                value = [None if v == "." else v for v in value]
+            if not value:
+                value = None
+            elif key not in mobidic_mpa.MULTIPLE_VALUES_KEYS:
+                value = value[0]
+            annotations[key] = value
+        return annotations
+
+    def score_record(self, record):
+        """
+        @summary: Score one record and add the MPA fields to it
+        @param record: [pysam.VariantRecord] The record (read with the input \
+            header)
+        @return: [tuple] The record with MPA fields (on the output header) \
+            and the MPA fields
+        """
+        site = raw.Site(
+            record.chrom,
+            record.pos,
+            record.id,
+            record.ref,
+            list(record.alts or [])
+        )
+        mobidic_mpa.check_split_variants(site)
+
+        mpa_fields = mobidic_mpa.score_annotations(
+            self.annotations(record),
+            (not raw.is_snv(site)),
+            self.no_refseq_version
+        )
+        record.translate(self.header)
+        set_info_fields(record, mpa_fields)
+        return record, mpa_fields
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+@contextlib.contextmanager
+def quiet():
+    """
+    @summary: Hide htslib warnings while parsing a header: ANNOVAR keys are \
+        not valid BCF keys (e.g. "GERP++_RS") and the index of the input is \
+        not needed to read the whole file
+    """
+    verbosity = pysam.set_verbosity(0)
+    try:
+        yield
+    finally:
+        pysam.set_verbosity(verbosity)
+
+
+def is_bcf(path):
+    """
+    @summary: Define if a path is a BCF file from its extension
+    @param path: [str] The path
+    @return: [bool] True for ".bcf" paths
+    """
+    return path is not None and path.endswith(".bcf")
+
+
+def open_input(path):
+    """
+    @summary: Open a BCF or VCF with htslib
+    @param path: [str] The path of the file ("-" for the standard input)
+    @return: [pysam.VariantFile] The input file
+    """
+    try:
+        with quiet():
+            return pysam.VariantFile(path, "r")
+    except (OSError, ValueError) as e:
+        sys.exit(f"Cannot read {path}: {e}")
+
+
+def output_header(header):
+    """
+    @summary: Copy a header and add the MPA INFO lines (as vcfpy \
+        add_info_line would do)
+    @param header: [pysam.VariantHeader] The header of the input
+    @return: [pysam.VariantHeader] The header of the output
+    """
+    with quiet():
+        header = header.copy()
+    for info in mobidic_mpa.MPA_INFOS:
+        if info["ID"] in header.info:
+            continue
+        header.add_line("##INFO=<{}>".format(",".join(
+            '{}="{}"'.format(key, value) if key in ("Description", "Source")
+            else "{}={}".format(key, value)
+            for key, value in info.items()
+        )))
+    return header
+
+
+def open_output(path, header, compress=None, threads=1):
+    """
+    @summary: Open the output with htslib (BCF for ".bcf" paths)
+    @param path: [str] The path of the output ("-" for the standard output)
+    @param header: [pysam.VariantHeader] The header of the output (see \
+        output_header)
+    @param compress: [bool] Write a BGZF vcf (default for ".gz" and ".bgz" \
+        paths)
+    @param threads: [int] The number of compression threads
+    @return: [pysam.VariantFile] The output file
+    """
+    try:
+        with quiet():
+            return pysam.VariantFile(
+                path, output_mode(path, compress), header=header,
+                threads=threads)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Cannot write {path}: {e}")
+
+
+def output_mode(path, compress=None):
+    """
+    @summary: Define the htslib mode of an output
+    @param path: [str] The path of the output ("-" for the standard output)
+    @param compress: [bool] Write a BGZF vcf (default for ".gz" and ".bgz" \
+        paths)
+    @return: [str] "wb" for BCF, "wz" for a bgzipped vcf, "w" otherwise
+    """
+    if is_bcf(path):
+        return "wb"
+    if compress is None:
+        compress = raw.is_compressed(path)
+    return "wz" if compress else "w"
+
+
+def set_info_fields(record, mpa_fields):
+    """
+    @summary: Set the MPA fields of a record with the types of their header \
+        lines
+    @param record: [pysam.VariantRecord] The record (on the output header)
+    @param mpa_fields: [OrderedDict] The MPA fields (see score_annotations)
+    """
+    for key, value in mpa_fields.items():
+        if key in MPA_TYPES:
+            record.info[key] = MPA_TYPES[key](value)
+        else:
+            record.info[key] = tuple(value)
+
+
+def gene_of(record, gene_key):
+    """
+    @summary: Read the gene of a record
+    @param record: [pysam.VariantRecord] The record
+    @param gene_key: [str] The INFO key of the gene (see filters.gene_key)
+    @return: [str] The gene (None if missing)
+    """
+    value = record.info.get(gene_key)
+    if isinstance(value, tuple):
+        return ",".join(str(gene) for gene in value)
+    return value
+
+
+def score_records(annotator, variants, vcf_metrics=None):
+    """
+    @summary: Score htslib records and add MPA fields to them
+    @param annotator: [RecordAnnotator] The record scorer
+    @param variants: [iterable] The records of the input
+    @param vcf_metrics: [Metrics] The metrics collected (None to disable)
+    @return: [generator] The records with MPA fields and the MPA fields
+    """
+    score_record = metrics.timer(vcf_metrics, "score", annotator.score_record)
+    for record in variants:
+        try:
+            record, mpa_fields = score_record(record)
+        except SystemExit as e:
+            raise SystemExit("{}\n{}".format(str(record).rstrip(), e))
+        if vcf_metrics is not None:
+            vcf_metrics.count(mpa_fields)
+        yield record, mpa_fields
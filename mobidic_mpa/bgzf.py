@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import io
+import zlib
+import struct
+import collections
+import concurrent.futures
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Maximum size of the uncompressed data of a block (same as htslib)
+BLOCK_SIZE = 0xff00
+
+# Header of a BGZF block (gzip header with the BC extra field), followed by
+# the size of the block minus one
+BLOCK_HEADER = bytes.fromhex("1f8b08040000000000ff060042430200")
+
+# Empty BGZF block marking the end of a BGZF file
+EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class BgzfWriter(io.RawIOBase):
+    """
+    @summary: Binary file writing BGZF blocks. Blocks are compressed by a \
+        pool of threads (zlib releases the GIL) and written in order.
+    """
+    def __init__(self, fileobj, threads=1, level=6):
+        """
+        @param fileobj: [file] The binary file object of the output (closed \
+            with the writer)
+        @param threads: [int] The number of compression threads
+        @param level: [int] The compression level
+        """
+        super().__init__()
+        self._fileobj = fileobj
+        self._level = level
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._max_pending = 4 * threads
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """
+        @summary: Write data, full blocks are sent to the compression threads
+        @param data: [bytes] The uncompressed data
+        @return: [int] The number of bytes written
+        """
+        self._buffer += data
+        if len(self._buffer) >= BLOCK_SIZE:
+            view = memoryview(self._buffer)
+            end = len(self._buffer) - len(self._buffer) % BLOCK_SIZE
+            for start in range(0, end, BLOCK_SIZE):
+                self._submit(bytes(view[start:start + BLOCK_SIZE]))
+            view.release()
+            del self._buffer[:end]
+        return len(data)
+
+    def _submit(self, block):
+        """
+        @summary: Compress a block in a thread and write the oldest blocks \
+            when too many blocks are in flight
+        @param block: [bytes] The uncompressed block
+        """
+        self._pending.append(
+            self._executor.submit(compress_block, block, self._level))
+        while len(self._pending) > self._max_pending:
+            self._fileobj.write(self._pending.popleft().result())
+
+    def close(self):
+        """
+        @summary: Write the remaining data and the end of file marker
+        """
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+            self._fileobj.write(EOF)
+        finally:
+            self._executor.shutdown()
+            self._fileobj.close()
+            super().close()
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def compress_block(data, level=6):
+    """
+    @summary: Compress data as one BGZF block
+    @param data: [bytes] The uncompressed data (at most BLOCK_SIZE bytes)
+    @param level: [int] The compression level
+    @return: [bytes] The BGZF block
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return b"".join([
+        BLOCK_HEADER,
+        struct.pack("<H", len(compressed) + 25),
+        compressed,
+        struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+    ])
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import re
+import sys
+import json
+import hashlib
+import sqlite3
+import collections
+
+import mobidic_mpa
+from mobidic_mpa import raw
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Default maximum number of variants kept in the cache
+MAX_SIZE = 10000000
+
+# Maximum number of keys looked up by one query
+QUERY_SIZE = 500
+
+# Number of runs after which the last use of a variant is updated (hits do
+# not write to the database otherwise)
+REFRESH_RUNS = 10
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS scores (
+        key BLOB PRIMARY KEY,
+        fields TEXT NOT NULL,
+        info TEXT NOT NULL,
+        used INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS scores_used ON scores (used)",
+    """CREATE TABLE IF NOT EXISTS runs (
+        run INTEGER PRIMARY KEY AUTOINCREMENT
+    )"""
+]
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class ScoreCache(object):
+    """
+    @summary: Persistent cache of MPA fields (SQLite). Variants are keyed by \
+        their site, the raw INFO entries of the annotations read by MPA (in \
+        the order of the INFO column) and the MPA version. The MPA fields \
+        are stored with their INFO entries, added as is to the lines. When \
+        the cache is full, the variants used by the oldest runs are evicted \
+        (the last use of a variant is only updated every REFRESH_RUNS runs).
+    """
+    def __init__(self, path, no_refseq_version=True, max_size=MAX_SIZE,
+                 version=None):
+        """
+        @param path: [str] The path of the SQLite database (created if needed)
+        @param no_refseq_version: [bool] Annotation without refseq version
+        @param max_size: [int] The maximum number of variants kept
+        @param version: [str] The MPA version (default to the installed one)
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        keys = mobidic_mpa.annotation_keys(no_refseq_version)
+        # The entries of these keys are found in one pass over the INFO
+        # column (preceded by ";", the lookahead skips the other entries)
+        self._entries = re.compile(";(?=[{}])(?:{})=[^;]*".format(
+            "".join(sorted(set(re.escape(key[0]) for key in keys))),
+            "|".join(re.escape(key) for key in keys)
+        ))
+        self._prefix = "{}\t{}\t".format(
+            version or mobidic_mpa.__version__, no_refseq_version).encode()
+        try:
+            self._db = sqlite3.connect(path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            with self._db:
+                for statement in SCHEMA:
+                    self._db.execute(statement)
+                # Each run marks the variants it uses (for eviction)
+                self._run = self._db.execute(
+                    "INSERT INTO runs DEFAULT VALUES").lastrowid
+        except sqlite3.Error as e:
+            sys.exit(f"Cannot open the score cache {path}: {e}")
+
+    def key(self, line):
+        """
+        @summary: Build the key of a vcf line (no annotation is decoded)
+        @param line: [str] The raw vcf line
+        @return: [bytes] The key
+        """
+        columns = line.split('\t', 8)
+        fingerprint = hashlib.blake2b(self._prefix, digest_size=16)
+        fingerprint.update('\t'.join(
+            columns[:2] + columns[3:5] +
+            self._entries.findall(';' + columns[7])
+        ).encode())
+        return fingerprint.digest()
+
+    def get_many(self, keys):
+        """
+        @summary: Look up the MPA fields of several variants
+        @param keys: [list] The keys of the variants (see key)
+        @return: [dict] The INFO entries (list, see raw.format_info_fields) \
+            and the MPA fields of variants found
+        """
+        found = dict()
+        stale = []
+        distinct = list(set(keys))
+        for start in range(0, len(distinct), QUERY_SIZE):
+            chunk = distinct[start:start + QUERY_SIZE]
+            marks = ",".join("?" * len(chunk))
+            for key, fields, info, used in self._db.execute(
+                "SELECT key, fields, info, used FROM scores "
+                f"WHERE key IN ({marks})", chunk
+            ):
+                found[key] = (info.split(";"), decode_fields(fields))
+                if used <= self._run - REFRESH_RUNS:
+                    stale.append(key)
+        for start in range(0, len(stale), QUERY_SIZE):
+            chunk = stale[start:start + QUERY_SIZE]
+            self._db.execute(
+                "UPDATE scores SET used = ? WHERE key IN ({})".format(
+                    ",".join("?" * len(chunk))),
+                [self._run] + chunk)
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, scores):
+        """
+        @summary: Store the MPA fields of several variants
+        @param scores: [dict] The MPA fields (OrderedDict) of each key
+        """
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO scores (key, fields, info, used) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    (
+                        key,
+                        encode_fields(mpa_fields),
+                        ";".join(raw.format_info_fields(mpa_fields)),
+                        self._run
+                    )
+                    for key, mpa_fields in scores.items()
+                )
+            )
+
+    def size(self):
+        """
+        @summary: Number of variants in the cache
+        @return: [int] The number of variants
+        """
+        return self._db.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+
+    def evict(self):
+        """
+        @summary: Remove the variants used by the oldest runs when the cache \
+            is larger than max_size
+        @return: [int] The number of variants removed
+        """
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return 0
+        with self._db:
+            self._db.execute(
+                "DELETE FROM scores WHERE key IN "
+                "(SELECT key FROM scores ORDER BY used LIMIT ?)", (excess,))
+        return excess
+
+    def stats(self):
+        """
+        @summary: Statistics of the cache for this run
+        @return: [dict] The number of hits, misses, the hit rate and the \
+            number of variants cached
+        """
+        lookups = self.hits + self.misses
+        return collections.OrderedDict([
+            ("hits", self.hits),
+            ("misses", self.misses),
+            ("hit_rate", round(self.hits / lookups, 4) if lookups else None),
+            ("size", self.size())
+        ])
+
+    def close(self):
+        """
+        @summary: Close the database (see evict to bound its size)
+        """
+        self._db.commit()
+        self._db.close()
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def encode_fields(mpa_fields):
+    """
+    @summary: Serialize MPA fields
+    @param mpa_fields: [OrderedDict] The MPA fields (see score_annotations)
+    @return: [str] The serialized fields
+    """
+    return json.dumps(mpa_fields, separators=(',', ':'))
+
+
+def decode_fields(fields):
+    """
+    @summary: Deserialize MPA fields
+    @param fields: [str] The serialized fields (see encode_fields)
+    @return: [dict] The MPA fields, in the order of score_annotations
+    """
+    return json.loads(fields)
+
+
+def score_lines(score_cache, score_batches, lines, batch_size=1000):
+    """
+    @summary: Score vcf lines, only variants missing from the cache are \
+        scored (results are returned in the input order). Cached MPA fields \
+        are added to the raw lines, the other columns are written as read.
+    @param score_cache: [ScoreCache] The cache
+    @param score_batches: [function] Score an iterable of batches of lines, \
+        returns the vcf lines with MPA fields and the MPA fields of each \
+        batch (e.g. raw.score_batches)
+    @param lines: [iterable] The raw vcf lines
+    @param batch_size: [int] The number of lines looked up at once
+    @return: [generator] The vcf lines with MPA fields and the MPA fields
+    """
+    # Batches read from the input and not written yet: lines, keys and
+    # cached fields (bounded by the batches in flight of the scorer)
+    batches = collections.deque()
+
+    def misses():
+        for batch in raw.batched(lines, batch_size):
+            keys = [score_cache.key(line) for line in batch]
+            cached = score_cache.get_many(keys)
+            batches.append((batch, keys, cached))
+            # Each batch is sent, even without miss, so that its results
+            # come back before the next batches are read
+            yield [
+                line for line, key in zip(batch, keys) if key not in cached
+            ]
+
+    for scored in score_batches(misses()):
+        batch, keys, cached = batches.popleft()
+        scored = iter(scored)
+        new_scores = dict()
+        for line, key in zip(batch, keys):
+            if key in cached:
+                entries, mpa_fields = cached[key]
+                yield raw.annotate_line(line, entries), mpa_fields
+                continue
+            result = next(scored)
+            new_scores[key] = result[1]
+            yield result
+        if new_scores:
+            score_cache.put_many(new_scores)
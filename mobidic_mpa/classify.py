@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import re
+import functools
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Maximum number of distinct annotations kept in the classification cache
+CACHE_SIZE = 4096
+
+# Bits of the mask of an annotation (Func, ExonicFunc or CLNSIG)
+CLINVAR_PATHOGENIC = 1 << 0  # pathogenic, without benign nor conflicting
+EXONIC = 1 << 1              # exonic
+SPLICING = 1 << 2            # splicing
+STOP = 1 << 3                # stoploss or stopgain
+START = 1 << 4               # startloss
+FRAMESHIFT = 1 << 5          # frameshift, without nonframeshift
+NONFRAMESHIFT = 1 << 6       # nonframeshift
+MISSENSE = 1 << 7            # nonsynonymous_SNV
+UNKNOWN = 1 << 8             # unknown
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def _search(pattern, annotation):
+    """
+    @summary: Case insensitive search of a pattern in an annotation
+    @param pattern: [str] The searched pattern
+    @param annotation: [str] The annotation
+    @return: [bool] True if the pattern is found
+    """
+    return re.search(pattern, annotation, re.IGNORECASE) is not None
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def classify(annotation):
+    """
+    @summary: Classify an annotation (Func, ExonicFunc or CLNSIG) as a mask \
+        of impact bits. Annotations come from a small vocabulary, each \
+        distinct value is classified once and kept in a bounded cache.
+    @param annotation: [str] The annotation (None if empty)
+    @return: [int] The mask of impact bits (see CONSTANTS)
+    """
+    if not annotation:
+        return 0
+
+    mask = 0
+    if (
+        _search("pathogenic", annotation) and
+        not _search("benign", annotation) and
+        not _search("conflicting", annotation)
+    ):
+        mask |= CLINVAR_PATHOGENIC
+    if _search("exonic", annotation):
+        mask |= EXONIC
+    if _search("splicing", annotation):
+        mask |= SPLICING
+    if _search("stoploss", annotation) or _search("stopgain", annotation):
+        mask |= STOP
+    if _search("startloss", annotation):
+        mask |= START
+    if _search("nonframeshift", annotation):
+        mask |= NONFRAMESHIFT
+    elif _search("frameshift", annotation):
+        mask |= FRAMESHIFT
+    if _search("nonsynonymous_SNV", annotation):
+        mask |= MISSENSE
+    if _search("unknown", annotation):
+        mask |= UNKNOWN
+    return mask
+
+
+def cache_info():
+    """
+    @summary: Statistics of the classification cache
+    @return: [dict] The number of hits, misses and cached annotations
+    """
+    info = classify.cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize
+    }
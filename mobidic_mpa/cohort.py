@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import sys
+import glob
+import time
+import logging
+import collections
+import concurrent.futures
+
+import mobidic_mpa
+from mobidic_mpa import raw
+from mobidic_mpa import alleles
+from mobidic_mpa import filters
+from mobidic_mpa import sorting
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Name of the report written in the output directory
+REPORT_NAME = "mpa_cohort.tsv"
+
+REPORT_COLUMNS = ["input", "output", "status", "variants", "seconds", "error"]
+
+# Extensions of vcf (a cohort given as an existing file with another
+# extension is a manifest)
+VCF_EXTENSIONS = (".vcf", ".gz", ".bgz")
+
+
+###############################################################################
+#
+# WORKER
+#
+###############################################################################
+def _init_worker(logger_name, log_level):
+    """
+    @summary: Initialize a worker process with the logger of the script
+    @param logger_name: [str] The name of the logger of the script
+    @param log_level: [int] The level of the logger of the script
+    """
+    mobidic_mpa.log = logging.getLogger(logger_name)
+    mobidic_mpa.log.setLevel(log_level)
+
+
+def annotate_file(path, output, engine="vcfpy", no_refseq_version=True,
+                  batch_size=1000, compress=None, compress_threads=1,
+                  max_rank=None, min_score=None, top_k=None,
+                  sort_memory=None, split_alleles=False, lazy_samples=False):
+    """
+    @summary: Annotate one vcf of a cohort (its header is already checked). \
+        Errors are returned instead of raised, and a partial output is \
+        removed.
+    @param path: [str] The path of the input vcf
+    @param output: [str] The path of the output vcf
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param batch_size: [int] The number of lines scored at once
+    @param compress: [bool] Write BGZF (default for ".gz" and ".bgz" paths)
+    @param compress_threads: [int] The number of compression threads
+    @param max_rank: [int] Only write variants with MPA_ranking <= max_rank
+    @param min_score: [float] Only write variants with MPA_final_score >= \
+        min_score
+    @param top_k: [int] Only write the top_k best variants of each gene
+    @param sort_memory: [int] Sort variants by rank and score with this \
+        memory (MB), None to keep the vcf order
+    @param split_alleles: [bool] Split multi-allelic variants (see \
+        alleles.AlleleSplitter)
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    @return: [dict] The status ("ok" or "failed"), the number of variants, \
+        the time (s), the error and the number of variants per rank and impact
+    """
+    start = time.perf_counter()
+    result = {
+        "status": "ok",
+        "variants": 0,
+        "seconds": 0.0,
+        "error": "",
+        "ranks": collections.Counter(),
+        "impacts": collections.Counter()
+    }
+    try:
+        with raw.open_vcf(path) as stream:
+            header = raw.read_header(stream)
+            for info in mobidic_mpa.MPA_INFOS:
+                header.add_info_line(info)
+            scorer = raw.line_scorer(
+                engine, header, no_refseq_version, lazy_samples)
+            lines = raw.iter_body(stream)
+            if split_alleles:
+                lines = alleles.AlleleSplitter(header).split_lines(lines)
+            gene_token = filters.gene_key(no_refseq_version) + '='
+            with raw.open_output(output, compress, compress_threads) as out:
+                out.write(raw.header_text(header))
+                selected = filters.select(
+                    _counted(
+                        raw.score_lines(scorer, lines, batch_size),
+                        result
+                    ),
+                    lambda line: raw.find_info_value(
+                        line.split('\t', 8)[7], gene_token),
+                    max_rank,
+                    min_score,
+                    top_k
+                )
+                if sort_memory:
+                    out.writelines(sorting.sort_lines(
+                        selected,
+                        sort_memory * 1024 * 1024,
+                        os.path.dirname(os.path.abspath(output))
+                    ))
+                else:
+                    out.writelines(line for line, _ in selected)
+    except (SystemExit, Exception) as e:
+        # One malformed vcf does not stop the cohort
+        result = failed(str(e) or type(e).__name__)
+        if os.path.exists(output):
+            os.remove(output)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _counted(scored, result):
+    """
+    @summary: Count the scored variants of a vcf in its result
+    @param scored: [iterable] The vcf lines with MPA fields and the MPA fields
+    @param result: [dict] The result of the vcf (see annotate_file)
+    @return: [generator] The vcf lines with MPA fields and the MPA fields
+    """
+    for line, mpa_fields in scored:
+        result["variants"] += 1
+        result["ranks"][mpa_fields['MPA_ranking']] += 1
+        result["impacts"].update(mpa_fields['MPA_impact'])
+        yield line, mpa_fields
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def list_inputs(cohort):
+    """
+    @summary: List the vcf of a cohort
+    @param cohort: [str] A manifest (text file with one vcf path per line, \
+        relative to the manifest) or a glob pattern of vcf
+    @return: [list] The distinct paths of the vcf (in the manifest or \
+        sorted order)
+    """
+    if os.path.isfile(cohort) and not cohort.endswith(VCF_EXTENSIONS):
+        directory = os.path.dirname(cohort)
+        with open(cohort) as manifest:
+            paths = [
+                os.path.join(directory, line.strip()) for line in manifest
+                if line.strip() and not line.startswith("#")
+            ]
+    else:
+        paths = sorted(glob.glob(cohort))
+    return list(collections.OrderedDict.fromkeys(paths))
+
+
+def output_path(path, output_dir, compress=False):
+    """
+    @summary: Define the output of a vcf of a cohort
+    @param path: [str] The path of the input vcf
+    @param output_dir: [str] The output directory
+    @param compress: [bool] The output is bgzipped
+    @return: [str] The path of the output vcf (same name as the input)
+    """
+    name = os.path.basename(path)
+    if compress and not raw.is_compressed(name):
+        name += ".gz"
+    return os.path.join(output_dir, name)
+
+
+def check_headers(paths, no_refseq_version=True):
+    """
+    @summary: Check the annotations of the header of each vcf, once per \
+        distinct set of INFO fields
+    @param paths: [list] The paths of the vcf
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [dict] The error of each vcf not correctly annotated (or \
+        unreadable)
+    """
+    layouts = dict()
+    errors = dict()
+    for path in paths:
+        try:
+            with raw.open_vcf(path) as stream:
+                layout = frozenset(raw.read_header(stream).info_ids())
+        except (SystemExit, Exception) as e:
+            errors[path] = str(e) or type(e).__name__
+            continue
+        if layout not in layouts:
+            try:
+                mobidic_mpa.check_annotation(layout, no_refseq_version)
+                layouts[layout] = None
+            except SystemExit as e:
+                layouts[layout] = str(e)
+        if layouts[layout] is not None:
+            errors[path] = layouts[layout]
+    mobidic_mpa.log.info(
+        f"Checked {len(layouts)} distinct header layouts for {len(paths)} vcf")
+    return errors
+
+
+def annotate_cohort(paths, output_dir, engine="vcfpy", no_refseq_version=True,
+                    threads=1, batch_size=1000, compress=False,
+                    compress_threads=1, max_rank=None, min_score=None,
+                    top_k=None, sort_memory=None, split_alleles=False,
+                    lazy_samples=False):
+    """
+    @summary: Annotate the vcf of a cohort on a shared pool of processes (one \
+        vcf per process at a time). A vcf failing does not stop the others.
+    @param paths: [list] The paths of the input vcf (see list_inputs)
+    @param output_dir: [str] The output directory (created if needed)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param threads: [int] The number of worker processes
+    @param batch_size: [int] The number of lines scored at once
+    @param compress: [bool] Write bgzipped outputs
+    @param compress_threads: [int] The number of compression threads per vcf
+    @param max_rank: [int] Only write variants with MPA_ranking <= max_rank
+    @param min_score: [float] Only write variants with MPA_final_score >= \
+        min_score
+    @param top_k: [int] Only write the top_k best variants of each gene
+    @param sort_memory: [int] Sort variants by rank and score with this \
+        memory (MB), None to keep the vcf order
+    @param split_alleles: [bool] Split multi-allelic variants
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    @return: [generator] The input, the output and the result of each vcf \
+        (see annotate_file), as soon as they are done
+    """
+    outputs = collections.OrderedDict(
+        (path, output_path(path, output_dir, compress)) for path in paths)
+    if len(set(outputs.values())) < len(outputs):
+        sys.exit("Several vcf of the cohort have the same name.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    errors = check_headers(paths, no_refseq_version)
+    for path, output in outputs.items():
+        if path not in errors and os.path.exists(output) and \
+                os.path.samefile(path, output):
+            errors[path] = "The output would overwrite the input."
+        if path in errors:
+            yield path, output, failed(errors[path])
+        else:
+            jobs.append((path, output))
+    options = (engine, no_refseq_version, batch_size, compress or None,
+               compress_threads, max_rank, min_score, top_k, sort_memory,
+               split_alleles, lazy_samples)
+
+    if threads <= 1:
+        for path, output in jobs:
+            yield path, output, annotate_file(path, output, *options)
+        return
+
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=threads,
+        initializer=_init_worker,
+        initargs=(mobidic_mpa.log.name, mobidic_mpa.log.level)
+    )
+    futures = {
+        executor.submit(annotate_file, path, output, *options): (path, output)
+        for path, output in jobs
+    }
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            path, output = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process died (e.g. out of memory)
+                result = failed(str(e) or type(e).__name__)
+            yield path, output, result
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+
+
+def failed(error):
+    """
+    @summary: Build the result of a vcf not annotated
+    @param error: [str] The error
+    @return: [dict] The result (see annotate_file)
+    """
+    return {
+        "status": "failed",
+        "variants": 0,
+        "seconds": 0.0,
+        "error": error,
+        "ranks": collections.Counter(),
+        "impacts": collections.Counter()
+    }
+
+
+def write_report(path, results):
+    """
+    @summary: Write the status and timing of each vcf of a cohort
+    @param path: [str] The path of the report (tab separated)
+    @param results: [list] The input, the output and the result of each vcf \
+        (see annotate_cohort)
+    """
+    with open(path, "w") as report:
+        report.write("\t".join(REPORT_COLUMNS) + "\n")
+        for vcf, output, result in results:
+            report.write("\t".join([
+                vcf,
+                output,
+                result["status"],
+                str(result["variants"]),
+                f"{result['seconds']:.3f}",
+                " ".join(result["error"].split())
+            ]) + "\n")
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import math
+import collections
+import numpy
+
+from mobidic_mpa import raw
+from mobidic_mpa import classify
+from mobidic_mpa import splice
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Missense predictors (columns of the predictions array)
+PREDICTION_KEYS = [
+    'SIFT_pred',
+    'Polyphen2_HDIV_pred',
+    'Polyphen2_HVAR_pred',
+    'LRT_pred',
+    'MutationTaster_pred',
+    'FATHMM_pred',
+    'PROVEAN_pred',
+    'fathmm-MKL_coding_pred',
+    'MetaSVM_pred',
+    'MetaLR_pred'
+]
+
+# SpliceAI delta scores (columns of the spliceai array)
+SPLICEAI_KEYS = list(splice.SPLICEAI_KEYS)
+
+# MPA impacts (bits of the impact mask), in the order used for ranking
+IMPACTS = [
+    "clinvar_pathogenicity",
+    "stop_impact",
+    "splice_impact",
+    "frameshift_impact",
+    "indel_impact",
+    "unknown_impact",
+    "start_impact",
+    "missense_impact"
+]
+
+# Ranks where the final score is the adjusted missense score
+ADJUSTED_RANKS = (5, 7, 9, 10)
+
+# Scores of a batch of variants (one array per field)
+Scores = collections.namedtuple('Scores', [
+    'adjusted',
+    'available',
+    'deleterious',
+    'final_score',
+    'ranking',
+    'impact'
+])
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class ColumnScorer(object):
+    """
+    @summary: Score batches of vcf lines with vectorized operations. Only \
+        the INFO keys used by MPA are decoded (as the raw engine) and the MPA \
+        fields are appended to the original lines.
+    """
+    def __init__(self, header, no_refseq_version=True):
+        """
+        @param header: [vcfpy.Header] The header of the vcf
+        @param no_refseq_version: [bool] Annotation without refseq version
+        """
+        self.no_refseq_version = no_refseq_version
+        self._raw = raw.RawScorer(header, no_refseq_version)
+
+    def score_line(self, line):
+        """
+        @summary: Score one vcf line
+        @param line: [str] The raw vcf line
+        @return: [tuple] The vcf line with MPA fields and the MPA fields
+        """
+        return self.score_batch([line])[0]
+
+    def score_batch(self, lines):
+        """
+        @summary: Score a batch of vcf lines
+        @param lines: [list] The raw vcf lines
+        @return: [list] The vcf lines with MPA fields and the MPA fields
+        """
+        rows = []
+        annotations = []
+        indels = []
+        for line in lines:
+            try:
+                columns, annotation, is_indel = self._raw.parse_line(line)
+            except SystemExit as e:
+                raise SystemExit("{}\n{}".format(line.rstrip(), e))
+            rows.append(columns)
+            annotations.append(annotation)
+            indels.append(is_indel)
+
+        scores = score_columns(**annotation_columns(
+            annotations, indels, self.no_refseq_version))
+
+        result = []
+        for i, columns in enumerate(rows):
+            mpa_fields = get_mpa_fields(scores, i)
+            columns[7] = raw.add_info_fields(columns[7], mpa_fields)
+            result.append(('\t'.join(columns) + '\n', mpa_fields))
+        return result
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def annotation_columns(annotations, is_indel, no_refseq_version=True):
+    """
+    @summary: Build the columns used by score_columns from per variant \
+        annotations
+    @param annotations: [list] The annotations of each variant (see \
+        mobidic_mpa.get_annotations)
+    @param is_indel: [list] Boolean to define if each variant is indel or not
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [dict] The columns (keyword arguments of score_columns)
+    """
+    refSeqExt = 'refGene' if no_refseq_version else 'refGeneWithVer'
+    FuncKey = f'Func.{refSeqExt}'
+    ExonicFuncKey = f'ExonicFunc.{refSeqExt}'
+
+    def column(key):
+        return [annotation[key] for annotation in annotations]
+
+    # Splicing scores (missing scores become nan)
+    splices_scores = numpy.array([
+        [math.nan if score is None else score for score in (
+            scores.ada, scores.rf,
+            scores.ds_ag, scores.ds_al, scores.ds_dg, scores.ds_dl
+        )]
+        for scores in (
+            splice.decode(
+                annotation['dbscSNV_ADA_SCORE'],
+                annotation['dbscSNV_RF_SCORE'],
+                annotation['spliceai_filtered']
+            )
+            for annotation in annotations
+        )
+    ], dtype=float).reshape(len(annotations), 2 + len(SPLICEAI_KEYS))
+
+    return {
+        "predictions": numpy.array(
+            [column(key) for key in PREDICTION_KEYS], dtype=object
+        ).T.reshape(len(annotations), len(PREDICTION_KEYS)),
+        "ada": splices_scores[:, 0],
+        "rf": splices_scores[:, 1],
+        "spliceai": splices_scores[:, 2:],
+        "clnsig": column('CLNSIG'),
+        "func": column(FuncKey),
+        "exonic_func": column(ExonicFuncKey),
+        "is_indel": is_indel
+    }
+
+
+def _strings(values):
+    """
+    @summary: Convert a column to a numpy string array (missing values \
+        become empty strings)
+    @param values: [array-like] The column (str, None or nan values)
+    @return: [numpy.ndarray] The string array
+    """
+    values = numpy.asarray(values)
+    if values.dtype.kind == 'U':
+        return values
+    return numpy.array(
+        [value if isinstance(value, str) else "" for value in values.ravel()],
+        dtype=str
+    ).reshape(values.shape)
+
+
+def _classify(values):
+    """
+    @summary: Classify a string column as masks of impact bits (each \
+        distinct value is classified once, see mobidic_mpa.classify)
+    @param values: [numpy.ndarray] The string array
+    @return: [numpy.ndarray] Integer array, the mask of each value
+    """
+    distinct, inverse = numpy.unique(values, return_inverse=True)
+    masks = numpy.array(
+        [classify.classify(str(value)) for value in distinct], dtype=int)
+    return masks[inverse.reshape(values.shape)]
+
+
+def score_columns(predictions, ada, rf, spliceai, clnsig, func, exonic_func,
+                  is_indel):
+    """
+    @summary: Calculate MPA scores and ranking of a batch of variants with \
+        vectorized operations (same results as mobidic_mpa.score_annotations)
+    @param predictions: [array-like] (n, 10) missense predictions, columns \
+        in PREDICTION_KEYS order (None or empty string if missing)
+    @param ada: [array-like] (n,) dbscSNV ADA scores (nan if missing)
+    @param rf: [array-like] (n,) dbscSNV RF scores (nan if missing)
+    @param spliceai: [array-like] (n, 4) SpliceAI delta scores, columns in \
+        SPLICEAI_KEYS order (nan if missing)
+    @param clnsig: [array-like] (n,) ClinVar significance
+    @param func: [array-like] (n,) Func.refGene annotation
+    @param exonic_func: [array-like] (n,) ExonicFunc.refGene annotation
+    @param is_indel: [array-like] (n,) Boolean to define if variants are \
+        indel or not
+    @return: [Scores] The MPA scores (impact is a bit mask over IMPACTS)
+    """
+    is_indel = numpy.asarray(is_indel, dtype=bool)
+    n = len(is_indel)
+    predictions = _strings(predictions).reshape(n, len(PREDICTION_KEYS))
+    ada = numpy.asarray(ada, dtype=float)
+    rf = numpy.asarray(rf, dtype=float)
+    spliceai = numpy.asarray(spliceai, dtype=float).reshape(
+        n, len(SPLICEAI_KEYS))
+    clnsig = _classify(_strings(clnsig))
+    func = _classify(_strings(func))
+    exonic_func = _strings(exonic_func)
+
+    # Calculate adjusted score for each variants
+    deleterious = (
+        (predictions == "D") | (predictions == "A")
+    ).sum(axis=1)
+    available = (predictions != "").sum(axis=1)
+    adjusted = numpy.where(
+        available > 0,
+        deleterious / numpy.maximum(available, 1) * 10,
+        0.0
+    )
+
+    impacts = numpy.zeros((n, len(IMPACTS)), dtype=int)
+
+    # Determine if variant is annotated with clinvar as deleterious
+    impacts[:, 0] = numpy.where(clnsig & classify.CLINVAR_PATHOGENIC, 1, 0)
+
+    # Determine the impact on splicing
+    with numpy.errstate(invalid='ignore'):
+        impacts[:, 2] = numpy.select(
+            [
+                rf >= 0.6,
+                ada >= 0.6,
+                (spliceai > 0.8).any(axis=1),
+                (spliceai > 0.5).any(axis=1),
+                (spliceai > 0.2).any(axis=1),
+                is_indel & ((func & classify.SPLICING) > 0)
+            ],
+            [3, 3, 4, 6, 8, 8],
+            0)
+
+    # Determine the exonic impact
+    exonic = numpy.where(
+        ((func & classify.EXONIC) > 0) & (exonic_func != ""),
+        _classify(exonic_func), 0)
+    impacts[:, 1] = numpy.where(exonic & classify.STOP, 2, 0)
+    impacts[:, 3] = numpy.where(exonic & classify.FRAMESHIFT, 2, 0)
+    impacts[:, 4] = numpy.where(exonic & classify.NONFRAMESHIFT, 8, 0)
+    impacts[:, 5] = numpy.where(exonic & classify.UNKNOWN, 10, 0)
+    impacts[:, 6] = numpy.where(exonic & classify.START, 2, 0)
+    impacts[:, 7] = numpy.where(
+        exonic & classify.MISSENSE,
+        numpy.select([adjusted > 6, adjusted > 2], [5, 7], 9),
+        0)
+
+    # Ranking of variants (first impact in IMPACTS order wins ties)
+    candidates = numpy.where(impacts > 0, impacts, numpy.iinfo(int).max)
+    winner = candidates.argmin(axis=1)
+    ranking = impacts[numpy.arange(n), winner]
+    ranked = ranking > 0
+    ranking = numpy.where(ranked, ranking, 10)
+
+    # Final score of the impact that defines the rank
+    final_score = numpy.select(
+        [
+            ~ranked | (winner == 5) | (winner == 7),
+            (winner == 2) & (ranking == 6),
+            (winner == 2) & (ranking == 8),
+            winner == 4,
+            winner == 3
+        ],
+        [adjusted, 6, 2, 8, 2],
+        10).astype(float)
+
+    impact = ((impacts > 0) << numpy.arange(len(IMPACTS))).sum(axis=1)
+
+    return Scores(
+        adjusted,
+        available,
+        deleterious,
+        final_score,
+        ranking,
+        impact
+    )
+
+
+def get_mpa_fields(scores, i):
+    """
+    @summary: Format the scores of one variant as MPA INFO fields
+    @param scores: [Scores] The scores of a batch (see score_columns)
+    @param i: [int] The index of the variant in the batch
+    @return: [OrderedDict] The MPA INFO fields (same as \
+        mobidic_mpa.score_annotations)
+    """
+    available = int(scores.available[i])
+    ranking = int(scores.ranking[i])
+    # The adjusted score is an integer when no predictor is available
+    adjusted = str(float(scores.adjusted[i]) if available else 0)
+    impact = int(scores.impact[i])
+
+    mpa_fields = collections.OrderedDict([
+        ('MPA_impact', [
+            name for bit, name in enumerate(IMPACTS) if impact & (1 << bit)
+        ] or ["NULL"]),
+        ('MPA_ranking', ranking),
+        ('MPA_adjusted', adjusted),
+        ('MPA_available', str(available)),
+        ('MPA_deleterious', str(int(scores.deleterious[i]))),
+        ('MPA_final_score', (
+            adjusted if ranking in ADJUSTED_RANKS
+            else str(int(scores.final_score[i]))
+        ))
+    ])
+    return mpa_fields
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import sys
+import gzip
+
+from mobidic_mpa import raw
+from mobidic_mpa import filters
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Columns of the site of a variant
+SITE_COLUMNS = ["CHROM", "POS", "REF", "ALT"]
+
+# MPA fields exported (in the column order) and their type
+MPA_COLUMNS = [
+    ("MPA_ranking", "int"),
+    ("MPA_final_score", "float"),
+    ("MPA_impact", "str"),
+    ("MPA_adjusted", "float"),
+    ("MPA_available", "int"),
+    ("MPA_deleterious", "int")
+]
+
+# Number of variants of a row group (Parquet) or record batch (Arrow)
+ROW_GROUP_SIZE = 65536
+
+# Format of an export from the extension of its path
+FORMATS = [
+    (".parquet", "parquet"),
+    (".arrow", "arrow"),
+    (".feather", "arrow"),
+    (".tsv", "tsv"),
+    (".tsv.gz", "tsv")
+]
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class TsvExporter(object):
+    """
+    @summary: Write MPA results in a tab separated file (gzipped for ".gz" \
+        paths). Values are written as in the vcf, empty if missing.
+    """
+    def __init__(self, path, columns):
+        """
+        @param path: [str] The path of the export
+        @param columns: [list] The names of the columns
+        """
+        if path.endswith(".gz"):
+            self._output = gzip.open(path, "wt", compresslevel=6)
+        else:
+            self._output = open(path, "w")
+        self._output.write("\t".join(columns) + "\n")
+
+    def write(self, row):
+        """
+        @summary: Write one variant
+        @param row: [list] The raw values of the variant (see read_row)
+        """
+        self._output.write(
+            "\t".join("" if value is None else value for value in row) + "\n")
+
+    def close(self):
+        self._output.close()
+
+
+class ArrowExporter(object):
+    """
+    @summary: Write MPA results in a Parquet or Arrow IPC file (needs \
+        pyarrow). Rows are buffered and written by row groups as the vcf is \
+        read, with typed MPA columns.
+    """
+    def __init__(self, path, columns, types, file_format="parquet",
+                 row_group_size=ROW_GROUP_SIZE):
+        """
+        @param path: [str] The path of the export
+        @param columns: [list] The names of the columns
+        @param types: [list] The type of each column ("str", "int" or "float")
+        @param file_format: [str] "parquet" or "arrow"
+        @param row_group_size: [int] The number of variants per row group
+        """
+        # pyarrow is an optional dependency
+        import pyarrow
+        self._pyarrow = pyarrow
+        arrow_types = {
+            "int": pyarrow.int64(),
+            "float": pyarrow.float64(),
+            "str": pyarrow.string()
+        }
+        converters = {"int": _to_int, "float": _to_float, "str": _to_str}
+        self._converters = [converters[column_type] for column_type in types]
+        self._schema = pyarrow.schema([
+            (column, arrow_types[column_type])
+            for column, column_type in zip(columns, types)
+        ])
+        self._row_group_size = row_group_size
+        self._rows = []
+        if file_format == "parquet":
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+        else:
+            import pyarrow.ipc
+            self._writer = pyarrow.ipc.new_file(path, self._schema)
+
+    def write(self, row):
+        """
+        @summary: Add one variant, a row group is written when full
+        @param row: [list] The raw values of the variant (see read_row)
+        """
+        self._rows.append(row)
+        if len(self._rows) >= self._row_group_size:
+            self._flush()
+
+    def _flush(self):
+        """
+        @summary: Write the buffered variants as one row group
+        """
+        arrays = [
+            self._pyarrow.array(
+                [convert(row[i]) for row in self._rows],
+                type=self._schema.field(i).type
+            )
+            for i, convert in enumerate(self._converters)
+        ]
+        self._writer.write_table(
+            self._pyarrow.Table.from_arrays(arrays, schema=self._schema))
+        self._rows = []
+
+    def close(self):
+        if self._rows:
+            self._flush()
+        self._writer.close()
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def _to_int(value):
+    """
+    @summary: Convert a raw value to an integer
+    @param value: [str] The raw value
+    @return: [int] The integer (None if missing or not an integer)
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    """
+    @summary: Convert a raw value to a float
+    @param value: [str] The raw value
+    @return: [float] The float (None if missing or not a number)
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_str(value):
+    """
+    @summary: Keep a raw value as is
+    @param value: [str] The raw value
+    @return: [str] The raw value
+    """
+    return value
+
+
+def export_format(path):
+    """
+    @summary: Define the format of an export from its extension
+    @param path: [str] The path of the export
+    @return: [str] "parquet", "arrow" or "tsv" (None if unknown)
+    """
+    for extension, file_format in FORMATS:
+        if path.endswith(extension):
+            return file_format
+    return None
+
+
+def columns(info_keys=(), no_refseq_version=True):
+    """
+    @summary: List the columns of an export
+    @param info_keys: [list] The INFO keys exported as is
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [list] The name and type of each column
+    """
+    fixed = (
+        [(column, "int" if column == "POS" else "str")
+         for column in SITE_COLUMNS] +
+        [(filters.gene_key(no_refseq_version), "str")] +
+        MPA_COLUMNS
+    )
+    names = set(column for column, _ in fixed)
+    return fixed + [
+        (key, "str") for key in dict.fromkeys(info_keys) if key not in names
+    ]
+
+
+def open_exporter(path, info_keys=(), no_refseq_version=True):
+    """
+    @summary: Open an export of MPA results
+    @param path: [str] The path of the export (".parquet", ".arrow", \
+        ".feather", ".tsv" or ".tsv.gz")
+    @param info_keys: [list] The INFO keys exported as is
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [TsvExporter/ArrowExporter] The exporter
+    """
+    file_format = export_format(path)
+    if file_format is None:
+        sys.exit(
+            f"Unknown export format: {path} (use .parquet, .arrow, .feather, "
+            ".tsv or .tsv.gz)")
+    names, types = zip(*columns(info_keys, no_refseq_version))
+    if file_format == "tsv":
+        return TsvExporter(path, names)
+    try:
+        return ArrowExporter(path, names, types, file_format)
+    except ImportError:
+        sys.exit(
+            "Parquet and Arrow exports need pyarrow "
+            "(pip install mobidic-mpa[parquet]).")
+
+
+def info_tokens(info_keys=(), no_refseq_version=True):
+    """
+    @summary: Build the tokens searched in the INFO column of a line
+    @param info_keys: [list] The INFO keys exported as is
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [list] The tokens ("key=") of the gene, MPA fields and INFO keys
+    """
+    return [
+        key + '=' for key, _ in columns(info_keys, no_refseq_version)[4:]
+    ]
+
+
+def read_row(line, tokens):
+    """
+    @summary: Read the exported values of a vcf line with MPA fields
+    @param line: [str] The vcf line
+    @param tokens: [list] The INFO tokens (see info_tokens)
+    @return: [list] The raw values (None if missing)
+    """
+    fields = line.rstrip("\n").split("\t", 8)
+    return (
+        [fields[0], fields[1], fields[3], fields[4]] +
+        [raw.find_info_value(fields[7], token) for token in tokens]
+    )
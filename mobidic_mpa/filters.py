@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import math
+import heapq
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class TopPerGene(object):
+    """
+    @summary: Keep the K best variants of each gene (lowest MPA_ranking, then \
+        highest MPA_final_score, then first in the vcf). Each gene has a \
+        bounded heap: the memory grows with genes x K, not with the vcf.
+    """
+    def __init__(self, k):
+        """
+        @param k: [int] The number of variants kept per gene
+        """
+        self.k = k
+        self._heaps = dict()
+        self._count = 0
+
+    def push(self, gene, item, mpa_fields):
+        """
+        @summary: Offer a variant to the heap of its gene
+        @param gene: [str] The gene of the variant
+        @param item: [object] The variant (vcf line or record)
+        @param mpa_fields: [OrderedDict] The MPA fields of the variant (see \
+            score_annotations)
+        """
+        # The root of a heap is the worst variant kept (highest rank, lowest
+        # score, last read)
+        entry = (
+            -mpa_fields['MPA_ranking'],
+            final_score(mpa_fields),
+            -self._count,
+            item,
+            mpa_fields
+        )
+        self._count += 1
+        heap = self._heaps.setdefault(gene, [])
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry[:3] > heap[0][:3]:
+            heapq.heapreplace(heap, entry)
+
+    def items(self):
+        """
+        @summary: The variants kept, in the order of the vcf
+        @return: [list] The variants and their MPA fields
+        """
+        entries = [entry for heap in self._heaps.values() for entry in heap]
+        entries.sort(key=lambda entry: -entry[2])
+        return [(entry[3], entry[4]) for entry in entries]
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def gene_key(no_refseq_version=True):
+    """
+    @summary: The INFO key of the gene of a variant
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [str] The INFO key
+    """
+    return 'Gene.{}'.format(
+        'refGene' if no_refseq_version else 'refGeneWithVer')
+
+
+def final_score(mpa_fields):
+    """
+    @summary: Read the final score of a variant as a number
+    @param mpa_fields: [OrderedDict] The MPA fields (see score_annotations)
+    @return: [float] The final score (-inf if not a number)
+    """
+    try:
+        score = float(mpa_fields['MPA_final_score'])
+    except (TypeError, ValueError):
+        return -math.inf
+    return -math.inf if math.isnan(score) else score
+
+
+def keep(mpa_fields, max_rank=None, min_score=None):
+    """
+    @summary: Define if a variant passes the rank and score thresholds
+    @param mpa_fields: [OrderedDict] The MPA fields (see score_annotations)
+    @param max_rank: [int] Keep variants with MPA_ranking <= max_rank
+    @param min_score: [float] Keep variants with MPA_final_score >= min_score
+    @return: [bool] True if the variant is kept
+    """
+    if max_rank is not None and mpa_fields['MPA_ranking'] > max_rank:
+        return False
+    if min_score is not None and final_score(mpa_fields) < min_score:
+        return False
+    return True
+
+
+def select(scored, gene_of=None, max_rank=None, min_score=None, top_k=None):
+    """
+    @summary: Select the variants written in the output. Variants are \
+        yielded as they come, except with top_k: the best variants of each \
+        gene are yielded at the end (in the order of the vcf).
+    @param scored: [iterable] The variants (vcf line or record) and their \
+        MPA fields
+    @param gene_of: [function] Read the gene of a variant (needed by top_k)
+    @param max_rank: [int] Keep variants with MPA_ranking <= max_rank
+    @param min_score: [float] Keep variants with MPA_final_score >= min_score
+    @param top_k: [int] Keep the top_k best variants of each gene (see \
+        TopPerGene)
+    @return: [generator] The variants selected and their MPA fields
+    """
+    top = TopPerGene(top_k) if top_k else None
+    for item, mpa_fields in scored:
+        if not keep(mpa_fields, max_rank, min_score):
+            continue
+        if top is None:
+            yield item, mpa_fields
+        else:
+            top.push(gene_of(item), item, mpa_fields)
+    if top is not None:
+        yield from top.items()
+
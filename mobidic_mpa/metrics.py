@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import io
+import json
+import time
+import resource
+import collections
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Stages of an annotation (in the order of the report)
+STAGES = ["read", "validate", "score", "sort", "serialize", "write"]
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class Metrics(object):
+    """
+    @summary: Time spent in each stage of an annotation and counts of \
+        variants per rank and impact. Stages are timed exclusively: the time \
+        spent in a stage nested in another one (e.g. reading lines while \
+        scoring them) is only counted once.
+    """
+    def __init__(self):
+        self.stages = collections.OrderedDict(
+            (stage, 0.0) for stage in STAGES)
+        self.records = 0
+        self.regions = 0
+        self.ranks = collections.Counter()
+        self.impacts = collections.Counter()
+        self.status = 0
+        # Statistics of the score cache (if used)
+        self.cache = None
+        self._start = time.perf_counter()
+        # Time spent in the stages called by the current stage
+        self._nested = 0.0
+
+    def _enter(self):
+        """
+        @summary: Start timing a stage
+        @return: [tuple] The start time and the nested time of the caller
+        """
+        outer = self._nested
+        self._nested = 0.0
+        return time.perf_counter(), outer
+
+    def _exit(self, stage, start, outer):
+        """
+        @summary: Stop timing a stage
+        @param stage: [str] The stage
+        @param start: [float] The start time (see _enter)
+        @param outer: [float] The nested time of the caller (see _enter)
+        """
+        elapsed = time.perf_counter() - start
+        self.stages[stage] += elapsed - self._nested
+        self._nested = outer + elapsed
+
+    def timed(self, stage, iterable):
+        """
+        @summary: Time the iteration over an iterable
+        @param stage: [str] The stage
+        @param iterable: [iterable] The iterable
+        @return: [generator] The items of the iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            start, outer = self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._exit(stage, start, outer)
+            yield item
+
+    def timed_function(self, stage, function):
+        """
+        @summary: Time the calls of a function
+        @param stage: [str] The stage
+        @param function: [function] The function
+        @return: [function] The timed function
+        """
+        def timed_call(*args, **kwargs):
+            start, outer = self._enter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._exit(stage, start, outer)
+        return timed_call
+
+    def timed_file(self, stage, fileobj):
+        """
+        @summary: Time the writes in a binary file (and its closing, which \
+            flushes the remaining data)
+        @param stage: [str] The stage
+        @param fileobj: [file] The binary file object
+        @return: [TimedFile] The timed file
+        """
+        return TimedFile(
+            self.timed_function(stage, fileobj.write),
+            self.timed_function(stage, fileobj.close)
+        )
+
+    def count(self, mpa_fields):
+        """
+        @summary: Count a scored variant
+        @param mpa_fields: [OrderedDict] The MPA fields of the variant (see \
+            score_annotations)
+        """
+        self.records += 1
+        self.ranks[mpa_fields['MPA_ranking']] += 1
+        self.impacts.update(mpa_fields['MPA_impact'])
+
+    def counted(self, scored):
+        """
+        @summary: Count the variants of an iterable of scored variants
+        @param scored: [iterable] The variants and their MPA fields
+        @return: [generator] The variants and their MPA fields
+        """
+        for item, mpa_fields in scored:
+            self.count(mpa_fields)
+            yield item, mpa_fields
+
+    def add_counts(self, records, ranks, impacts):
+        """
+        @summary: Add the counts of a batch of variants (e.g. a region)
+        @param records: [int] The number of variants
+        @param ranks: [Counter] The number of variants per rank
+        @param impacts: [Counter] The number of variants per impact
+        """
+        self.records += records
+        self.ranks.update(ranks)
+        self.impacts.update(impacts)
+
+    def report(self):
+        """
+        @summary: Summarize the metrics
+        @return: [dict] The metrics (times in seconds, memory in MB)
+        """
+        seconds = time.perf_counter() - self._start
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        return {
+            "status": self.status,
+            "records": self.records,
+            "regions": self.regions,
+            "seconds": round(seconds, 6),
+            "records_per_second": round(self.records / seconds, 1)
+            if seconds else None,
+            "stages": collections.OrderedDict(
+                (stage, round(value, 6))
+                for stage, value in self.stages.items()
+            ),
+            "peak_memory_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_workers_memory_mb": round(children / 1024, 1)
+            if children else None,
+            "ranks": collections.OrderedDict(
+                (str(rank), self.ranks[rank]) for rank in sorted(self.ranks)),
+            "impacts": collections.OrderedDict(self.impacts.most_common()),
+            "cache": self.cache
+        }
+
+    def write(self, path):
+        """
+        @summary: Write the metrics as JSON
+        @param path: [str] The path of the JSON file
+        """
+        with open(path, "w") as output:
+            json.dump(self.report(), output, indent=2)
+            output.write("\n")
+
+    def log(self, logger):
+        """
+        @summary: Log a summary of the metrics
+        @param logger: [Logger] The logger
+        """
+        report = self.report()
+        logger.info(
+            f"Profile: {report['records']} variants in "
+            f"{report['seconds']:.2f}s "
+            f"({report['records_per_second'] or 0:.0f} variants/s), peak "
+            f"memory {report['peak_memory_mb']} MB")
+        total = sum(report["stages"].values()) or 1
+        for stage, seconds in report["stages"].items():
+            logger.info(
+                f"Profile: {stage:<9} {seconds:>10.3f}s "
+                f"({100 * seconds / total:5.1f}%)")
+        logger.info(
+            "Profile: ranks " + ", ".join(
+                f"{rank}: {count}" for rank, count in report["ranks"].items()))
+
+
+class TimedFile(io.RawIOBase):
+    """
+    @summary: Binary file timing its writes (see Metrics.timed_file)
+    """
+    def __init__(self, write, close):
+        """
+        @param write: [function] The timed write function of the file
+        @param close: [function] The timed close function of the file
+        """
+        super().__init__()
+        self._write = write
+        self._close = close
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._close()
+        finally:
+            super().close()
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def timer(metrics, stage, function):
+    """
+    @summary: Time the calls of a function when metrics are collected
+    @param metrics: [Metrics] The metrics (None if not collected)
+    @param stage: [str] The stage
+    @param function: [function] The function
+    @return: [function] The timed function (function itself without metrics)
+    """
+    if metrics is None:
+        return function
+    return metrics.timed_function(stage, function)
+
+
+def timed(metrics, stage, iterable):
+    """
+    @summary: Time the iteration over an iterable when metrics are collected
+    @param metrics: [Metrics] The metrics (None if not collected)
+    @param stage: [str] The stage
+    @param iterable: [iterable] The iterable
+    @return: [iterable] The timed iterable (iterable itself without metrics)
+    """
+    if metrics is None:
+        return iterable
+    return metrics.timed(stage, iterable)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import io
+import logging
+import collections
+import concurrent.futures
+
+import mobidic_mpa
+from mobidic_mpa import raw
+
+
+###############################################################################
+#
+# WORKER
+#
+###############################################################################
+# Line scorer of the worker process (built once by _init_worker)
+_scorer = None
+
+
+def _init_worker(header, engine, no_refseq_version, logger_name, log_level,
+                 lazy_samples=False):
+    """
+    @summary: Initialize a worker process with its own line scorer
+    @param header: [str] The serialized header of the vcf (with MPA fields)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param logger_name: [str] The name of the logger of the script
+    @param log_level: [int] The level of the logger of the script
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    """
+    global _scorer
+    mobidic_mpa.log = logging.getLogger(logger_name)
+    mobidic_mpa.log.setLevel(log_level)
+    _scorer = raw.line_scorer(
+        engine,
+        raw.read_header(io.StringIO(header)),
+        no_refseq_version,
+        lazy_samples
+    )
+
+
+def _score_batch(lines):
+    """
+    @summary: Score a batch of vcf lines in a worker process
+    @param lines: [list] The raw vcf lines
+    @return: [list] The vcf lines with MPA fields and the MPA fields
+    """
+    return list(raw.score_lines(_scorer, lines, len(lines)))
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def score_lines(lines, header, engine="vcfpy", no_refseq_version=True,
+                threads=2, batch_size=1000, max_batches=None,
+                lazy_samples=False):
+    """
+    @summary: Score vcf lines on a pool of processes, results are returned in \
+        the input order
+    @param lines: [iterable] The raw vcf lines
+    @param header: [vcfpy.Header] The header of the vcf (with MPA fields)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param threads: [int] The number of worker processes
+    @param batch_size: [int] The number of lines sent at once to a worker
+    @param max_batches: [int] The maximum number of batches in flight (bound \
+        the memory used), default to twice the number of workers
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    @return: [generator] The vcf lines with MPA fields and the MPA fields
+    """
+    for scored in score_batches(
+        raw.batched(lines, batch_size),
+        header,
+        engine,
+        no_refseq_version,
+        threads,
+        max_batches,
+        lazy_samples
+    ):
+        yield from scored
+
+
+def score_batches(batches, header, engine="vcfpy", no_refseq_version=True,
+                  threads=2, max_batches=None, lazy_samples=False):
+    """
+    @summary: Score batches of vcf lines on a pool of processes, the results \
+        of each batch are returned in the input order
+    @param batches: [iterable] The batches of raw vcf lines (list), each \
+        batch is sent at once to a worker
+    @param header: [vcfpy.Header] The header of the vcf (with MPA fields)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param threads: [int] The number of worker processes
+    @param max_batches: [int] The maximum number of batches in flight (bound \
+        the memory used), default to twice the number of workers
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    @return: [generator] The vcf lines with MPA fields and the MPA fields \
+        of each batch (list)
+    """
+    max_batches = max_batches or 2 * threads
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=threads,
+        initializer=_init_worker,
+        initargs=(
+            raw.header_text(header),
+            engine,
+            no_refseq_version,
+            mobidic_mpa.log.name,
+            mobidic_mpa.log.level,
+            lazy_samples
+        )
+    )
+    pending = collections.deque()
+    try:
+        for batch in batches:
+            pending.append(executor.submit(_score_batch, batch))
+            # Wait for the oldest batch when too many batches are in flight
+            if len(pending) >= max_batches:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import queue
+import threading
+
+from mobidic_mpa import raw
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Default number of batches waiting between two stages (bound the memory)
+DEPTH = 4
+
+# Size of the text written at once by the writer thread (characters)
+BUFFER_SIZE = 1 << 20
+
+# Seconds between two checks of the stop of the pipeline
+POLL_INTERVAL = 0.1
+
+# End of the batches of a stage
+_END = object()
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class _Failure(object):
+    """
+    @summary: Error raised in a stage thread, raised again by the main thread
+    """
+    def __init__(self, error):
+        """
+        @param error: [BaseException] The error (SystemExit included)
+        """
+        self.error = error
+
+
+class QueuedWriter(object):
+    """
+    @summary: Text stream writing in a separate thread. Writes are buffered \
+        and sent by chunks to the thread through a bounded queue: the main \
+        thread only waits when DEPTH chunks are not written yet. Compression \
+        (zlib) and system writes release the GIL and overlap with scoring.
+    """
+    def __init__(self, stream, depth=DEPTH, buffer_size=BUFFER_SIZE,
+                 metrics=None):
+        """
+        @param stream: [file] The text stream of the output
+        @param depth: [int] The number of chunks waiting to be written
+        @param buffer_size: [int] The size of a chunk (characters)
+        @param metrics: [Metrics] Time the waits of the main thread in the \
+            "write" stage
+        """
+        self._stream = stream
+        self._chunks = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._failure = None
+        self._buffer = []
+        self._size = 0
+        self._buffer_size = buffer_size
+        if metrics is not None:
+            # Metrics are only updated by the main thread
+            self._send = metrics.timed_function("write", self._send)
+        self.closed = False
+        self._thread = threading.Thread(
+            target=self._write_chunks, name="mpa-writer", daemon=True)
+        self._thread.start()
+
+    def _write_chunks(self):
+        """
+        @summary: Write the chunks of the queue (writer thread)
+        """
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is _END:
+                    return
+                self._stream.write(chunk)
+        except BaseException as e:
+            self._failure = _Failure(e)
+            self._stop.set()
+
+    def _send(self, chunk):
+        """
+        @summary: Send a chunk to the writer thread
+        @param chunk: [object] The text (or _END)
+        """
+        if not put(self._chunks, chunk, self._stop):
+            raise self._failure.error
+
+    def write(self, text):
+        """
+        @summary: Buffer text, a chunk is sent when the buffer is full
+        @param text: [str] The text
+        @return: [int] The number of characters written
+        """
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self._buffer_size:
+            self._flush()
+        return len(text)
+
+    def _flush(self):
+        """
+        @summary: Send the buffered text to the writer thread
+        """
+        if self._buffer:
+            self._send("".join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+    def close(self):
+        """
+        @summary: Write the remaining text and close the stream
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._flush()
+            self._send(_END)
+            self._thread.join()
+            if self._failure is not None:
+                raise self._failure.error
+        finally:
+            self._stop.set()
+            self._stream.close()
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def put(batches, batch, stop):
+    """
+    @summary: Put a batch in a bounded queue, waiting for a free place until \
+        the pipeline is stopped
+    @param batches: [queue.Queue] The queue
+    @param batch: [object] The batch
+    @param stop: [threading.Event] The stop of the pipeline
+    @return: [bool] True if the batch is queued, False if stopped
+    """
+    while not stop.is_set():
+        try:
+            batches.put(batch, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(variants, batch_size=1000, depth=DEPTH):
+    """
+    @summary: Read variants in a separate thread, by batches sent through a \
+        bounded queue: reading (and gzip decompression, which releases the \
+        GIL) overlaps with scoring and writing, and at most depth batches \
+        are kept in memory. Errors of the reader are raised by the returned \
+        generator.
+    @param variants: [iterable] The variants (raw lines or vcfpy records)
+    @param batch_size: [int] The number of variants per batch
+    @param depth: [int] The number of batches read in advance
+    @return: [generator] The variants
+    """
+    batches = queue.Queue(depth)
+    stop = threading.Event()
+
+    def read():
+        try:
+            for batch in raw.batched(variants, batch_size):
+                if not put(batches, batch, stop):
+                    return
+            put(batches, _END, stop)
+        except BaseException as e:
+            put(batches, _Failure(e), stop)
+
+    thread = threading.Thread(target=read, name="mpa-reader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is _END:
+                break
+            if isinstance(batch, _Failure):
+                raise batch.error
+            yield from batch
+        thread.join()
+    finally:
+        # The reader stops at its next batch if the variants are not all
+        # consumed
+        stop.set()
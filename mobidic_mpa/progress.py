@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import stat
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def _input_file(stream):
+    """
+    @summary: Find the file object holding the position in the input file \
+        (the compressed file for gzip/bgzip vcf)
+    @param stream: [file] The text stream of the vcf
+    @return: [file] The binary file object (None if unknown)
+    """
+    buffer = getattr(stream, "buffer", None)
+    # gzip.GzipFile keeps the compressed file object in "fileobj"
+    return getattr(buffer, "fileobj", buffer)
+
+
+def _input_size(fileobj):
+    """
+    @summary: Size of a regular input file
+    @param fileobj: [file] The binary file object
+    @return: [int] The size in bytes (None if unknown, e.g. stdin or pipe)
+    """
+    try:
+        status = os.fstat(fileobj.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(status.st_mode) or not status.st_size:
+        return None
+    return status.st_size
+
+
+def track(variants, stream, disable=False, step=1000):
+    """
+    @summary: Report progress while iterating over variants, from the bytes \
+        consumed in the input file (no extra read of the vcf). When the size \
+        of the input is unknown (stdin, pipe), the number of variants and \
+        the rate are reported.
+    @param variants: [iterable] The variants read from the stream
+    @param stream: [file] The text stream of the vcf
+    @param disable: [bool] Disable the progress bar
+    @param step: [int] The number of variants between two updates
+    @return: [generator] The variants
+    """
+    if disable:
+        yield from variants
+        return
+
+    # tqdm is slow to import, only load it when a bar is shown
+    import tqdm
+
+    fileobj = _input_file(stream)
+    total = _input_size(fileobj) if fileobj is not None else None
+    if total is None:
+        yield from tqdm.tqdm(variants, unit=" variants", miniters=step)
+        return
+
+    with tqdm.tqdm(
+        total=total, unit="B", unit_scale=True, unit_divisor=1024
+    ) as progress_bar:
+        count = 0
+        for count, variant in enumerate(variants, 1):
+            yield variant
+            if count % step == 0:
+                progress_bar.update(fileobj.tell() - progress_bar.n)
+                progress_bar.set_postfix(variants=count, refresh=False)
+        progress_bar.update(total - progress_bar.n)
+        progress_bar.set_postfix(variants=count, refresh=False)
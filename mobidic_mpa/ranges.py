@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import io
+import mmap
+import logging
+import concurrent.futures
+import pysam
+
+import mobidic_mpa
+from mobidic_mpa import raw
+from mobidic_mpa import alleles
+from mobidic_mpa import filters
+from mobidic_mpa import regions
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Number of byte ranges per worker process at least (balance the workers)
+RANGES_PER_WORKER = 4
+
+# Maximum size of a byte range (bound the temporary output of a range)
+RANGE_SIZE = 64 << 20
+
+# Size of the blocks of the mapping decoded at once by a worker
+BLOCK_SIZE = 1 << 20
+
+
+###############################################################################
+#
+# WORKER
+#
+###############################################################################
+# Mapping of the vcf, line scorer and allele splitter of the worker process
+# (built by _init_worker)
+_mapping = None
+_scorer = None
+_splitter = None
+
+
+def _init_worker(path, header, engine, no_refseq_version, logger_name,
+                 log_level, split_alleles=False, lazy_samples=False):
+    """
+    @summary: Initialize a worker process with its own mapping of the vcf \
+        (the pages are shared by all processes) and line scorer
+    @param path: [str] The path of the uncompressed vcf
+    @param header: [str] The serialized header of the vcf (with MPA fields)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param logger_name: [str] The name of the logger of the script
+    @param log_level: [int] The level of the logger of the script
+    @param split_alleles: [bool] Split multi-allelic variants
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    """
+    global _mapping, _scorer, _splitter
+    mobidic_mpa.log = logging.getLogger(logger_name)
+    mobidic_mpa.log.setLevel(log_level)
+    with open(path, "rb") as vcf:
+        _mapping = mmap.mmap(vcf.fileno(), 0, access=mmap.ACCESS_READ)
+    header = raw.read_header(io.StringIO(header))
+    _scorer = raw.line_scorer(
+        engine, header, no_refseq_version, lazy_samples)
+    _splitter = alleles.AlleleSplitter(header) if split_alleles else None
+
+
+def _score_range(byte_range, path, compress, count_ranks=False,
+                 max_rank=None, min_score=None, gene_summary=None):
+    """
+    @summary: Score all variants of a byte range of the vcf and write them \
+        to a temporary file
+    @param byte_range: [tuple] The range (start, end), aligned to lines
+    @param path: [str] The path of the temporary output
+    @param compress: [bool] Write the output as BGZF
+    @param count_ranks: [bool] Count variants per rank and impact
+    @param max_rank: [int] Only write variants with MPA_ranking <= max_rank
+    @param min_score: [float] Only write variants with MPA_final_score >= \
+        min_score
+    @param gene_summary: [tuple] Summarize the variants per gene (see \
+        regions.score_chunk)
+    @return: [tuple] See regions.score_chunk
+    """
+    lines = raw.iter_body(_range_lines(*byte_range))
+    if _splitter is not None:
+        lines = _splitter.split_lines(lines)
+    return regions.score_chunk(
+        _scorer, lines, path, compress, count_ranks, max_rank, min_score,
+        gene_summary)
+
+
+def _range_lines(start, end):
+    """
+    @summary: Read the lines of a byte range from the mapping, by blocks
+    @param start: [int] The offset of the first line
+    @param end: [int] The offset after the last line
+    @return: [generator] The raw lines
+    """
+    rest = b""
+    for position in range(start, end, BLOCK_SIZE):
+        data = rest + _mapping[position:min(position + BLOCK_SIZE, end)]
+        # Lines are decoded whole (a block may end inside a character)
+        cut = data.rfind(b"\n") + 1
+        rest = data[cut:]
+        lines = data[:cut].decode().split("\n")
+        lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if rest:
+        yield rest.decode() + "\n"
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def is_mappable(path):
+    """
+    @summary: Define if a vcf can be split in byte ranges: an uncompressed \
+        and non empty regular file
+    @param path: [str] The path of the vcf
+    @return: [bool] True if the vcf can be mapped
+    """
+    if path == "-" or raw.is_compressed(path) or not os.path.isfile(path):
+        return False
+    with open(path, "rb") as vcf:
+        magic = vcf.read(2)
+    return len(magic) > 0 and magic != b"\x1f\x8b"
+
+
+def list_ranges(path, count, range_size=RANGE_SIZE):
+    """
+    @summary: Cut the body of an uncompressed vcf in byte ranges aligned to \
+        lines, in file order
+    @param path: [str] The path of the vcf
+    @param count: [int] The number of ranges at least
+    @param range_size: [int] The maximum size of a range (in bytes)
+    @return: [list] The ranges (start, end)
+    """
+    with open(path, "rb") as vcf, \
+            mmap.mmap(vcf.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        size = len(mapping)
+        start = _body_start(mapping)
+        count = max(count, -(-(size - start) // range_size), 1)
+        bounds = [start]
+        for i in range(1, count):
+            # A range starts after the end of the line crossing its offset
+            offset = max(start + (size - start) * i // count - 1, bounds[-1])
+            end_of_line = mapping.find(b"\n", offset)
+            if end_of_line < 0 or end_of_line + 1 >= size:
+                break
+            if end_of_line + 1 > bounds[-1]:
+                bounds.append(end_of_line + 1)
+        bounds.append(size)
+    return [
+        (range_start, range_end)
+        for range_start, range_end in zip(bounds, bounds[1:])
+        if range_end > range_start
+    ]
+
+
+def _body_start(mapping):
+    """
+    @summary: Find the end of the header of a mapped vcf
+    @param mapping: [mmap] The mapping of the vcf
+    @return: [int] The offset of the first variant line
+    """
+    position = 0
+    while mapping[position:position + 1] == b"#":
+        end_of_line = mapping.find(b"\n", position)
+        if end_of_line < 0:
+            return len(mapping)
+        position = end_of_line + 1
+    return position
+
+
+def write_ranges(path, header, ranges, output, engine="vcfpy",
+                 no_refseq_version=True, threads=1, compress=None,
+                 count_ranks=False, max_rank=None, min_score=None,
+                 split_alleles=False, summary_top=None,
+                 lazy_samples=False):
+    """
+    @summary: Score each byte range of an uncompressed vcf in a separate \
+        process, reading the lines from a shared mapping of the vcf (lines \
+        are not sent to the workers), and concatenate the results in order.
+    @param path: [str] The path of the uncompressed vcf
+    @param header: [vcfpy.Header] The header of the vcf (with MPA fields)
+    @param ranges: [list] The byte ranges (see list_ranges)
+    @param output: [str] The path of the output vcf ("-" for the standard \
+        output)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param threads: [int] The number of worker processes
+    @param compress: [bool] Write BGZF (default for ".gz" and ".bgz" paths)
+    @param count_ranks: [bool] Count variants per rank and impact
+    @param max_rank: [int] Only write variants with MPA_ranking <= max_rank
+    @param min_score: [float] Only write variants with MPA_final_score >= \
+        min_score
+    @param split_alleles: [bool] Split multi-allelic variants
+    @param summary_top: [int] Summarize the variants of each range per gene \
+        with this number of top variants per gene (None to disable)
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    @return: [generator] The number of variants of each range, the number \
+        of variants per rank and impact and the summary per gene (in order, \
+        see regions.score_chunk)
+    """
+    if compress is None:
+        compress = raw.is_compressed(output)
+    header = raw.header_text(header)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=threads,
+        initializer=_init_worker,
+        initargs=(
+            path,
+            header,
+            engine,
+            no_refseq_version,
+            mobidic_mpa.log.name,
+            mobidic_mpa.log.level,
+            split_alleles,
+            lazy_samples
+        )
+    )
+    gene_token = filters.gene_key(no_refseq_version) + "="
+    yield from regions.write_chunks(
+        executor,
+        _score_range,
+        [
+            (
+                byte_range, compress, count_ranks, max_rank, min_score,
+                None if summary_top is None else (gene_token, summary_top, i)
+            )
+            for i, byte_range in enumerate(ranges)
+        ],
+        header,
+        output,
+        compress
+    )
+
+    if compress and output != "-":
+        try:
+            pysam.tabix_index(output, preset="vcf", force=True)
+        except OSError as e:
+            # The vcf may not be sorted (it has no index)
+            mobidic_mpa.log.warning(f"Cannot index {output}: {e}")
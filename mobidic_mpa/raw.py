@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import io
+import sys
+import gzip
+import itertools
+import collections
+import vcfpy
+from vcfpy import parser as vcfpy_parser
+
+import mobidic_mpa
+from mobidic_mpa import bgzf
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+# Minimal view of a vcf line (compatible with check_split_variants)
+Site = collections.namedtuple('Site', ['CHROM', 'POS', 'ID', 'REF', 'ALT'])
+
+
+class RawScorer(object):
+    """
+    @summary: Score vcf lines without parsing them with vcfpy. Only the INFO \
+        keys used by MPA are decoded and the MPA fields are appended to the \
+        original line (other columns are left untouched).
+    """
+    def __init__(self, header, no_refseq_version=True):
+        """
+        @param header: [vcfpy.Header] The header of the vcf
+        @param no_refseq_version: [bool] Annotation without refseq version
+        """
+        self.no_refseq_version = no_refseq_version
+        self.keys = mobidic_mpa.annotation_keys(no_refseq_version)
+        # (key, searched token, field info) of each annotation used by MPA
+        self._fields = [
+            (key, key + '=', header.get_info_field_info(key))
+            for key in self.keys
+        ]
+
+    def annotations(self, info):
+        """
+        @summary: Decode the annotations used by MPA from the INFO column
+        @param info: [str] The raw INFO column
+        @return: [dict] The first value of each annotation (None if empty, \
+            see mobidic_mpa.get_annotations)
+        """
+        annotations = dict()
+        for key, token, field_info in self._fields:
+            value = find_info_value(info, token)
+            if value is not None:
+                value = vcfpy_parser.parse_field_value(field_info, value)
+            if not value:
+                value = None
+            elif key not in mobidic_mpa.MULTIPLE_VALUES_KEYS:
+                value = value[0]
+            annotations[key] = value
+        return annotations
+
+    def parse_line(self, line):
+        """
+        @summary: Split one vcf line and decode the annotations used by MPA
+        @param line: [str] The raw vcf line
+        @return: [tuple] The columns of the line, the annotations (see \
+            annotations) and if the variant is an indel
+        """
+        columns = line.rstrip('\r\n').split('\t', 8)
+        site = Site(
+            columns[0],
+            columns[1],
+            columns[2],
+            columns[3],
+            [] if columns[4] == '.' else columns[4].split(',')
+        )
+        mobidic_mpa.check_split_variants(site)
+
+        return columns, self.annotations(columns[7]), (not is_snv(site))
+
+    def score_line(self, line):
+        """
+        @summary: Score one vcf line
+        @param line: [str] The raw vcf line
+        @return: [tuple] The vcf line with MPA fields and the MPA fields
+        """
+        columns, annotations, is_indel = self.parse_line(line)
+
+        mpa_fields = mobidic_mpa.score_annotations(
+            annotations,
+            is_indel,
+            self.no_refseq_version
+        )
+        columns[7] = add_info_fields(columns[7], mpa_fields)
+
+        return '\t'.join(columns) + '\n', mpa_fields
+
+
+class RecordScorer(object):
+    """
+    @summary: Score vcf lines by parsing them with vcfpy (same output as the \
+        vcfpy engine). With lazy samples, only the site columns are parsed: \
+        the FORMAT and sample columns are written as read.
+    """
+    def __init__(self, header, no_refseq_version=True, lazy_samples=False):
+        """
+        @param header: [vcfpy.Header] The header of the vcf (with MPA fields)
+        @param no_refseq_version: [bool] Annotation without refseq version
+        @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+        """
+        self.no_refseq_version = no_refseq_version
+        self.keys = mobidic_mpa.annotation_keys(no_refseq_version)
+        self._lazy_samples = lazy_samples
+        if lazy_samples:
+            # Sites are parsed and written as in a vcf without sample
+            header = header.copy()
+            header.samples = vcfpy.SamplesInfos([])
+        self._reader = vcfpy.Reader.from_stream(
+            io.StringIO(header_text(header)))
+        self._buffer = io.StringIO()
+        self._writer = vcfpy.Writer.from_stream(self._buffer, header)
+
+    def score_line(self, line):
+        """
+        @summary: Score one vcf line
+        @param line: [str] The raw vcf line
+        @return: [tuple] The vcf line with MPA fields and the MPA fields
+        """
+        line, samples = self._split_samples(line)
+        record = self._reader.parser.parse_line(line)
+        mobidic_mpa.check_split_variants(record)
+
+        mpa_fields = mobidic_mpa.score_annotations(
+            mobidic_mpa.get_annotations(record.INFO, self.keys),
+            (not record.is_snv()),
+            self.no_refseq_version
+        )
+        record.INFO.update(mpa_fields)
+
+        return self._serialize(record, samples), mpa_fields
+
+    def _split_samples(self, line):
+        """
+        @summary: Split the site columns from the FORMAT and sample columns \
+            (with lazy samples)
+        @param line: [str] The raw vcf line
+        @return: [tuple] The site line and the raw FORMAT and sample \
+            columns (None if not split)
+        """
+        if not self._lazy_samples:
+            return line, None
+        columns = line.split("\t", 8)
+        if len(columns) < 9:
+            return line, None
+        samples = columns.pop()
+        if not samples.endswith("\n"):
+            samples += "\n"
+        return "\t".join(columns) + "\n", "\t" + samples
+
+    def _serialize(self, record, samples=None):
+        """
+        @summary: Serialize a record as vcfpy would write it
+        @param record: [vcfpy.Record] The record
+        @param samples: [str] The raw FORMAT and sample columns appended to \
+            the site columns (None if parsed)
+        @return: [str] The vcf line
+        """
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._writer.write_record(record)
+        if samples is None:
+            return self._buffer.getvalue()
+        return self._buffer.getvalue()[:-1] + samples
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def line_scorer(engine, header, no_refseq_version=True, lazy_samples=False):
+    """
+    @summary: Build the line scorer of an engine
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param header: [vcfpy.Header] The header of the vcf (with MPA fields)
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns \
+        with vcfpy (raw and numpy engines never parse them)
+    @return: [RawScorer/RecordScorer/ColumnScorer] The line scorer
+    """
+    if engine == "raw":
+        return RawScorer(header, no_refseq_version)
+    if engine == "numpy":
+        # numpy is an optional dependency
+        from mobidic_mpa import columnar
+        return columnar.ColumnScorer(header, no_refseq_version)
+    return RecordScorer(header, no_refseq_version, lazy_samples)
+
+
+def batched(lines, batch_size):
+    """
+    @summary: Group lines in batches
+    @param lines: [iterable] The raw vcf lines
+    @param batch_size: [int] The number of lines per batch
+    @return: [generator] The batches (list of lines)
+    """
+    lines = iter(lines)
+    while True:
+        batch = list(itertools.islice(lines, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def score_lines(scorer, lines, batch_size=1000):
+    """
+    @summary: Score vcf lines one by one (or batch by batch for scorers \
+        working on batches)
+    @param scorer: [RawScorer/RecordScorer/ColumnScorer] The line scorer
+    @param lines: [iterable] The raw vcf lines
+    @param batch_size: [int] The number of lines per batch
+    @return: [generator] The vcf lines with MPA fields and the MPA fields
+    """
+    if hasattr(scorer, "score_batch"):
+        for batch in batched(lines, batch_size):
+            yield from scorer.score_batch(batch)
+        return
+
+    for line in lines:
+        mobidic_mpa.log.debug(line)
+        try:
+            yield scorer.score_line(line)
+        except SystemExit as e:
+            raise SystemExit("{}\n{}".format(line.rstrip(), e))
+
+
+def score_batches(scorer, batches):
+    """
+    @summary: Score batches of vcf lines, batch by batch
+    @param scorer: [RawScorer/RecordScorer/ColumnScorer] The line scorer
+    @param batches: [iterable] The batches of raw vcf lines (list)
+    @return: [generator] The vcf lines with MPA fields and the MPA fields \
+        of each batch (list, empty for an empty batch)
+    """
+    for batch in batches:
+        yield list(score_lines(scorer, batch, len(batch)))
+
+
+def annotate_line(line, entries):
+    """
+    @summary: Add MPA fields already serialized to one vcf line (written as \
+        read otherwise)
+    @param line: [str] The raw vcf line
+    @param entries: [list] The "key=value" entries (see format_info_fields)
+    @return: [str] The vcf line with MPA fields
+    """
+    columns = line.rstrip('\r\n').split('\t', 8)
+    columns[7] = add_info_entries(columns[7], entries)
+    return '\t'.join(columns) + '\n'
+
+
+def open_vcf(path):
+    """
+    @summary: Open a vcf (plain text or gzipped) as a text stream
+    @param path: [str] The path of the vcf ("-" for the standard input, \
+        gzip is detected from the first bytes)
+    @return: [file] The text stream
+    """
+    if path == "-":
+        stdin = open(sys.stdin.fileno(), "rb", closefd=False)
+        if stdin.peek(2)[:2] == b"\x1f\x8b":
+            return gzip.open(stdin, "rt")
+        return io.TextIOWrapper(stdin)
+    if is_compressed(path):
+        return gzip.open(path, "rt")
+    return open(path, "rt")
+
+
+def open_output(path, compress=None, threads=1, metrics=None):
+    """
+    @summary: Open the output vcf as a text stream
+    @param path: [str] The path of the output ("-" for the standard output)
+    @param compress: [bool] Write BGZF (default for ".gz" and ".bgz" paths)
+    @param threads: [int] The number of compression threads
+    @param metrics: [Metrics] Time the writes (and compression) in the \
+        "write" stage
+    @return: [file] The text stream
+    """
+    if compress is None:
+        compress = is_compressed(path)
+    if path == "-":
+        output = open(sys.stdout.fileno(), "wb", closefd=False)
+    else:
+        output = open(path, "wb")
+    if compress:
+        output = bgzf.BgzfWriter(output, threads)
+    if metrics is not None:
+        output = metrics.timed_file("write", output)
+    return io.TextIOWrapper(output)
+
+
+def is_compressed(path):
+    """
+    @summary: Define if a path is a gzipped/bgzipped file from its extension
+    @param path: [str] The path
+    @return: [bool] True for ".gz" and ".bgz" paths
+    """
+    return path.endswith(".gz") or path.endswith(".bgz")
+
+
+def read_header(stream):
+    """
+    @summary: Read and parse the header of a vcf, the stream is left at the \
+        first variant line
+    @param stream: [file] The text stream of the vcf
+    @return: [vcfpy.Header] The header of the vcf
+    """
+    lines = []
+    for line in stream:
+        lines.append(line)
+        if line.startswith("#CHROM"):
+            break
+    return vcfpy.Reader.from_stream(io.StringIO("".join(lines))).header
+
+
+def header_text(header):
+    """
+    @summary: Serialize a vcf header as vcfpy would write it
+    @param header: [vcfpy.Header] The header of the vcf
+    @return: [str] The header lines
+    """
+    buffer = io.StringIO()
+    vcfpy.Writer.from_stream(buffer, header)
+    return buffer.getvalue()
+
+
+def iter_body(stream):
+    """
+    @summary: Iterate over variant lines of a vcf
+    @param stream: [file] The text stream of the vcf
+    @return: [generator] The raw variant lines
+    """
+    for line in stream:
+        if line.startswith("#") or not line.strip():
+            continue
+        yield line
+
+
+def find_info_value(info, token):
+    """
+    @summary: Find the raw value of one key in the INFO column without \
+        splitting the whole column
+    @param info: [str] The raw INFO column
+    @param token: [str] The key followed by "="
+    @return: [str] The raw value (None if the key is missing)
+    """
+    start = info.find(token)
+    while start != -1:
+        # Only match full keys (start of the column or after a separator)
+        if start == 0 or info[start - 1] == ';':
+            start += len(token)
+            end = info.find(';', start)
+            return info[start:] if end == -1 else info[start:end]
+        start = info.find(token, start + 1)
+    return None
+
+
+def is_snv(site):
+    """
+    @summary: Define if the variant is a SNV (same definition as vcfpy)
+    @param site: [Site] The variant
+    @return: [bool] True if all alternatives are SNV
+    """
+    return len(site.REF) == 1 and all(
+        len(alt) == 1 and alt not in ".[]" for alt in site.ALT
+    )
+
+
+def format_info_fields(mpa_fields):
+    """
+    @summary: Serialize MPA fields as vcfpy would do
+    @param mpa_fields: [OrderedDict] The MPA fields (see score_annotations)
+    @return: [list] The "key=value" entries
+    """
+    return [
+        "{}={}".format(
+            key,
+            (",".join(value) if value else ".") if isinstance(value, list)
+            else value
+        )
+        for key, value in mpa_fields.items()
+    ]
+
+
+def add_info_fields(info, mpa_fields):
+    """
+    @summary: Add MPA fields to a raw INFO column. Fields already present \
+        are replaced in place (as vcfpy would do).
+    @param info: [str] The raw INFO column
+    @param mpa_fields: [OrderedDict] The MPA fields (see score_annotations)
+    @return: [str] The INFO column with MPA fields
+    """
+    return add_info_entries(info, format_info_fields(mpa_fields))
+
+
+def add_info_entries(info, entries):
+    """
+    @summary: Add serialized MPA fields to a raw INFO column (see \
+        add_info_fields)
+    @param info: [str] The raw INFO column
+    @param entries: [list] The "key=value" entries (see format_info_fields)
+    @return: [str] The INFO column with MPA fields
+    """
+    if info == ".":
+        return ";".join(entries)
+    if "MPA_" not in info:
+        return info + ";" + ";".join(entries)
+
+    pending = collections.OrderedDict(
+        (entry.split("=", 1)[0], entry) for entry in entries
+    )
+    result = []
+    for entry in info.split(";"):
+        key = entry.split("=", 1)[0]
+        result.append(pending.pop(key) if key in pending else entry)
+    result.extend(pending.values())
+    return ";".join(result)
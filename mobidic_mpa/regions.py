@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import io
+import sys
+import shutil
+import logging
+import tempfile
+import collections
+import concurrent.futures
+import pysam
+
+import mobidic_mpa
+from mobidic_mpa import raw
+from mobidic_mpa import bgzf
+from mobidic_mpa import alleles
+from mobidic_mpa import filters
+from mobidic_mpa import summary
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Size of the buffer written at once in region outputs
+BUFFER_SIZE = 1 << 16
+
+
+###############################################################################
+#
+# WORKER
+#
+###############################################################################
+# Tabix file, line scorer and allele splitter of the worker process (built by
+# _init_worker)
+_tabix = None
+_scorer = None
+_splitter = None
+
+
+def _init_worker(path, index, header, engine, no_refseq_version, logger_name,
+                 log_level, split_alleles=False, lazy_samples=False):
+    """
+    @summary: Initialize a worker process with its own tabix file and line \
+        scorer
+    @param path: [str] The path of the bgzipped vcf
+    @param index: [str] The path of the tabix/csi index
+    @param header: [str] The serialized header of the vcf (with MPA fields)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param logger_name: [str] The name of the logger of the script
+    @param log_level: [int] The level of the logger of the script
+    @param split_alleles: [bool] Split multi-allelic variants
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    """
+    global _tabix, _scorer, _splitter
+    mobidic_mpa.log = logging.getLogger(logger_name)
+    mobidic_mpa.log.setLevel(log_level)
+    _tabix = pysam.TabixFile(path, index=index)
+    header = raw.read_header(io.StringIO(header))
+    _scorer = raw.line_scorer(
+        engine, header, no_refseq_version, lazy_samples)
+    _splitter = alleles.AlleleSplitter(header) if split_alleles else None
+
+
+def _score_region(region, path, compress, count_ranks=False, max_rank=None,
+                  min_score=None, gene_summary=None):
+    """
+    @summary: Score all variants starting in a region and write them to a \
+        temporary file
+    @param region: [tuple] The region (contig, 0-based start, end), start \
+        and end are None for the whole contig
+    @param path: [str] The path of the temporary output
+    @param compress: [bool] Write the output as BGZF
+    @param count_ranks: [bool] Count variants per rank and impact
+    @param max_rank: [int] Only write variants with MPA_ranking <= max_rank
+    @param min_score: [float] Only write variants with MPA_final_score >= \
+        min_score
+    @param gene_summary: [tuple] Summarize the variants per gene: the gene \
+        INFO token, the number of top variants per gene and the position of \
+        the region in the vcf (None to disable)
+    @return: [tuple] See score_chunk
+    """
+    contig, start, end = region
+    lines = _starting_in(_tabix.fetch(contig, start, end), start)
+    if _splitter is not None:
+        lines = _splitter.split_lines(lines)
+    return score_chunk(
+        _scorer, lines, path, compress, count_ranks, max_rank, min_score,
+        gene_summary)
+
+
+def _starting_in(lines, start):
+    """
+    @summary: Skip variants overlapping the region but starting before it \
+        (they belong to the previous window)
+    @param lines: [iterable] The raw vcf lines fetched in the region
+    @param start: [int] The 0-based start of the region (None for a contig)
+    @return: [generator] The raw vcf lines starting in the region
+    """
+    for line in lines:
+        if start is None or int(line.split("\t", 2)[1]) > start:
+            yield line
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def score_chunk(scorer, lines, path, compress, count_ranks=False,
+                max_rank=None, min_score=None, gene_summary=None):
+    """
+    @summary: Score vcf lines and write them to a temporary file (in a \
+        worker process)
+    @param scorer: [object] The line scorer (see raw.line_scorer)
+    @param lines: [iterable] The raw vcf lines
+    @param path: [str] The path of the temporary output
+    @param compress: [bool] Write the output as BGZF
+    @param count_ranks: [bool] Count variants per rank and impact
+    @param max_rank: [int] Only write variants with MPA_ranking <= max_rank
+    @param min_score: [float] Only write variants with MPA_final_score >= \
+        min_score
+    @param gene_summary: [tuple] Summarize the variants per gene: the gene \
+        INFO token, the number of top variants per gene and the position of \
+        the chunk in the vcf (None to disable)
+    @return: [tuple] The number of variants scored, the number of variants \
+        per rank and per impact (empty if not counted) and the summary per \
+        gene (None if not summarized)
+    """
+    count = 0
+    ranks = collections.Counter()
+    impacts = collections.Counter()
+    buffer = []
+    buffer_size = 0
+    scored_lines = raw.score_lines(scorer, lines)
+    chunk_summary = None
+    if gene_summary is not None:
+        gene_token, top, position = gene_summary
+        # Ties between chunks are broken by their order in the vcf
+        chunk_summary = summary.GeneSummary(top, position << 40)
+        scored_lines = summary.summarized_lines(
+            scored_lines, chunk_summary, gene_token)
+    with (pysam.BGZFile(path, "wb") if compress else open(path, "wb")) as out:
+        for line, mpa_fields in scored_lines:
+            count += 1
+            if count_ranks:
+                ranks[mpa_fields['MPA_ranking']] += 1
+                impacts.update(mpa_fields['MPA_impact'])
+            if not filters.keep(mpa_fields, max_rank, min_score):
+                continue
+            data = line.encode()
+            buffer.append(data)
+            buffer_size += len(data)
+            if buffer_size >= BUFFER_SIZE:
+                out.write(b"".join(buffer))
+                buffer = []
+                buffer_size = 0
+        if buffer:
+            out.write(b"".join(buffer))
+    return count, ranks, impacts, chunk_summary
+
+
+def find_index(path):
+    """
+    @summary: Find the tabix or csi index of a bgzipped vcf
+    @param path: [str] The path of the vcf
+    @return: [str] The path of the index (None if not indexed)
+    """
+    if not raw.is_compressed(path):
+        return None
+    for extension in (".tbi", ".csi"):
+        if os.path.exists(path + extension):
+            return path + extension
+    return None
+
+
+def list_regions(path, index, header, split_by="contig", window_size=None):
+    """
+    @summary: Split an indexed vcf in regions, in coordinate order
+    @param path: [str] The path of the bgzipped vcf
+    @param index: [str] The path of the tabix/csi index
+    @param header: [vcfpy.Header] The header of the vcf
+    @param split_by: [str] Split by "contig" or by fixed size "window"
+    @param window_size: [int] The size of windows (in bp)
+    @return: [list] The regions (contig, 0-based start, end)
+    """
+    lengths = dict()
+    for line in header.get_lines("contig"):
+        if "length" in line.mapping:
+            lengths[line.mapping["ID"]] = int(line.mapping["length"])
+
+    regions = []
+    with pysam.TabixFile(path, index=index) as tabix:
+        for contig in tabix.contigs:
+            # Contigs without length in the header are not split
+            if split_by != "window" or contig not in lengths:
+                regions.append((contig, None, None))
+                continue
+            for start in range(0, lengths[contig], window_size):
+                regions.append((contig, start, start + window_size))
+    return regions
+
+
+def write_regions(path, index, header, regions, output, engine="vcfpy",
+                  no_refseq_version=True, threads=1, compress=None,
+                  count_ranks=False, max_rank=None, min_score=None,
+                  split_alleles=False, summary_top=None,
+                  lazy_samples=False):
+    """
+    @summary: Score each region of an indexed vcf in a separate process and \
+        concatenate the results in coordinate order. A bgzipped output file \
+        is indexed.
+    @param path: [str] The path of the bgzipped vcf
+    @param index: [str] The path of the tabix/csi index
+    @param header: [vcfpy.Header] The header of the vcf (with MPA fields)
+    @param regions: [list] The regions (see list_regions)
+    @param output: [str] The path of the output vcf ("-" for the standard \
+        output)
+    @param engine: [str] The engine name ("vcfpy", "raw" or "numpy")
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @param threads: [int] The number of worker processes
+    @param compress: [bool] Write BGZF (default for ".gz" and ".bgz" paths)
+    @param count_ranks: [bool] Count variants per rank and impact
+    @param max_rank: [int] Only write variants with MPA_ranking <= max_rank
+    @param min_score: [float] Only write variants with MPA_final_score >= \
+        min_score
+    @param split_alleles: [bool] Split multi-allelic variants
+    @param summary_top: [int] Summarize the variants of each region per \
+        gene with this number of top variants per gene (None to disable)
+    @param lazy_samples: [bool] Do not parse the FORMAT and sample columns
+    @return: [generator] The number of variants of each region, the number \
+        of variants per rank and impact and the summary per gene (in order, \
+        see _score_region)
+    """
+    if compress is None:
+        compress = raw.is_compressed(output)
+    header = raw.header_text(header)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=threads,
+        initializer=_init_worker,
+        initargs=(
+            path,
+            index,
+            header,
+            engine,
+            no_refseq_version,
+            mobidic_mpa.log.name,
+            mobidic_mpa.log.level,
+            split_alleles,
+            lazy_samples
+        )
+    )
+    gene_token = filters.gene_key(no_refseq_version) + "="
+    yield from write_chunks(
+        executor,
+        _score_region,
+        [
+            (
+                region, compress, count_ranks, max_rank, min_score,
+                None if summary_top is None else (gene_token, summary_top, i)
+            )
+            for i, region in enumerate(regions)
+        ],
+        header,
+        output,
+        compress
+    )
+
+    if compress and output != "-":
+        pysam.tabix_index(
+            output,
+            preset="vcf",
+            force=True,
+            csi=index.endswith(".csi")
+        )
+
+
+def write_chunks(executor, task, arguments, header, output, compress):
+    """
+    @summary: Score chunks of a vcf in worker processes, each in a temporary \
+        file, and concatenate them in order after the header as soon as \
+        they are done. The executor is shut down at the end.
+    @param executor: [ProcessPoolExecutor] The worker processes
+    @param task: [function] Score a chunk: task(chunk, path, *arguments) \
+        writes the chunk in path (see score_chunk)
+    @param arguments: [list] The arguments of each chunk (the chunk first)
+    @param header: [str] The serialized header of the vcf (with MPA fields)
+    @param output: [str] The path of the output vcf ("-" for the standard \
+        output)
+    @param compress: [bool] Write BGZF
+    @return: [generator] The result of each chunk (in order)
+    """
+    if output == "-":
+        tmp_dir = tempfile.mkdtemp(prefix=".mpa-")
+    else:
+        tmp_dir = tempfile.mkdtemp(
+            prefix=".mpa-", dir=os.path.dirname(os.path.abspath(output)))
+    futures = [
+        (
+            executor.submit(task, chunk_arguments[0], chunk,
+                            *chunk_arguments[1:]),
+            chunk
+        )
+        for chunk_arguments, chunk in (
+            (chunk_arguments, os.path.join(tmp_dir, f"{i}.vcf"))
+            for i, chunk_arguments in enumerate(arguments)
+        )
+    ]
+    try:
+        with (
+            open(sys.stdout.fileno(), "wb", closefd=False) if output == "-"
+            else open(output, "wb")
+        ) as out:
+            if compress:
+                with pysam.BGZFile(os.path.join(tmp_dir, "header"), "wb") as h:
+                    h.write(header.encode())
+                _append_chunk(out, os.path.join(tmp_dir, "header"), True)
+            else:
+                out.write(header.encode())
+
+            # Chunks are appended as soon as they are done (in order)
+            for future, chunk in futures:
+                yield future.result()
+                _append_chunk(out, chunk, compress)
+                os.remove(chunk)
+
+            if compress:
+                out.write(bgzf.EOF)
+    finally:
+        for future, chunk in futures:
+            future.cancel()
+        executor.shutdown()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _append_chunk(out, chunk, compress):
+    """
+    @summary: Append a region output to the final output (BGZF blocks are \
+        copied as is, without the end of file marker)
+    @param out: [file] The final output (binary)
+    @param chunk: [str] The path of the region output
+    @param compress: [bool] The region output is BGZF
+    """
+    size = os.path.getsize(chunk)
+    with open(chunk, "rb") as f:
+        if compress and size >= len(bgzf.EOF):
+            f.seek(size - len(bgzf.EOF))
+            if f.read() == bgzf.EOF:
+                size -= len(bgzf.EOF)
+            f.seek(0)
+        while size > 0:
+            data = f.read(min(size, BUFFER_SIZE))
+            if not data:
+                break
+            out.write(data)
+            size -= len(data)
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import io
+import os
+import sys
+import json
+import stat
+import time
+import signal
+import socket
+import threading
+import collections
+import socketserver
+import http.server
+
+import mobidic_mpa
+from mobidic_mpa import raw
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Default host of a TCP address given as a port only (local access only)
+HOST = "127.0.0.1"
+
+# Maximum size of a request body (bytes)
+MAX_BODY = 64 * 1024 * 1024
+
+# Number of latencies kept for the percentiles of the metrics
+LATENCY_WINDOW = 10000
+
+# Percentiles of the request latencies reported by the metrics
+PERCENTILES = [50, 90, 99]
+
+# Content types of a body made of vcf lines (JSON otherwise)
+VCF_TYPES = ["text/plain", "text/x-vcf", "text/vcf"]
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class RequestError(Exception):
+    """
+    @summary: Invalid request, answered with a 400 status
+    """
+
+
+class ServiceMetrics(object):
+    """
+    @summary: Requests served, variants scored, concurrency and latency of \
+        the service (updated by the threads of the requests)
+    """
+    def __init__(self, window=LATENCY_WINDOW):
+        """
+        @param window: [int] The number of latencies kept for percentiles
+        """
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.variants = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def enter(self):
+        """
+        @summary: Start a request
+        @return: [float] The start time of the request
+        """
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def exit(self, start, variants=0, error=False):
+        """
+        @summary: End a request
+        @param start: [float] The start time of the request (see enter)
+        @param variants: [int] The number of variants scored
+        @param error: [bool] True if the request failed
+        """
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.errors += int(error)
+            self.variants += variants
+            self._latencies.append(latency)
+
+    def report(self):
+        """
+        @summary: Build the report of the metrics
+        @return: [dict] The metrics (latencies in ms)
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            uptime = time.perf_counter() - self._start
+            report = collections.OrderedDict([
+                ("uptime_seconds", round(uptime, 3)),
+                ("requests", self.requests),
+                ("errors", self.errors),
+                ("variants", self.variants),
+                ("in_flight", self.in_flight),
+                ("max_in_flight", self.max_in_flight),
+                ("requests_per_second", round(self.requests / uptime, 3))
+            ])
+        latency = collections.OrderedDict()
+        if latencies:
+            latency["mean"] = round(
+                1000 * sum(latencies) / len(latencies), 3)
+            for percentile in PERCENTILES:
+                index = min(
+                    len(latencies) - 1, len(latencies) * percentile // 100)
+                latency[f"p{percentile}"] = round(1000 * latencies[index], 3)
+            latency["max"] = round(1000 * latencies[-1], 3)
+        report["latency_ms"] = latency
+        report["classification_cache"] = mobidic_mpa.classify.cache_info()
+        return report
+
+
+class Scorer(object):
+    """
+    @summary: Score variants sent to the service: vcf lines (as the raw \
+        engine) or annotations given as JSON. The scorer has no state per \
+        request and is shared by the threads of the service.
+    """
+    def __init__(self, no_refseq_version=True):
+        """
+        @param no_refseq_version: [bool] Annotation without refseq version
+        """
+        self.no_refseq_version = no_refseq_version
+        self.keys = mobidic_mpa.annotation_keys(no_refseq_version)
+        self._line_scorer = raw.RawScorer(
+            raw.read_header(io.StringIO(header_text(self.keys))),
+            no_refseq_version
+        )
+
+    def score_lines(self, lines):
+        """
+        @summary: Score vcf lines (header lines are skipped)
+        @param lines: [iterable] The vcf lines
+        @return: [list] The MPA fields of each variant (see result)
+        """
+        results = []
+        for line in raw.iter_body(lines):
+            try:
+                _, mpa_fields = self._line_scorer.score_line(line)
+            except (SystemExit, IndexError, ValueError) as e:
+                raise RequestError(f"Invalid vcf line: {e}: {line.rstrip()}")
+            results.append(result(mpa_fields))
+        return results
+
+    def score_variant(self, variant):
+        """
+        @summary: Score a variant given as JSON
+        @param variant: [dict] The annotations ("annotations", INFO key to \
+            value or list of values, missing keys are empty) and the alleles \
+            ("ref" and "alt", or "is_indel"), "id" is returned as is
+        @return: [OrderedDict] The MPA fields of the variant (see result)
+        """
+        if isinstance(variant, str):
+            results = self.score_lines([variant])
+            if len(results) != 1:
+                raise RequestError(f"Invalid vcf line: {variant}")
+            return results[0]
+        if not isinstance(variant, dict):
+            raise RequestError("A variant is a vcf line or an object")
+        values = variant.get("annotations") or {}
+        if not isinstance(values, dict):
+            raise RequestError("annotations must be an object")
+
+        annotations = dict()
+        for key in self.keys:
+            value = values.get(key)
+            if value is not None:
+                if not isinstance(value, list):
+                    value = [value]
+                # Values are read as in a vcf (numbers included)
+                value = [
+                    None if v is None or v in (".", "") else str(v)
+                    for v in value
+                ]
+            if not value:
+                value = None
+            elif key not in mobidic_mpa.MULTIPLE_VALUES_KEYS:
+                value = value[0]
+            annotations[key] = value
+
+        if "ref" in variant and "alt" in variant:
+            site = raw.Site(None, None, None, str(variant["ref"]),
+                            str(variant["alt"]).split(","))
+            try:
+                mobidic_mpa.check_split_variants(site)
+            except SystemExit as e:
+                raise RequestError(str(e))
+            is_indel = not raw.is_snv(site)
+        else:
+            is_indel = bool(variant.get("is_indel", False))
+
+        mpa_fields = result(mobidic_mpa.score_annotations(
+            annotations, is_indel, self.no_refseq_version))
+        if "id" in variant:
+            mpa_fields["id"] = variant["id"]
+            mpa_fields.move_to_end("id", last=False)
+        return mpa_fields
+
+    def score_request(self, body, content_type):
+        """
+        @summary: Score the variants of a request body
+        @param body: [bytes] The body: vcf lines, or JSON (a list of \
+            variants or {"variants": [...]}, see score_variant)
+        @param content_type: [str] The content type of the body
+        @return: [list] The MPA fields of each variant
+        """
+        try:
+            text = body.decode("utf-8")
+        except UnicodeDecodeError:
+            raise RequestError("The body is not UTF-8")
+        if content_type in VCF_TYPES:
+            return self.score_lines(text.splitlines(True))
+
+        try:
+            payload = json.loads(text)
+        except ValueError as e:
+            raise RequestError(f"Invalid JSON: {e}")
+        if isinstance(payload, dict):
+            payload = payload.get("variants")
+        if not isinstance(payload, list):
+            raise RequestError("The body must be a list of variants or "
+                               "{\"variants\": [...]}")
+        return [self.score_variant(variant) for variant in payload]
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    @summary: HTTP API of the service: POST /score, GET /metrics and \
+        GET /health (the server holds the scorer and the metrics)
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        # Headers and body are sent by two writes: on TCP, Nagle's algorithm
+        # would delay the body until the headers are acknowledged
+        self.disable_nagle_algorithm = isinstance(self.client_address, tuple)
+        super().setup()
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(
+                200, {"status": "ok", "version": mobidic_mpa.__version__})
+        elif self.path == "/metrics":
+            self._send(200, self.server.metrics.report())
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        start = self.server.metrics.enter()
+        results = []
+        status = 200
+        try:
+            length = content_length(self.headers.get("Content-Length"))
+            if length > MAX_BODY:
+                status = 413
+                response = {"error": f"Body larger than {MAX_BODY} bytes"}
+                self.close_connection = True
+            else:
+                content_type = (self.headers.get("Content-Type") or "").split(
+                    ";")[0].strip()
+                results = self.server.scorer.score_request(
+                    self.rfile.read(length), content_type)
+                response = {"results": results}
+        except RequestError as e:
+            status = 400
+            response = {"error": str(e)}
+            # The body may not be read (e.g. invalid length)
+            self.close_connection = True
+        except Exception as e:
+            mobidic_mpa.log.exception("Cannot score the request")
+            status = 500
+            response = {"error": str(e)}
+        finally:
+            self.server.metrics.exit(start, len(results), status != 200)
+        self._send(status, response)
+
+    def _send(self, status, response):
+        """
+        @summary: Send a JSON response
+        @param status: [int] The HTTP status
+        @param response: [dict] The response
+        """
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        mobidic_mpa.log.debug(
+            "%s - %s", self.address_string(), format % args)
+
+
+class TCPServer(http.server.ThreadingHTTPServer):
+    """
+    @summary: HTTP service on a TCP address, one thread per request
+    """
+    daemon_threads = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    @summary: HTTP service on a Unix socket, one thread per request
+    """
+    daemon_threads = True
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def header_text(keys):
+    """
+    @summary: Build the header of the vcf lines sent to the service (INFO \
+        keys declared as ANNOVAR does)
+    @param keys: [list] The INFO keys read by MPA (see annotation_keys)
+    @return: [str] The header lines
+    """
+    lines = ["##fileformat=VCFv4.2"]
+    for key in keys:
+        lines.append(
+            f'##INFO=<ID={key},Number=.,Type=String,Description="{key}">')
+    lines.append("\t".join(
+        ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]))
+    return "\n".join(lines) + "\n"
+
+
+def result(mpa_fields):
+    """
+    @summary: Type the MPA fields of a variant for a JSON response
+    @param mpa_fields: [OrderedDict] The MPA fields (see score_annotations)
+    @return: [OrderedDict] MPA_ranking, MPA_final_score and MPA_impact first, \
+        then MPA_adjusted, MPA_available and MPA_deleterious
+    """
+    return collections.OrderedDict([
+        ("MPA_ranking", mpa_fields["MPA_ranking"]),
+        ("MPA_final_score", float(mpa_fields["MPA_final_score"])),
+        ("MPA_impact", list(mpa_fields["MPA_impact"])),
+        ("MPA_adjusted", float(mpa_fields["MPA_adjusted"])),
+        ("MPA_available", int(mpa_fields["MPA_available"])),
+        ("MPA_deleterious", int(mpa_fields["MPA_deleterious"]))
+    ])
+
+
+def content_length(value):
+    """
+    @summary: Parse the Content-Length header of a request
+    @param value: [str] The header (None if missing)
+    @return: [int] The length of the body (0 if missing)
+    @raise RequestError: If the length is not a positive integer
+    """
+    try:
+        length = int(value or 0)
+    except ValueError:
+        raise RequestError(f"Invalid Content-Length {value}")
+    if length < 0:
+        raise RequestError(f"Invalid Content-Length {value}")
+    return length
+
+
+def parse_address(address):
+    """
+    @summary: Parse the address of the service
+    @param address: [str] A Unix socket path (with a "/" or ending with \
+        ".sock"), or a TCP port, optionally preceded by a host ("host:port")
+    @return: [tuple] ("unix", path) or ("tcp", (host, port))
+    """
+    if "/" in address or address.endswith(".sock"):
+        return "unix", address
+    host, _, port = address.rpartition(":")
+    try:
+        return "tcp", (host or HOST, int(port))
+    except ValueError:
+        sys.exit(f"Invalid address {address} (use a port, host:port or a "
+                 "Unix socket path)")
+
+
+def remove_stale_socket(address, path):
+    """
+    @summary: Remove a socket left by a previous service (other files and \
+        sockets of a running service are kept)
+    @param address: [str] The address of the service
+    @param path: [str] The path of the Unix socket
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        sys.exit(f"Cannot listen on {address}: not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(path)
+        except OSError:
+            # Nothing listens on the socket any more
+            os.remove(path)
+            return
+    sys.exit(f"Cannot listen on {address}: a service is already running")
+
+
+def create_server(address, no_refseq_version=True):
+    """
+    @summary: Create the service (not started)
+    @param address: [str] The address of the service (see parse_address)
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [TCPServer/UnixServer] The server, with its scorer and metrics
+    """
+    family, location = parse_address(address)
+    try:
+        if family == "unix":
+            remove_stale_socket(address, location)
+            server = UnixServer(location, RequestHandler)
+        else:
+            server = TCPServer(location, RequestHandler)
+    except OSError as e:
+        sys.exit(f"Cannot listen on {address}: {e}")
+    server.scorer = Scorer(no_refseq_version)
+    server.metrics = ServiceMetrics()
+    return server
+
+
+def serve(address, no_refseq_version=True):
+    """
+    @summary: Serve MPA scores until interrupted (SIGINT or SIGTERM). The \
+        scorer stays loaded between requests.
+    @param address: [str] The address of the service (see parse_address)
+    @param no_refseq_version: [bool] Annotation without refseq version
+    @return: [dict] The metrics of the service (see ServiceMetrics.report)
+    """
+    server = create_server(address, no_refseq_version)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    mobidic_mpa.log.info(f"Serve MPA scores on {address}")
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, UnixServer):
+            os.remove(server.server_address)
+    return server.metrics.report()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import heapq
+import shutil
+import tempfile
+
+from mobidic_mpa import filters
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Default memory used to sort lines (bytes)
+SORT_MEMORY = 256 * 1024 * 1024
+
+# Memory of the python objects of a line kept in memory (key and tuple),
+# added to the size of the line
+ENTRY_OVERHEAD = 200
+
+# Maximum number of sorted runs merged at once (bound the open files)
+MAX_MERGE = 64
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def sort_lines(scored, max_memory=SORT_MEMORY, tmp_dir=None):
+    """
+    @summary: Sort vcf lines by MPA_ranking, then by decreasing \
+        MPA_final_score, then in the input order. Lines are sorted in memory \
+        up to max_memory, larger inputs are spilled in sorted runs to \
+        temporary files and merged.
+    @param scored: [iterable] The vcf lines with MPA fields and the MPA fields
+    @param max_memory: [int] The memory used to sort lines (bytes)
+    @param tmp_dir: [str] The directory of temporary files (default to the \
+        system temporary directory)
+    @return: [generator] The sorted vcf lines
+    """
+    work_dir = tempfile.mkdtemp(prefix=".mpa-sort-", dir=tmp_dir)
+    try:
+        runs = []
+        entries = []
+        size = 0
+        for index, (line, mpa_fields) in enumerate(scored):
+            entries.append((
+                mpa_fields['MPA_ranking'],
+                -filters.final_score(mpa_fields),
+                index,
+                line
+            ))
+            size += len(line) + ENTRY_OVERHEAD
+            if size >= max_memory:
+                runs.append(_write_run(entries, work_dir, len(runs)))
+                entries = []
+                size = 0
+
+        # Small inputs are sorted in memory only
+        if not runs:
+            entries.sort()
+            for entry in entries:
+                yield entry[3]
+            return
+        if entries:
+            runs.append(_write_run(entries, work_dir, len(runs)))
+        entries = None
+
+        count = len(runs)
+        while len(runs) > MAX_MERGE:
+            merged = os.path.join(work_dir, f"{count}.run")
+            count += 1
+            with open(merged, "w") as out:
+                for entry in _merge(runs[:MAX_MERGE]):
+                    out.write(_format_entry(entry))
+            for run in runs[:MAX_MERGE]:
+                os.remove(run)
+            runs = runs[MAX_MERGE:] + [merged]
+
+        for entry in _merge(runs):
+            yield entry[3]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _write_run(entries, work_dir, number):
+    """
+    @summary: Sort entries and write them in a temporary file
+    @param entries: [list] The entries (rank, negative score, index, line)
+    @param work_dir: [str] The directory of temporary files
+    @param number: [int] The number of the run
+    @return: [str] The path of the run
+    """
+    entries.sort()
+    path = os.path.join(work_dir, f"{number}.run")
+    with open(path, "w") as out:
+        out.writelines(_format_entry(entry) for entry in entries)
+    return path
+
+
+def _format_entry(entry):
+    """
+    @summary: Serialize an entry of a run
+    @param entry: [tuple] The entry (rank, negative score, index, line)
+    @return: [str] The serialized entry
+    """
+    rank, score, index, line = entry
+    return f"{rank}\t{score!r}\t{index}\t{line}"
+
+
+def _read_run(path):
+    """
+    @summary: Read the entries of a run
+    @param path: [str] The path of the run
+    @return: [generator] The entries (rank, negative score, index, line)
+    """
+    with open(path) as run:
+        for text in run:
+            rank, score, index, line = text.split("\t", 3)
+            yield int(rank), float(score), int(index), line
+
+
+def _merge(runs):
+    """
+    @summary: Merge sorted runs
+    @param runs: [list] The paths of the runs
+    @return: [generator] The sorted entries
+    """
+    return heapq.merge(*[_read_run(run) for run in runs])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import collections
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# SpliceAI delta scores (acceptor gain/loss, donor gain/loss)
+SPLICEAI_KEYS = ('DS_AG', 'DS_AL', 'DS_DG', 'DS_DL')
+
+# Separators of the spliceai_filtered annotation (escaped by annovar)
+ENTRY_SEPARATOR = "\\x2c"
+FIELD_SEPARATOR = "\\x3b"
+VALUE_SEPARATOR = "\\x3d"
+
+# Splicing scores of a variant (None if missing). SpliceAI delta scores are
+# the maximum over all gene entries, gene is the SYMBOL of the entry holding
+# the highest delta score.
+SpliceScores = collections.namedtuple('SpliceScores', [
+    'ada',
+    'rf',
+    'max_ds',
+    'ds_ag',
+    'ds_al',
+    'ds_dg',
+    'ds_dl',
+    'gene'
+])
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def decode_score(value):
+    """
+    @summary: Decode a numeric annotation
+    @param value: [str/float] The annotation (None if empty)
+    @return: [float] The score (None if missing or not a number)
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _entries(spliceai):
+    """
+    @summary: Split the spliceai_filtered annotation in gene entries
+    @param spliceai: [str/list] The annotation, or all its values
+    @return: [generator] The fields (dict) of each gene entry
+    """
+    values = [spliceai] if isinstance(spliceai, str) else spliceai
+    for value in values:
+        if not value:
+            continue
+        for entry in value.split(ENTRY_SEPARATOR):
+            fields = dict()
+            for field in entry.split(FIELD_SEPARATOR):
+                key, separator, field_value = field.partition(VALUE_SEPARATOR)
+                if not separator:
+                    continue
+                # A repeated key starts the entry of another gene
+                if key in fields:
+                    yield fields
+                    fields = dict()
+                fields[key] = field_value
+            if fields:
+                yield fields
+
+
+def decode(ada, rf, spliceai):
+    """
+    @summary: Decode the splicing annotations of a variant in one pass
+    @param ada: [str] The dbscSNV_ADA_SCORE annotation (None if empty)
+    @param rf: [str] The dbscSNV_RF_SCORE annotation (None if empty)
+    @param spliceai: [str/list] The spliceai_filtered annotation, or all its \
+        values (None if empty)
+    @return: [SpliceScores] The splicing scores
+    """
+    delta_scores = [None] * len(SPLICEAI_KEYS)
+    max_ds = None
+    gene = None
+    if spliceai is not None:
+        for fields in _entries(spliceai):
+            entry_max = None
+            for i, key in enumerate(SPLICEAI_KEYS):
+                score = decode_score(fields.get(key))
+                if score is None:
+                    continue
+                if delta_scores[i] is None or score > delta_scores[i]:
+                    delta_scores[i] = score
+                if entry_max is None or score > entry_max:
+                    entry_max = score
+            if entry_max is None:
+                continue
+            if max_ds is None or entry_max > max_ds:
+                max_ds = entry_max
+                gene = fields.get("SYMBOL")
+
+    return SpliceScores(
+        decode_score(ada),
+        decode_score(rf),
+        max_ds,
+        *delta_scores,
+        gene
+    )
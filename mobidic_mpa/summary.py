@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import re
+import gzip
+import json
+import heapq
+import collections
+
+from mobidic_mpa import raw
+from mobidic_mpa import filters
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Default number of top variants kept per gene
+TOP = 3
+
+# Separators of the genes of a variant (ANNOVAR escapes ";" as "\x3b")
+GENE_SEPARATOR = re.compile(r"\\x3b|[;,]")
+
+# Columns of the TSV summary
+COLUMNS = [
+    "gene", "variants", "best_ranking", "max_final_score", "impacts",
+    "top_variants"
+]
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class GeneStats(object):
+    """
+    @summary: Aggregates of the variants of one gene, in constant memory \
+        (the impact classes are bounded and only the top variants are kept)
+    """
+    __slots__ = ["variants", "best_ranking", "max_final_score", "impacts",
+                 "_top"]
+
+    def __init__(self):
+        self.variants = 0
+        self.best_ranking = None
+        self.max_final_score = None
+        self.impacts = collections.Counter()
+        # Bounded heap of the top variants (the root is the worst one)
+        self._top = []
+
+    def add(self, variant_id, mpa_fields, order, top):
+        """
+        @summary: Add a variant to the gene
+        @param variant_id: [str] The identifier of the variant
+        @param mpa_fields: [OrderedDict] The MPA fields (see \
+            score_annotations)
+        @param order: [int] The position of the variant in the vcf
+        @param top: [int] The number of top variants kept
+        """
+        rank = mpa_fields['MPA_ranking']
+        score = filters.final_score(mpa_fields)
+        self.variants += 1
+        if self.best_ranking is None or rank < self.best_ranking:
+            self.best_ranking = rank
+        if self.max_final_score is None or score > self.max_final_score:
+            self.max_final_score = score
+        self.impacts.update(mpa_fields['MPA_impact'])
+        entry = (-rank, score, -order, variant_id)
+        if len(self._top) < top:
+            heapq.heappush(self._top, entry)
+        elif entry > self._top[0]:
+            heapq.heapreplace(self._top, entry)
+
+    def update(self, other, top):
+        """
+        @summary: Merge the aggregates of the same gene (e.g. of another \
+            region)
+        @param other: [GeneStats] The aggregates to merge
+        @param top: [int] The number of top variants kept
+        """
+        self.variants += other.variants
+        if self.best_ranking is None or (
+            other.best_ranking is not None and
+            other.best_ranking < self.best_ranking
+        ):
+            self.best_ranking = other.best_ranking
+        if self.max_final_score is None or (
+            other.max_final_score is not None and
+            other.max_final_score > self.max_final_score
+        ):
+            self.max_final_score = other.max_final_score
+        self.impacts.update(other.impacts)
+        self._top = heapq.nlargest(top, self._top + other._top)
+        heapq.heapify(self._top)
+
+    def top_variants(self):
+        """
+        @summary: The top variants of the gene (lowest MPA_ranking, then \
+            highest MPA_final_score, then first in the vcf)
+        @return: [list] The identifiers of the variants, best first
+        """
+        return [entry[3] for entry in sorted(self._top, reverse=True)]
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class GeneSummary(object):
+    """
+    @summary: Per-gene summary of the scored variants, built while the vcf \
+        is streamed: best MPA_ranking, max MPA_final_score, number of \
+        variants per MPA_impact and the top variants of each gene.
+    """
+    def __init__(self, top=TOP, offset=0):
+        """
+        @param top: [int] The number of top variants kept per gene
+        @param offset: [int] The position of the first variant added (keeps \
+            the vcf order of the summaries of regions)
+        """
+        self.top = top
+        self.genes = dict()
+        self._count = offset
+
+    def add(self, genes, variant_id, mpa_fields):
+        """
+        @summary: Add a scored variant to its genes
+        @param genes: [str] The raw gene annotation (several genes are \
+            separated by ";" or ",")
+        @param variant_id: [str] The identifier of the variant
+        @param mpa_fields: [OrderedDict] The MPA fields (see \
+            score_annotations)
+        """
+        for gene in gene_names(genes):
+            stats = self.genes.get(gene)
+            if stats is None:
+                stats = self.genes[gene] = GeneStats()
+            stats.add(variant_id, mpa_fields, self._count, self.top)
+        self._count += 1
+
+    def update(self, other):
+        """
+        @summary: Merge another summary (e.g. of a region)
+        @param other: [GeneSummary] The summary to merge
+        """
+        for gene, other_stats in other.genes.items():
+            stats = self.genes.get(gene)
+            if stats is None:
+                self.genes[gene] = other_stats
+            else:
+                stats.update(other_stats, self.top)
+
+    def rows(self):
+        """
+        @summary: The summary of each gene (sorted by gene)
+        @return: [generator] The summary of each gene (see COLUMNS)
+        """
+        for gene in sorted(self.genes):
+            stats = self.genes[gene]
+            yield collections.OrderedDict([
+                ("gene", gene),
+                ("variants", stats.variants),
+                ("best_ranking", stats.best_ranking),
+                ("max_final_score", _number(stats.max_final_score)),
+                ("impacts", collections.OrderedDict(
+                    sorted(stats.impacts.items()))),
+                ("top_variants", stats.top_variants())
+            ])
+
+    def write(self, path):
+        """
+        @summary: Write the summary as JSON (".json" paths) or TSV (gzipped \
+            for ".gz" paths)
+        @param path: [str] The path of the summary
+        """
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "wt") as output:
+            if path.endswith(".json") or path.endswith(".json.gz"):
+                json.dump(list(self.rows()), output, indent=1)
+                output.write("\n")
+                return
+            output.write("\t".join(COLUMNS) + "\n")
+            for row in self.rows():
+                row["impacts"] = ",".join(
+                    f"{impact}:{count}"
+                    for impact, count in row["impacts"].items())
+                row["top_variants"] = ",".join(row["top_variants"])
+                output.write("\t".join(
+                    "" if value is None else str(value)
+                    for value in row.values()) + "\n")
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def _number(score):
+    """
+    @summary: Write a final score (None if no variant has a numeric score)
+    @param score: [float] The score
+    @return: [float] The score (None for -inf)
+    """
+    return None if score is None or score == float("-inf") else score
+
+
+def gene_names(genes):
+    """
+    @summary: Split the gene annotation of a variant
+    @param genes: [str] The raw gene annotation
+    @return: [list] The genes ("." if missing)
+    """
+    if not genes:
+        return ["."]
+    return [gene for gene in GENE_SEPARATOR.split(genes) if gene] or ["."]
+
+
+def variant_id(chrom, pos, variant, ref, alt):
+    """
+    @summary: Identify a variant by its ID, or by its site without ID
+    @param chrom: [str] The contig
+    @param pos: [str] The position
+    @param variant: [str] The ID column ("." if missing)
+    @param ref: [str] The reference allele
+    @param alt: [str] The alternative allele(s)
+    @return: [str] The identifier ("chrom:pos:ref>alt" without ID)
+    """
+    if variant and variant != ".":
+        return variant
+    return f"{chrom}:{pos}:{ref}>{alt}"
+
+
+def summarized_lines(scored, summary, gene_token):
+    """
+    @summary: Add scored vcf lines to a summary as they pass
+    @param scored: [iterable] The vcf lines with MPA fields and the MPA fields
+    @param summary: [GeneSummary] The summary
+    @param gene_token: [str] The INFO token of the gene ("key=")
+    @return: [generator] The vcf lines with MPA fields and the MPA fields
+    """
+    for line, mpa_fields in scored:
+        columns = line.split("\t", 8)
+        summary.add(
+            raw.find_info_value(columns[7], gene_token),
+            variant_id(*columns[:5]),
+            mpa_fields
+        )
+        yield line, mpa_fields
+
+
+def summarized_records(scored, summary, gene_of):
+    """
+    @summary: Add scored records (vcfpy or htslib) to a summary as they pass
+    @param scored: [iterable] The records with MPA fields and the MPA fields
+    @param summary: [GeneSummary] The summary
+    @param gene_of: [function] Read the gene of a record
+    @return: [generator] The records with MPA fields and the MPA fields
+    """
+    for record, mpa_fields in scored:
+        summary.add(gene_of(record), variant_id(*record_site(record)),
+                    mpa_fields)
+        yield record, mpa_fields
+
+
+def record_site(record):
+    """
+    @summary: Read the site of a record (vcfpy or htslib)
+    @param record: [vcfpy.Record/pysam.VariantRecord] The record
+    @return: [tuple] The chrom, pos, ID, ref and alt
+    """
+    if hasattr(record, "CHROM"):
+        return (
+            record.CHROM, record.POS, ";".join(record.ID), record.REF,
+            ",".join(alt.serialize() for alt in record.ALT)
+        )
+    return (
+        record.chrom, record.pos, record.id, record.ref,
+        ",".join(record.alts or [])
+    )
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2017-2022
+#
+
+###############################################################################
+#
+# IMPORT
+#
+###############################################################################
+import os
+import re
+import sys
+import gzip
+import json
+import random
+import collections
+
+import mobidic_mpa
+from mobidic_mpa import summary
+
+
+###############################################################################
+#
+# CONSTANTS
+#
+###############################################################################
+# Seed of the sampling (the same variants are traced by each run)
+SEED = 0
+
+# Region of traced variants: contig, or contig:start-end (1-based, inclusive)
+REGION = re.compile(
+    r"^(?P<contig>[^:]+)(?::(?P<start>[\d,]+)(?:-(?P<end>[\d,]+))?)?$")
+
+
+###############################################################################
+#
+# CLASS
+#
+###############################################################################
+class Tracer(object):
+    """
+    @summary: Write the scoring decision of sampled variants as JSON lines: \
+        the annotations read, the outcome of each rule, the rank and the MPA \
+        fields. Traced variants are selected by a sampling rate, regions or \
+        IDs; the other variants are not formatted.
+    """
+    def __init__(self, path, rate=None, regions=None, ids=None,
+                 no_refseq_version=True):
+        """
+        @param path: [str] The path of the trace (gzipped for ".gz" paths)
+        @param rate: [float] The fraction of variants traced at random
+        @param regions: [list] The regions of traced variants (see REGION)
+        @param ids: [list] The IDs of traced variants (or chrom:pos:ref>alt \
+            for variants without ID), or files with one ID per line
+        @param no_refseq_version: [bool] Annotation without refseq version
+        """
+        self.no_refseq_version = no_refseq_version
+        self._rate = rate or 0.0
+        self._random = random.Random(SEED).random
+        self._regions = collections.defaultdict(list)
+        for region in regions or []:
+            contig, start, end = parse_region(region)
+            self._regions[contig].append((start, end))
+        self._ids = read_ids(ids or [])
+        self._by_site = bool(self._regions or self._ids)
+        opener = gzip.open if path.endswith(".gz") else open
+        self._output = opener(path, "wt")
+        self.traced = 0
+
+    def _selected(self, site):
+        """
+        @summary: Define if a variant is traced by its region or ID
+        @param site: [tuple] The site (chrom, pos, ID, ref, alt)
+        @return: [bool] True if the variant is traced
+        """
+        chrom, pos, variant, ref, alt = site
+        if self._regions.get(chrom):
+            pos = int(pos)
+            for start, end in self._regions[chrom]:
+                if (start is None or pos >= start) and \
+                        (end is None or pos <= end):
+                    return True
+        if self._ids:
+            if variant and not self._ids.isdisjoint(variant.split(";")):
+                return True
+            return summary.variant_id(chrom, pos, ".", ref, alt) in self._ids
+        return False
+
+    def traced_variants(self, scored, site_of, annotations_of):
+        """
+        @summary: Trace the selected variants of scored variants as they pass
+        @param scored: [iterable] The variants with MPA fields and the MPA \
+            fields
+        @param site_of: [function] Read the site of a variant (chrom, pos, \
+            ID, ref, alt)
+        @param annotations_of: [function] Read the annotations of a variant \
+            and if it is an indel (see get_annotations)
+        @return: [generator] The variants with MPA fields and the MPA fields
+        """
+        for variant, mpa_fields in scored:
+            if self._rate and self._random() < self._rate:
+                self.write(site_of(variant), *annotations_of(variant),
+                           mpa_fields)
+            elif self._by_site:
+                site = site_of(variant)
+                if self._selected(site):
+                    self.write(site, *annotations_of(variant), mpa_fields)
+            yield variant, mpa_fields
+
+    def write(self, site, annotations, is_indel, mpa_fields):
+        """
+        @summary: Score a variant again, recording each decision, and write \
+            its trace
+        @param site: [tuple] The site (chrom, pos, ID, ref, alt)
+        @param annotations: [dict] The annotations (see get_annotations)
+        @param is_indel: [bool] The variant is an indel
+        @param mpa_fields: [OrderedDict] The MPA fields written for the \
+            variant
+        """
+        chrom, pos, variant, ref, alt = site
+        decision = collections.OrderedDict()
+        mobidic_mpa.score_annotations(
+            annotations, is_indel, self.no_refseq_version, decision)
+        trace = collections.OrderedDict([
+            ("chrom", chrom),
+            ("pos", int(pos)),
+            ("id", variant or "."),
+            ("ref", ref),
+            ("alt", alt),
+            ("is_indel", is_indel),
+            ("annotations", annotations)
+        ])
+        trace.update(decision)
+        trace["mpa_fields"] = mpa_fields
+        self._output.write(json.dumps(trace, default=str) + "\n")
+        self.traced += 1
+
+    def close(self):
+        """
+        @summary: Close the trace
+        """
+        self._output.close()
+
+
+###############################################################################
+#
+# FUNCTIONS
+#
+###############################################################################
+def parse_region(region):
+    """
+    @summary: Parse a region of traced variants
+    @param region: [str] The region (contig, contig:pos or contig:start-end)
+    @return: [tuple] The contig, the start and the end (1-based, None if \
+        open)
+    """
+    match = REGION.match(region)
+    if match is None:
+        sys.exit(f"Invalid trace region: {region} (expected contig or "
+                 "contig:start-end)")
+    start, end = (
+        None if value is None else int(value.replace(",", ""))
+        for value in match.group("start", "end")
+    )
+    if start is not None and end is None:
+        end = start
+    return match.group("contig"), start, end
+
+
+def read_ids(values):
+    """
+    @summary: Read the IDs of traced variants
+    @param values: [list] The IDs, or files with one ID per line
+    @return: [set] The IDs
+    """
+    ids = set()
+    for value in values:
+        if not os.path.isfile(value):
+            ids.add(value)
+            continue
+        with open(value) as id_file:
+            ids.update(line.strip() for line in id_file if line.strip())
+    return ids
+
+
+def line_site(line):
+    """
+    @summary: Read the site of a vcf line
+    @param line: [str] The raw vcf line
+    @return: [list] The chrom, pos, ID, ref and alt columns
+    """
+    return line.split("\t", 5)[:5]
+
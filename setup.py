@@ -46,6 +46,10 @@ setuptools.setup(
         'tqdm>=4.59.0',
         'pysam>=0.19.1'
     ],
+    extras_require={
+        'numpy': ['numpy>=1.17'],
+        'parquet': ['pyarrow>=1.0']
+    },
     scripts=['scripts/mpa'],
     project_urls={  # Optional
         'Bug Reports': 'https://github.com/mobidic/MPA/issues',